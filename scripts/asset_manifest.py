@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+以內容雜湊命名的題目圖片
+裁切結果 q001.jpg 每次執行都會在原地覆寫，網頁與 CDN 無法長期快取
+這裡將每張題目圖片（與 imageUrls 使用的 WebP 版本）另存為 q001.<雜湊>.jpg，
+內容不變時檔名就不變，可以加上長期快取標頭（見 firebase.json）
+
+public/images/exams/manifest.json 記錄 (年份, 題號) 對應的網址：
+{"2020": {"1": {"imageUrl": "/images/exams/2020/questions/q001.3fa2c1d4e5b6.jpg", "imageUrls": [...]}, ...}, ...}
+generate_exam_json 以 question_urls() 讀取
+
+舊的雜湊檔案不會自動刪除（已快取的網頁可能仍在引用），需要時可用 prune_year() 清除
+"""
+
+import json
+import re
+import shutil
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from build_manifest import BuildManifest, file_digest, write_json_if_changed
+from image_variants import image_urls as variant_image_urls, load_variants, preferred_variant, public_url
+
+# 設定路徑
+BASE_DIR = Path(__file__).parent.parent
+OUTPUT_DIR = BASE_DIR / "public" / "images" / "exams"
+ASSET_MANIFEST_PATH = OUTPUT_DIR / "manifest.json"
+
+# 檔名中的雜湊長度（SHA-256 的前 12 個十六進位字元）
+HASH_LENGTH = 12
+
+HASHED_NAME = re.compile(r'.+\.[0-9a-f]{%d}\.[^.]+$' % HASH_LENGTH)
+
+
+def hashed_path(path: Path, digest: str) -> Path:
+    """q001.jpg -> q001.<雜湊>.jpg"""
+    return path.with_name(f"{path.stem}.{digest[:HASH_LENGTH]}{path.suffix}")
+
+
+def is_hashed_name(name: str) -> bool:
+    """檔名是否為以內容雜湊命名的檔案"""
+    return HASHED_NAME.fullmatch(name) is not None
+
+
+def publish_file(path: Path, manifest: BuildManifest = None) -> Path:
+    """
+    將檔案另存為以內容雜湊命名的檔案（已存在時不動）
+    使用複製而不是硬連結：裁切結果會在原地覆寫，硬連結會連帶改變已發佈的檔案
+    """
+    digest = manifest.digest(path) if manifest is not None else file_digest(path)
+    target = hashed_path(path, digest)
+    if not target.exists():
+        tmp_path = target.with_suffix(target.suffix + '.tmp')
+        shutil.copyfile(path, tmp_path)
+        tmp_path.replace(target)
+    return target
+
+
+def load_asset_manifest(path: Path = ASSET_MANIFEST_PATH) -> Dict[str, Dict[str, Dict]]:
+    """讀取 manifest.json，沒有時返回空字典"""
+    if not path.exists():
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def publish_year(year: str, questions: Dict[int, Path], manifest: BuildManifest = None, path: Path = ASSET_MANIFEST_PATH) -> Dict[str, Dict]:
+    """
+    發佈一個年份的題目圖片，並以這些題目取代 manifest.json 中該年份的紀錄
+    questions: {題號: 裁切結果路徑}
+    imageUrls 有 WebP 版本（variants.json 雜湊相符）時使用 WebP，否則使用 JPEG
+    返回: 該年份的紀錄 {題號字串: {"imageUrl", "imageUrls"}}
+    """
+    variants_by_dir = {}
+    entries = {}
+
+    for qnum, image_path in sorted(questions.items()):
+        if not image_path.exists():
+            continue
+
+        image_url = public_url(publish_file(image_path, manifest))
+        image_urls = [image_url]
+
+        directory = image_path.parent
+        if directory not in variants_by_dir:
+            variants_by_dir[directory] = load_variants(directory)
+        entry = variants_by_dir[directory].get(image_path.name)
+
+        if entry is not None and entry['sha256'] == (manifest.digest(image_path) if manifest is not None else file_digest(image_path)):
+            variant = preferred_variant(entry['variants'])
+            if variant is not None:
+                variant_path = BASE_DIR / "public" / variant['url'].lstrip('/')
+                if variant_path.exists():
+                    image_urls = [public_url(publish_file(variant_path, manifest))]
+
+        entries[str(qnum)] = {"imageUrl": image_url, "imageUrls": image_urls}
+
+    assets = load_asset_manifest(path)
+    assets[str(year)] = entries
+    if write_json_if_changed(path, dict(sorted(assets.items()))):
+        print(f"  已更新圖片清單: {path}（{year} 年 {len(entries)} 題）")
+
+    return entries
+
+
+def question_urls(year: str, qnum: int, image_path: Path, assets: Optional[Dict] = None) -> Tuple[str, List[str]]:
+    """
+    題目的 (imageUrl, imageUrls)：manifest.json 有紀錄時使用以雜湊命名的網址，否則使用原本的檔名
+    assets: 已讀取的 manifest.json（省略時讀取檔案）
+    """
+    if assets is None:
+        assets = load_asset_manifest()
+
+    entry = assets.get(str(year), {}).get(str(qnum))
+    if entry is not None:
+        return entry['imageUrl'], entry['imageUrls']
+
+    return public_url(image_path), variant_image_urls(image_path)
+
+
+def prune_year(year: str, path: Path = ASSET_MANIFEST_PATH) -> int:
+    """刪除該年份 questions 目錄中不在 manifest.json 裡的雜湊檔案，返回刪除的數量"""
+    assets = load_asset_manifest(path)
+    referenced = {
+        url for entry in assets.get(str(year), {}).values()
+        for url in [entry['imageUrl']] + entry['imageUrls']
+    }
+
+    removed = 0
+    for file in (OUTPUT_DIR / str(year) / "questions").iterdir():
+        if is_hashed_name(file.name) and public_url(file) not in referenced:
+            file.unlink()
+            removed += 1
+    return removed
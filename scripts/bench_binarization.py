@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+版面分析二值化方法效能測試
+以 crop_config_2020.json 的人工題目位置為準，比較各二值化方法找到的題目起點
+準確度與每頁耗時
+"""
+
+import sys
+import time
+
+import cv2
+
+from crop_from_config import SOURCE_DIR, load_config, build_page_index
+from crop_questions import find_question_boundaries_in_gray
+from segmentation import BINARIZE_METHODS, binarize
+
+# 題目起點與配置檔相差在此範圍內（像素）視為正確
+TOLERANCE = 40
+
+REPEAT = 5
+
+
+def load_reference(year):
+    """
+    讀取配置檔中每頁的題目起點
+    跨頁題目在下一頁的延續部分 (y_start 為 0) 不是題目起點，不列入比較
+    返回: [(灰階頁面, [y_start, ...]), ...]
+    """
+    config = load_config(year)
+    page_index = build_page_index(SOURCE_DIR / year)
+    pages = []
+
+    for page_config in config['pages']:
+        if page_config.get('skip'):
+            continue
+
+        image_path = page_index.get(page_config['page'])
+        if image_path is None:
+            continue
+
+        gray = cv2.imread(str(image_path), cv2.IMREAD_GRAYSCALE)
+        starts = [q['y_start'] for q in page_config.get('questions', []) if q['y_start'] > 0]
+        pages.append((gray, starts))
+
+    return pages
+
+
+def score(pages, method):
+    """計算召回率（配置檔的起點被找到的比例）與精確率（找到的起點正確的比例）"""
+    matched_reference = 0
+    total_reference = 0
+    matched_detected = 0
+    total_detected = 0
+
+    for gray, starts in pages:
+        detected = [y1 for y1, y2, x1, x2 in find_question_boundaries_in_gray(gray, method=method)]
+
+        total_reference += len(starts)
+        matched_reference += sum(any(abs(d - s) <= TOLERANCE for d in detected) for s in starts)
+        total_detected += len(detected)
+        matched_detected += sum(any(abs(d - s) <= TOLERANCE for s in starts) for d in detected)
+
+    recall = matched_reference / max(1, total_reference)
+    precision = matched_detected / max(1, total_detected)
+    return recall, precision
+
+
+def main():
+    """主程式"""
+    if sys.platform == 'win32':
+        sys.stdout.reconfigure(encoding='utf-8')
+
+    pages = load_reference("2020")
+    print(f"二值化方法效能測試: crop_config_2020.json，{len(pages)} 頁，容許誤差 {TOLERANCE}px")
+    print("=" * 60)
+    print(f"{'方法':<10}{'二值化 ms/頁':>14}{'召回率':>10}{'精確率':>10}")
+
+    for method in BINARIZE_METHODS:
+        start = time.perf_counter()
+        for _ in range(REPEAT):
+            for gray, _ in pages:
+                binarize(gray, method)
+        elapsed = (time.perf_counter() - start) / (REPEAT * len(pages)) * 1000
+
+        recall, precision = score(pages, method)
+        print(f"{method:<10}{elapsed:>14.2f}{recall:>10.1%}{precision:>10.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+頁面分割效能測試
+在 his/image/* 的每一頁上比較原本的逐列迴圈與 segmentation.py 的向量化版本，
+以及逐頁與整年批次分割，確認結果完全相同並回報耗時
+"""
+
+import sys
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from segmentation import (
+    find_gaps, skip_header_gap, drop_header_gaps, split_by_gaps,
+    load_page_stacks, batch_profiles, find_gaps_batch,
+)
+from crop_questions_simple import crop_page_smart, crop_pages_smart_batch, boundaries_from_gaps
+from page_store import PageStore
+
+# 設定路徑
+BASE_DIR = Path(__file__).parent.parent
+SOURCE_DIR = BASE_DIR / "his" / "image"
+
+REPEAT = 20
+
+
+def legacy_density_boundaries(row_densities, height, min_gap=30):
+    """crop_questions.find_question_boundaries 原本的逐列迴圈"""
+    threshold = np.mean(row_densities) * 0.3
+    separators = []
+    gap_threshold = threshold * 0.5
+
+    in_gap = False
+    gap_start = 0
+
+    for i, density in enumerate(row_densities):
+        if density < gap_threshold:
+            if not in_gap:
+                gap_start = i
+                in_gap = True
+        else:
+            if in_gap and (i - gap_start) > min_gap:
+                separators.append((gap_start, i))
+            in_gap = False
+
+    if len(separators) == 0:
+        return [(0, height)]
+
+    boundaries = []
+    start_y = 0
+    if len(separators) > 0 and separators[0][0] < height * 0.2:
+        start_y = separators[0][1]
+        separators = separators[1:]
+
+    for gap_start, gap_end in separators:
+        if gap_start - start_y > min_gap:
+            boundaries.append((start_y, gap_start))
+        start_y = gap_end
+
+    if height - start_y > min_gap:
+        boundaries.append((start_y, height))
+
+    return boundaries
+
+
+def vectorized_density_boundaries(row_densities, height, min_gap=30):
+    """crop_questions.find_question_boundaries_in_gray 的向量化版本"""
+    threshold = np.mean(row_densities) * 0.3
+    separators = find_gaps(row_densities < threshold * 0.5, min_gap + 1)
+
+    if len(separators) == 0:
+        return [(0, height)]
+
+    start_y, separators = skip_header_gap(separators, height, 0.2)
+    return split_by_gaps(separators, height, min_gap, start_y)
+
+
+def legacy_brightness_boundaries(row_brightness, height, min_gap=40):
+    """crop_questions_simple 原本的逐列空白偵測 + crop_page_smart 迴圈（已由 segment_page 的向量化分割取代）"""
+    white_rows = row_brightness > 240
+
+    gaps = []
+    in_gap = False
+    gap_start = 0
+
+    for i, is_white in enumerate(white_rows):
+        if is_white:
+            if not in_gap:
+                gap_start = i
+                in_gap = True
+        else:
+            if in_gap and (i - gap_start) >= min_gap:
+                gaps.append((gap_start, i))
+            in_gap = False
+
+    boundaries = []
+    start_y = 0
+    filtered_gaps = [g for g in gaps if g[0] > height * 0.1]
+
+    for gap_start, gap_end in filtered_gaps:
+        if gap_start - start_y > 100:
+            boundaries.append((start_y, gap_start))
+        start_y = gap_end
+
+    if height - start_y > 100:
+        boundaries.append((start_y, height))
+
+    return boundaries
+
+
+def vectorized_brightness_boundaries(row_brightness, height, min_gap=40):
+    """crop_questions_simple 的向量化版本"""
+    gaps = find_gaps(row_brightness > 240, min_gap)
+    return split_by_gaps(drop_header_gaps(gaps, height, 0.1), height, 100)
+
+
+def load_profiles(paths):
+    """預先計算每頁的列密度與列亮度，只比較分割本身的耗時"""
+    profiles = []
+    for path in paths:
+        gray = cv2.imread(str(path), cv2.IMREAD_GRAYSCALE)
+        if gray is None:
+            continue
+
+        binary = cv2.adaptiveThreshold(
+            gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+            cv2.THRESH_BINARY_INV, 11, 2
+        )
+        profiles.append((
+            path,
+            gray.shape[0],
+            np.sum(binary, axis=1) / 255,
+            np.mean(gray, axis=1),
+        ))
+    return profiles
+
+
+def bench(name, legacy, vectorized, profiles, index):
+    """比較兩個實作的結果與耗時"""
+    mismatches = [
+        p[0] for p in profiles
+        if [tuple(b) for b in legacy(p[index], p[1])] != [tuple(b) for b in vectorized(p[index], p[1])]
+    ]
+
+    timings = []
+    for fn in (legacy, vectorized):
+        start = time.perf_counter()
+        for _ in range(REPEAT):
+            for p in profiles:
+                fn(p[index], p[1])
+        timings.append((time.perf_counter() - start) / (REPEAT * len(profiles)) * 1000)
+
+    print(f"{name}:")
+    print(f"  逐列迴圈: {timings[0]:.3f} ms/頁")
+    print(f"  向量化:   {timings[1]:.3f} ms/頁 ({timings[0] / timings[1]:.1f}x)")
+    print(f"  結果不同: {len(mismatches)} 頁")
+    for path in mismatches:
+        print(f"    {path}")
+
+    return not mismatches
+
+
+def bench_batch(year_dirs):
+    """
+    比較逐頁與整年批次分割
+    含解碼: crop_page_smart 逐頁讀取 vs crop_pages_smart_batch，兩邊各用一個空的頁面快取（不共用已解碼的頁面）
+    不含解碼: 在已解碼的頁面上比較列亮度與空白區段的計算
+    """
+    per_page_time = 0.0
+    batch_time = 0.0
+    per_page_compute = 0.0
+    batch_compute = 0.0
+    total_pages = 0
+    mismatches = []
+
+    for year_dir in year_dirs:
+        paths = sorted(
+            p for p in year_dir.iterdir()
+            if p.suffix.lower() in ['.jpg', '.png', '.jpeg']
+        )
+        total_pages += len(paths)
+
+        start = time.perf_counter()
+        store = PageStore()
+        per_page = {p: crop_page_smart(p, store=store) for p in paths}
+        per_page_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        batch = crop_pages_smart_batch(paths, store=PageStore())
+        batch_time += time.perf_counter() - start
+
+        mismatches += [p for p in paths if [tuple(b) for b in per_page[p]] != [tuple(b) for b in batch[p]]]
+
+        for _, stack, sizes in load_page_stacks(paths):
+            pages = [stack[i, :h, :w] for i, (h, w) in enumerate(sizes.tolist())]
+
+            start = time.perf_counter()
+            for _ in range(REPEAT):
+                for page in pages:
+                    gaps = find_gaps(np.mean(page, axis=1) > 240, 40)
+                    boundaries_from_gaps(gaps, page.shape[0])
+            per_page_compute += (time.perf_counter() - start) / REPEAT
+
+            start = time.perf_counter()
+            for _ in range(REPEAT):
+                row_brightness, _ = batch_profiles(stack, sizes)
+                for (height, _), gaps in zip(sizes.tolist(), find_gaps_batch(row_brightness > 240, 40)):
+                    boundaries_from_gaps(gaps, height)
+            batch_compute += (time.perf_counter() - start) / REPEAT
+
+    print("整年批次分割 (crop_questions_simple):")
+    print(f"  含解碼   逐頁: {total_pages / per_page_time:.1f} 頁/秒，"
+          f"批次: {total_pages / batch_time:.1f} 頁/秒 ({per_page_time / batch_time:.1f}x)")
+    print(f"  不含解碼 逐頁: {total_pages / per_page_compute:.1f} 頁/秒，"
+          f"批次: {total_pages / batch_compute:.1f} 頁/秒 ({per_page_compute / batch_compute:.1f}x)")
+    print(f"  結果不同: {len(mismatches)} 頁")
+    for path in mismatches:
+        print(f"    {path}")
+
+    return not mismatches
+
+
+def main():
+    """主程式"""
+    if sys.platform == 'win32':
+        sys.stdout.reconfigure(encoding='utf-8')
+
+    paths = sorted(
+        p for p in SOURCE_DIR.glob("*/*")
+        if p.suffix.lower() in ['.jpg', '.png', '.jpeg']
+    )
+    print(f"頁面分割效能測試: {len(paths)} 頁")
+    print("=" * 60)
+
+    profiles = load_profiles(paths)
+
+    ok = bench("密度分割 (crop_questions)", legacy_density_boundaries, vectorized_density_boundaries, profiles, 2)
+    ok &= bench("亮度分割 (crop_questions_simple)", legacy_brightness_boundaries, vectorized_brightness_boundaries, profiles, 3)
+    ok &= bench_batch(sorted(d for d in SOURCE_DIR.iterdir() if d.is_dir()))
+
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
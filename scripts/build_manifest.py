@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+增量建置清單
+記錄每個處理階段的輸入雜湊與輸出檔案，輸入未變更時即可跳過該階段
+供 process_pdf.py、crop_from_config.py、crop_questions*.py、crop_with_claude.py 共用
+"""
+
+import os
+import json
+import hashlib
+from pathlib import Path
+from typing import Dict, List, Optional
+
+# 設定路徑
+BASE_DIR = Path(__file__).parent.parent
+CACHE_DIR = BASE_DIR / "scripts" / ".cache"
+MANIFEST_PATH = CACHE_DIR / "build_manifest.json"
+
+# 版本 2：outputs 改為依記錄順序的 [[路徑, 雜湊], ...]（舊版清單會被忽略並重新建置）
+MANIFEST_VERSION = 2
+
+
+def file_digest(path: Path) -> str:
+    """計算檔案內容的 SHA-256"""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def params_digest(*parts) -> str:
+    """計算任意參數（設定項目、數值、雜湊字串）的組合雜湊"""
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _relative(path: Path) -> str:
+    """將路徑轉成相對於專案根目錄的格式，讓清單可以跨機器使用"""
+    path = Path(path).resolve()
+    try:
+        return path.relative_to(BASE_DIR.resolve()).as_posix()
+    except ValueError:
+        return path.as_posix()
+
+
+def _absolute(rel_path: str) -> Path:
+    path = Path(rel_path)
+    return path if path.is_absolute() else BASE_DIR / path
+
+
+class BuildManifest:
+    """
+    建置清單
+    entries: {階段鍵值: {"inputs": 輸入雜湊, "outputs": [[路徑, 雜湊], ...], "meta": {...}}}
+    outputs 以串列保存記錄順序（存檔時 sort_keys 不會重排），呼叫端可依序與 meta 中的題號對應
+    files:   {路徑: {"size", "mtime_ns", "sha256"}}，避免重複計算未變更檔案的雜湊
+    """
+
+    def __init__(self, path: Path = MANIFEST_PATH):
+        self.path = Path(path)
+        self.entries: Dict[str, Dict] = {}
+        self.files: Dict[str, Dict] = {}
+        self.skipped = 0
+        self.rebuilt = 0
+
+        if self.path.exists():
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                if data.get('version') == MANIFEST_VERSION:
+                    self.entries = data.get('entries', {})
+                    self.files = data.get('files', {})
+            except (OSError, ValueError) as e:
+                print(f"警告: 無法讀取建置清單 {self.path}，將重新建置: {e}")
+
+    def digest(self, path: Path) -> str:
+        """取得檔案雜湊，檔案大小與修改時間未變時直接使用快取"""
+        key = _relative(path)
+        stat = os.stat(path)
+        cached = self.files.get(key)
+
+        if cached and cached['size'] == stat.st_size and cached['mtime_ns'] == stat.st_mtime_ns:
+            return cached['sha256']
+
+        sha = file_digest(path)
+        self.files[key] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': sha}
+        return sha
+
+    def is_fresh(self, key: str, inputs: str) -> bool:
+        """
+        輸入雜湊相同且所有輸出檔案都還在且未被修改時，返回 True
+        只做檢查，不計入統計；實際跳過該階段時請呼叫 mark_skipped()
+        """
+        entry = self.entries.get(key)
+        if not entry or entry.get('inputs') != inputs:
+            return False
+
+        for rel_path, sha in entry.get('outputs', []):
+            path = _absolute(rel_path)
+            if not path.exists() or self.digest(path) != sha:
+                return False
+
+        return True
+
+    def mark_skipped(self):
+        """記錄一個因輸入未變更而跳過的階段（summary() 的統計）"""
+        self.skipped += 1
+
+    def outputs(self, key: str) -> List[Path]:
+        """取得階段記錄的輸出檔案（依記錄順序）"""
+        entry = self.entries.get(key, {})
+        return [_absolute(rel_path) for rel_path, _ in entry.get('outputs', [])]
+
+    def meta(self, key: str, inputs: Optional[str] = None) -> Optional[Dict]:
+        """
+        取得階段記錄的附加資料
+        提供 inputs 時，只有輸入雜湊相同才返回（即使輸出檔案已被刪除）
+        """
+        entry = self.entries.get(key)
+        if not entry or (inputs is not None and entry.get('inputs') != inputs):
+            return None
+        return entry.get('meta')
+
+    def record(self, key: str, inputs: str, outputs: List[Path], meta: Optional[Dict] = None):
+        """記錄一個已完成的階段"""
+        self.entries[key] = {
+            'inputs': inputs,
+            'outputs': [[_relative(p), self.digest(p)] for p in outputs],
+            'meta': meta or {},
+        }
+        self.rebuilt += 1
+
+    def cache_meta(self, key: str, inputs: str, meta: Dict):
+        """
+        記錄不屬於建置階段的計算結果（例如頁面的 dHash），以 meta(key, inputs) 取回
+        沒有輸出檔案，也不計入重建統計
+        """
+        self.entries[key] = {'inputs': inputs, 'outputs': [], 'meta': meta}
+
+    def save(self):
+        """寫入清單（先寫暫存檔再取代，避免中斷時留下損毀的檔案）"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix('.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'version': MANIFEST_VERSION,
+                'entries': self.entries,
+                'files': self.files,
+            }, f, ensure_ascii=False, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+    def summary(self) -> str:
+        return f"重建 {self.rebuilt} 項，跳過 {self.skipped} 項未變更的項目"
+
+
+def write_json_if_changed(path: Path, data) -> bool:
+    """內容與現有檔案相同時不重寫，返回是否有寫入"""
+    content = json.dumps(data, ensure_ascii=False, indent=2)
+
+    if path.exists():
+        with open(path, 'r', encoding='utf-8') as f:
+            if f.read() == content:
+                return False
+
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(content)
+    return True
@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""
+共用的裁切執行器
+將 (頁面, 區域, 輸出檔) 工作分配到行程池平行解碼、裁切與編碼，並限制同時處理中的頁面記憶體
+供 crop_from_config.py、crop_questions.py、crop_questions_simple.py、crop_with_claude.py 共用
+
+同一頁的所有裁切合併成一個工作，每頁只解碼一次；跨頁題目（多個部分）在同一個工作中拼接
+可選擇將每個裁切範圍縮小到墨跡範圍加上邊距（裁白邊），實際裁切的頁面座標會記錄在 crops.json
+"""
+
+import json
+import os
+import shutil
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Tuple
+
+import numpy as np
+from PIL import Image
+
+from build_manifest import BASE_DIR, write_json_if_changed
+from jpeg_lossless import JPEG_QUALITY, crop_stats, write_crop
+from page_store import PageStore, init_worker_store, shared_store, shared_store_settings
+
+# 同時處理中的頁面（解碼後的 RGB）記憶體上限
+DEFAULT_MAX_INFLIGHT_MB = 256
+
+# 裁白邊：灰階值低於 TRIM_INK_THRESHOLD 視為墨跡，至少 TRIM_MIN_INK 個墨跡像素的列/欄才算有內容（忽略掃描雜點）
+TRIM_INK_THRESHOLD = 200
+TRIM_MIN_INK = 2
+DEFAULT_TRIM_PAD = 12
+
+# 每個輸出目錄的裁切座標紀錄
+CROPS_FILE = "crops.json"
+
+
+class CropJob(NamedTuple):
+    """一個輸出檔案：parts 為 [(頁面路徑, (x1, y1, x2, y2)), ...]，多個部分時依序垂直拼接"""
+    parts: List[Tuple[Path, Tuple[int, int, int, int]]]
+    output: Path
+
+
+class CropResult(NamedTuple):
+    """裁切結果：boxes 為各部分實際裁切的頁面座標（裁白邊、MCU 對齊之後）"""
+    mode: str
+    boxes: List[Tuple[int, int, int, int]]
+
+
+def crop_job(image_path: Path, box: Tuple[int, int, int, int], output: Path) -> CropJob:
+    """單一區域的裁切工作"""
+    return CropJob([(image_path, box)], output)
+
+
+def trim_box(gray: np.ndarray, box: Tuple[int, int, int, int], pad: int) -> Tuple[int, int, int, int]:
+    """
+    將裁切範圍縮小到墨跡範圍再往外加 pad 像素（不超出原本的範圍）
+    範圍內沒有墨跡時返回原本的範圍（限制在頁面內）
+    """
+    height, width = gray.shape
+    x1, y1, x2, y2 = box
+    x1, y1, x2, y2 = max(0, x1), max(0, y1), min(width, x2), min(height, y2)
+
+    ink = gray[y1:y2, x1:x2] < TRIM_INK_THRESHOLD
+    rows = np.flatnonzero(np.count_nonzero(ink, axis=1) >= TRIM_MIN_INK)
+    cols = np.flatnonzero(np.count_nonzero(ink, axis=0) >= TRIM_MIN_INK)
+    if len(rows) == 0 or len(cols) == 0:
+        return (x1, y1, x2, y2)
+
+    return (
+        max(x1, x1 + int(cols[0]) - pad), max(y1, y1 + int(rows[0]) - pad),
+        min(x2, x1 + int(cols[-1]) + 1 + pad), min(y2, y1 + int(rows[-1]) + 1 + pad),
+    )
+
+
+def _page_task(image_path: Path, crops: List[Tuple[Tuple[int, int, int, int], Path]], lossless: bool, quality: int, trim_pad: int = None, store: PageStore = None) -> List[Tuple[Path, CropResult]]:
+    """裁切同一頁的所有區域（頁面最多解碼一次）"""
+    store = store or shared_store()
+    results = []
+    for box, output in crops:
+        if trim_pad is not None:
+            box = trim_box(store.gray(image_path), box, trim_pad)
+        mode, cropped_box = write_crop(image_path, box, output, lossless, store, quality)
+        results.append((output, CropResult(mode, [cropped_box])))
+    return results
+
+
+def _stitch_task(parts: List[Tuple[Path, Tuple[int, int, int, int]]], output: Path, quality: int, trim_pad: int = None, store: PageStore = None) -> List[Tuple[Path, CropResult]]:
+    """
+    裁切跨頁題目的各部分並拼接
+    裁白邊時各部分分別縮小上下範圍，左右範圍取各部分的聯集，拼接後各部分仍然對齊
+    同一時間只保留一頁的解碼結果：先逐頁算出裁切範圍（裁白邊後立即釋放該頁），
+    再建立輸出畫布，逐頁解碼、裁切並貼上
+    """
+    store = store or shared_store()
+    boxes = []
+    modes = set()
+    for image_path, (x1, y1, x2, y2) in parts:
+        with Image.open(image_path) as img:
+            width, height = img.size
+            modes.add(img.mode)
+        box = (max(0, x1), max(0, y1), min(width, x2), min(height, y2))
+        if trim_pad is not None:
+            trimmed = trim_box(store.gray(image_path), box, trim_pad)
+            store.release(image_path)
+            boxes.append((box, trimmed))
+        else:
+            boxes.append((box, box))
+
+    # 左右範圍取各部分（裁白邊後）的聯集
+    left = min(trimmed[0] for _, trimmed in boxes)
+    right = max(trimmed[2] for _, trimmed in boxes)
+    boxes = [(max(x1, left), ty1, min(x2, right), ty2) for (x1, _, x2, _), (_, ty1, _, ty2) in boxes]
+
+    # 灰階頁面保持灰階，其餘轉成 RGB；較窄的部分靠左，右側補白
+    mode = 'L' if modes == {'L'} else 'RGB'
+    canvas = Image.new(mode, (max(x2 - x1 for x1, _, x2, _ in boxes), sum(y2 - y1 for _, y1, _, y2 in boxes)), 'white')
+
+    offset = 0
+    for (image_path, _), box in zip(parts, boxes):
+        with Image.open(image_path) as img:
+            strip = img.crop(box)
+        canvas.paste(strip.convert(mode), (0, offset))
+        offset += strip.height
+
+    canvas.save(output, 'JPEG', quality=quality)
+    return [(output, CropResult('reencode', boxes))]
+
+
+def _page_bytes(image_path: Path) -> int:
+    """解碼一頁 RGB 所需的記憶體（只讀取檔頭）"""
+    with Image.open(image_path) as img:
+        width, height = img.size
+    return width * height * 3
+
+
+def plan_tasks(jobs: List[CropJob]) -> List[Tuple[int, str, tuple]]:
+    """
+    將裁切工作依頁面分組
+    返回: [(預估記憶體, 種類 'page' 或 'stitch', 參數), ...]，依頁面第一次出現的順序
+    """
+    pages: Dict[Path, List[Tuple[Tuple[int, int, int, int], Path]]] = {}
+    tasks = []
+
+    for job in jobs:
+        if len(job.parts) == 1:
+            image_path, box = job.parts[0]
+            pages.setdefault(image_path, []).append((box, job.output))
+        else:
+            cost = sum(_page_bytes(image_path) for image_path, _ in job.parts)
+            tasks.append((cost, 'stitch', (job.parts, job.output)))
+
+    page_tasks = [(_page_bytes(image_path), 'page', (image_path, crops)) for image_path, crops in pages.items()]
+    return page_tasks + tasks
+
+
+def run_crop_jobs(
+    jobs: List[CropJob],
+    workers: int = None,
+    lossless: bool = False,
+    quality: int = JPEG_QUALITY,
+    max_inflight_mb: int = DEFAULT_MAX_INFLIGHT_MB,
+    trim_pad: int = None,
+) -> Dict[Path, CropResult]:
+    """
+    執行裁切工作
+    workers: 行程數（預設為 CPU 核心數）；1 表示在目前行程中依序處理，並使用共用頁面快取中已解碼的頁面
+    max_inflight_mb: 已送出但尚未完成的工作所需的頁面記憶體上限（至少會送出一個工作）
+    trim_pad: 裁白邊後保留的邊距（像素）；None 表示不裁白邊
+    返回: {輸出路徑: CropResult}，失敗的工作不會出現在結果中；實際裁切的座標同時寫入各輸出目錄的 crops.json
+    """
+    # 範圍相同的工作（例如重複頁面換成代表頁面之後）只裁切一次，其餘複製輸出檔案
+    unique_jobs: Dict[tuple, CropJob] = {}
+    copies = []
+    for job in jobs:
+        key = tuple(job.parts)
+        if key in unique_jobs:
+            copies.append((unique_jobs[key], job))
+        else:
+            unique_jobs[key] = job
+
+    tasks = plan_tasks(list(unique_jobs.values()))
+    if not tasks:
+        return {}
+
+    workers = min(workers or os.cpu_count() or 1, len(tasks))
+    results: Dict[Path, CropResult] = {}
+    start_time = time.perf_counter()
+
+    def collect(task_results):
+        for output, result in task_results:
+            results[output] = result
+
+    if workers == 1:
+        store = shared_store()
+        for _, kind, args in tasks:
+            try:
+                if kind == 'page':
+                    collect(_page_task(*args, lossless, quality, trim_pad, store))
+                else:
+                    collect(_stitch_task(*args, quality, trim_pad, store))
+            except Exception as e:
+                print(f"  錯誤: 裁切 {args[0]} 失敗: {e}")
+    else:
+        budget = max_inflight_mb * 1024 * 1024
+        in_flight = {}
+
+        def drain(return_when):
+            done, _ = wait(in_flight, return_when=return_when)
+            for future in done:
+                _, args = in_flight.pop(future)
+                try:
+                    collect(future.result())
+                except Exception as e:
+                    print(f"  錯誤: 裁切 {args[0]} 失敗: {e}")
+
+        # 工作行程沿用主行程的頁面快取設定（含磁碟快取），記憶體上限再以 max_inflight_mb 平分
+        max_bytes, disk_cache, cache_dir = shared_store_settings()
+        worker_bytes = min(max_bytes, budget // workers)
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker_store,
+                                 initargs=(worker_bytes, disk_cache, cache_dir)) as executor:
+            for cost, kind, args in tasks:
+                while in_flight and sum(c for c, _ in in_flight.values()) + cost > budget:
+                    drain(FIRST_COMPLETED)
+
+                if kind == 'page':
+                    future = executor.submit(_page_task, *args, lossless, quality, trim_pad)
+                else:
+                    future = executor.submit(_stitch_task, *args, quality, trim_pad)
+                in_flight[future] = (cost, args)
+
+            if in_flight:
+                drain('ALL_COMPLETED')
+
+    crop_stats.update(result.mode for result in results.values())
+    cropped = len(results)
+
+    for source, job in copies:
+        if source.output in results:
+            shutil.copyfile(source.output, job.output)
+            results[job.output] = results[source.output]
+
+    write_crop_index(jobs, results)
+
+    elapsed = time.perf_counter() - start_time
+    summary = (f"  裁切 {cropped} 張，耗時 {elapsed:.2f} 秒 "
+               f"({cropped / max(elapsed, 1e-9):.1f} 張/秒，{workers} 個行程)")
+    if copies:
+        summary += f"，{len(copies)} 張與其他題目相同，直接複製"
+    print(summary)
+
+    return results
+
+
+def _page_name(image_path: Path) -> str:
+    """來源頁面相對於專案根目錄的路徑（不在專案內時為絕對路徑）"""
+    path = Path(image_path).resolve()
+    try:
+        return path.relative_to(BASE_DIR.resolve()).as_posix()
+    except ValueError:
+        return path.as_posix()
+
+
+def write_crop_index(jobs: List[CropJob], results: Dict[Path, CropResult]):
+    """
+    將實際裁切的座標寫入各輸出目錄的 crops.json（保留目錄中其他圖片的紀錄）
+    {"q001.jpg": [{"page": 來源頁面（相對於專案根目錄）, "box": [x1, y1, x2, y2], "requested": [...]}, ...]}
+    由 page 與 box 即可從原始頁面重建未裁白邊的圖片或還原題目在頁面上的位置
+    """
+    by_dir: Dict[Path, Dict[str, List[Dict]]] = {}
+    for job in jobs:
+        result = results.get(job.output)
+        if result is None:
+            continue
+        by_dir.setdefault(job.output.parent, {})[job.output.name] = [
+            {
+                "page": _page_name(image_path),
+                "box": list(box),
+                "requested": list(requested),
+            }
+            for (image_path, requested), box in zip(job.parts, result.boxes)
+        ]
+
+    for directory, entries in by_dir.items():
+        index = load_crop_index(directory)
+        index.update(entries)
+        write_json_if_changed(directory / CROPS_FILE, dict(sorted(index.items())))
+
+
+def load_crop_index(directory: Path) -> Dict[str, List[Dict]]:
+    """讀取目錄的 crops.json，沒有時返回空字典"""
+    path = Path(directory) / CROPS_FILE
+    if not path.exists():
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
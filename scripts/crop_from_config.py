@@ -9,7 +9,15 @@ import sys
 import json
 import re
 from pathlib import Path
-from PIL import Image
+
+from asset_manifest import load_asset_manifest, publish_year, question_urls
+from build_manifest import BuildManifest, params_digest, write_json_if_changed
+from crop_executor import DEFAULT_TRIM_PAD, CropJob, run_crop_jobs
+from image_variants import build_variants
+from jpeg_lossless import stats_summary
+from page_dedupe import dedupe_pages, print_aliases
+from page_words import crop_ocr_texts
+from page_store import shared_store
 
 # 設定路徑
 BASE_DIR = Path(__file__).parent.parent
@@ -18,6 +26,9 @@ OUTPUT_DIR = BASE_DIR / "public" / "images" / "exams"
 DATA_DIR = BASE_DIR / "scripts" / "output"
 CONFIG_DIR = BASE_DIR / "scripts"
 
+# 裁切參數（變更時所有題目都會重新裁切）
+JPEG_QUALITY = 95
+
 # 確保輸出目錄存在
 DATA_DIR.mkdir(parents=True, exist_ok=True)
 
@@ -35,7 +46,10 @@ def load_config(year):
 
 
 def merge_question_parts(pages_config):
-    """合併跨頁的題目部分"""
+    """
+    收集每個題目在各頁的所有部分
+    返回: {題號: [{"page", "y_start", "y_end"(, "x_start", "x_end")}, ...]}
+    """
     # 建立題號到所有出現位置的映射
     question_parts = {}
 
@@ -51,40 +65,72 @@ def merge_question_parts(pages_config):
             if qnum not in question_parts:
                 question_parts[qnum] = []
 
-            question_parts[qnum].append({
+            part = {
                 'page': page_num,
                 'y_start': q['y_start'],
                 'y_end': q['y_end']
-            })
-
-    # 合併每個題目的所有部分
-    merged_questions = {}
-
-    for qnum, parts in question_parts.items():
-        # 按頁碼排序
-        parts.sort(key=lambda x: x['page'])
-
-        # 如果題目只在一頁，直接使用
-        if len(parts) == 1:
-            merged_questions[qnum] = parts[0]
-        else:
-            # 題目跨頁，需要合併
-            # 使用第一個出現的頁面，並取最大的 y_end
-            first_part = parts[0]
-            last_part = parts[-1]
-
-            # 如果第一部分的 y_end 接近頁面底部，使用第一頁
-            # 否則使用最後一頁（題目主要內容在那裡）
-            if first_part['y_end'] > 1500:  # 接近頁面底部
-                merged_questions[qnum] = first_part
-            else:
-                merged_questions[qnum] = last_part
-
-    return merged_questions
-
-
-def crop_from_config(year, config):
-    """根據配置檔裁切圖片"""
+            }
+
+            # 多欄頁面可另外指定該題所在欄的水平範圍
+            for key in ('x_start', 'x_end'):
+                if key in q:
+                    part[key] = q[key]
+
+            question_parts[qnum].append(part)
+
+    # 每個題目的所有部分依頁碼、位置排序，跨頁的題目會在裁切時垂直拼接
+    for parts in question_parts.values():
+        parts.sort(key=lambda x: (x['page'], x['y_start']))
+
+    return question_parts
+
+
+# 頁面圖片檔名格式，依優先順序: *_Page{頁碼}.*、{頁碼}.*、{頁碼}-1.*
+PAGE_NAME_PATTERNS = [
+    re.compile(r'.*_Page(\d+)\..*'),
+    re.compile(r'(\d+)\..*'),
+    re.compile(r'(\d+)-1\..*'),
+]
+
+
+def build_page_index(source_year_dir):
+    """
+    掃描一次年份目錄，建立頁碼到圖片檔案的索引 (支援多種命名格式)
+    同一頁碼有多個檔案時，依 PAGE_NAME_PATTERNS 的順序取第一個符合的格式
+    返回: {頁碼: 圖片路徑}
+    """
+    candidates = {}
+    for path in sorted(source_year_dir.iterdir()):
+        for priority, pattern in enumerate(PAGE_NAME_PATTERNS):
+            match = pattern.fullmatch(path.name)
+            if match:
+                page_num = int(match.group(1))
+                if page_num not in candidates or priority < candidates[page_num][0]:
+                    candidates[page_num] = (priority, path)
+                break
+
+    return {page_num: path for page_num, (_, path) in candidates.items()}
+
+
+def part_box(part, size):
+    """題目部分在頁面上的裁切範圍，限制在頁面範圍內"""
+    width, height = size
+    return (
+        max(0, part.get('x_start', 0)), max(0, part['y_start']),
+        min(width, part.get('x_end', width)), min(height, part['y_end'])
+    )
+
+
+def crop_from_config(year, config, manifest=None, lossless=False, workers=None, variants=False, trim_pad=None, ocr_text=False):
+    """
+    根據配置檔裁切圖片
+    manifest: 建置清單，來源頁面與配置項目都未變更的題目會被跳過
+    lossless: 單頁題目以 jpegtran 無損裁切（起點往上對齊 MCU），跨頁題目仍需解碼拼接
+    workers: 裁切行程數（見 crop_executor.run_crop_jobs）
+    variants: 另外產生 WebP / AVIF 多尺寸版本（見 image_variants.py），imageUrls 改用 WebP
+    trim_pad: 裁掉題目四周的空白，只保留墨跡範圍外 trim_pad 像素；None 表示不裁白邊
+    ocr_text: 由頁面 OCR 的字詞框組出每題的 ocrText（見 page_words.py）；這個腳本本身不做 OCR，OCR 快取中沒有的頁面會另外整頁辨識一次
+    """
     print(f"\n{'='*60}")
     print(f"處理 {year} 年")
     print('='*60)
@@ -95,7 +141,7 @@ def crop_from_config(year, config):
         print(f"錯誤: 找不到目錄 {source_year_dir}")
         return {}
 
-    # 合併跨頁題目
+    # 收集每題的所有部分（跨頁題目有多個部分）
     merged_questions = merge_question_parts(config['pages'])
 
     print(f"共找到 {len(merged_questions)} 個題目")
@@ -104,60 +150,88 @@ def crop_from_config(year, config):
     year_dir = OUTPUT_DIR / year / "questions"
     year_dir.mkdir(parents=True, exist_ok=True)
 
-    # 裁切每個題目
-    cropped_images = {}
+    # 建立頁碼索引（只掃描一次目錄）
+    page_index = build_page_index(source_year_dir)
 
-    for qnum in sorted(merged_questions.keys()):
-        part = merged_questions[qnum]
-        page_num = part['page']
-        y_start = part['y_start']
-        y_end = part['y_end']
-
-        # 找到對應的圖片檔案 (支援多種命名格式)
-        image_files = list(source_year_dir.glob(f"*_Page{page_num}.*"))
+    # 內容重複的頁面改用同一個代表頁面，只解碼一次，相同範圍的題目也只裁切一次
+    canonical = dedupe_pages([page_index[page_num] for page_num in sorted(page_index)], manifest)
+    print_aliases(canonical)
 
-        # 如果找不到 *_Page 格式，嘗試簡單數字格式
-        if not image_files:
-            image_files = list(source_year_dir.glob(f"{page_num}.*"))
+    # 找出需要重新裁切的題目
+    store = shared_store()
+    cropped_images = {}
+    jobs = []
+    pending = {}
 
-        # 如果還是找不到，嘗試 {page_num}-1.* 格式
-        if not image_files:
-            image_files = list(source_year_dir.glob(f"{page_num}-1.*"))
+    for qnum in sorted(merged_questions.keys()):
+        parts = merged_questions[qnum]
 
-        if not image_files:
-            print(f"  警告: 找不到第 {page_num} 頁的圖片")
+        missing = [part['page'] for part in parts if part['page'] not in page_index]
+        if missing:
+            print(f"  警告: 找不到第 {', '.join(map(str, missing))} 頁的圖片，跳過題目 {qnum}")
             continue
 
-        image_path = image_files[0]
+        output_path = year_dir / f"q{qnum:03d}.jpg"
+        stage_key = f"crop_from_config/{year}/{qnum}"
+        stage_inputs = None
+
+        if manifest is not None:
+            stage_inputs = params_digest(
+                [manifest.digest(page_index[part['page']]) for part in parts], parts, JPEG_QUALITY, lossless, trim_pad
+            )
+            if manifest.is_fresh(stage_key, stage_inputs):
+                manifest.mark_skipped()
+                cropped_images[qnum] = output_path
+                continue
+
+        jobs.append(CropJob(
+            [(canonical[page_index[part['page']]], part_box(part, store.size(page_index[part['page']]))) for part in parts],
+            output_path
+        ))
+        pending[output_path] = (qnum, stage_key, stage_inputs)
+
+    # 同一頁的題目部分在同一個工作中裁切（每頁只解碼一次），跨頁題目裁切後拼接
+    results = run_crop_jobs(jobs, workers, lossless, JPEG_QUALITY, trim_pad=trim_pad)
+
+    stitched = 0
+    for job in jobs:
+        if job.output not in results:
+            continue
 
-        # 開啟並裁切
-        img = Image.open(image_path)
+        qnum, stage_key, stage_inputs = pending[job.output]
+        cropped_images[qnum] = job.output
+        if len(job.parts) > 1:
+            stitched += 1
 
-        # 確保座標在範圍內
-        y_start = max(0, y_start)
-        y_end = min(img.height, y_end)
+        if manifest is not None:
+            manifest.record(stage_key, stage_inputs, [job.output])
 
-        # 裁切
-        cropped = img.crop((0, y_start, img.width, y_end))
+    print(f"✓ 完成！共 {len(cropped_images)} 題，其中 {stitched} 題為跨頁拼接")
+    if manifest is not None:
+        print(f"  建置清單: {manifest.summary()}")
 
-        # 儲存
-        output_path = year_dir / f"q{qnum:03d}.jpg"
-        cropped.save(output_path, 'JPEG', quality=95)
-        cropped_images[qnum] = output_path
+    if variants:
+        build_variants(list(cropped_images.values()), manifest, workers)
 
-        if qnum % 10 == 0:
-            print(f"  已裁切 {qnum}/100 題")
+    # 以內容雜湊命名的檔案與 manifest.json，未變更的圖片網址不變
+    publish_year(year, cropped_images, manifest)
 
-    print(f"✓ 完成！共裁切 {len(cropped_images)} 題")
+    ocr_texts = crop_ocr_texts(cropped_images.values(), manifest) if ocr_text else None
 
     # 生成 JSON
-    generate_exam_json(year, cropped_images)
+    generate_exam_json(year, cropped_images, ocr_texts)
 
     return cropped_images
 
 
-def generate_exam_json(year, questions_dict):
-    """生成試卷 JSON 檔案"""
+def generate_exam_json(year, questions_dict, ocr_texts=None):
+    """
+    生成試卷 JSON 檔案
+    ocr_texts: {圖片路徑: 文字}，提供時每題加上 ocrText
+    """
+    # 以內容雜湊命名的網址（見 asset_manifest.py）
+    assets = load_asset_manifest()
+
     exam_data = {
         "title": f"{year}年感染症專科醫師甄審筆試",
         "year": int(year),
@@ -169,15 +243,14 @@ def generate_exam_json(year, questions_dict):
     sorted_questions = sorted(questions_dict.items(), key=lambda x: x[0])
 
     for idx, (qnum, img_path) in enumerate(sorted_questions):
-        rel_path = img_path.relative_to(BASE_DIR / "public")
-        url_path = "/" + str(rel_path).replace("\\", "/")
+        image_url, image_urls = question_urls(year, qnum, img_path, assets)
 
         question = {
             "order": idx,
             "content": f"第 {qnum} 題",
             "type": "CHOICE",
-            "imageUrl": url_path,
-            "imageUrls": [url_path],
+            "imageUrl": image_url,
+            "imageUrls": image_urls,
             "options": [
                 {"text": "A", "order": 0},
                 {"text": "B", "order": 1},
@@ -188,14 +261,16 @@ def generate_exam_json(year, questions_dict):
             "correctAnswer": "",
             "answerExplanation": ""
         }
+        if ocr_texts is not None:
+            question["ocrText"] = ocr_texts.get(img_path) or None
         exam_data["questions"].append(question)
 
     # 儲存 JSON
     output_path = DATA_DIR / f"exam_{year}.json"
-    with open(output_path, 'w', encoding='utf-8') as f:
-        json.dump(exam_data, f, ensure_ascii=False, indent=2)
-
-    print(f"✓ 已生成 JSON: {output_path}")
+    if write_json_if_changed(output_path, exam_data):
+        print(f"✓ 已生成 JSON: {output_path}")
+    else:
+        print(f"✓ JSON 未變更: {output_path}")
 
 
 def main():
@@ -214,8 +289,27 @@ def main():
     if not config:
         sys.exit(1)
 
-    # 裁切
-    crop_from_config(year, config)
+    # 裁切（建置清單會跳過未變更的題目，加上 --force 可全部重新裁切）
+    manifest = BuildManifest()
+    if '--force' in sys.argv[1:]:
+        manifest.entries.clear()
+
+    # --trim: 裁掉題目四周的空白，保留 DEFAULT_TRIM_PAD 像素邊距（--trim-pad N 可調整邊距）
+    trim_pad = None
+    if '--trim-pad' in sys.argv[1:]:
+        trim_pad = int(sys.argv[sys.argv.index('--trim-pad') + 1])
+    elif '--trim' in sys.argv[1:]:
+        trim_pad = DEFAULT_TRIM_PAD
+
+    # --variants: 另外產生 WebP / AVIF 多尺寸版本，imageUrls 改用 WebP
+    # --ocr-text: 由頁面 OCR 的字詞框組出每題的 ocrText（OCR 快取中沒有的頁面會另外以 EasyOCR 整頁辨識，需要安裝 easyocr）
+    # --workers N: 裁切行程數（預設為 CPU 核心數，1 表示不使用行程池）
+    workers = int(sys.argv[sys.argv.index('--workers') + 1]) if '--workers' in sys.argv[1:] else None
+
+    crop_from_config(year, config, manifest, lossless='--lossless' in sys.argv[1:], workers=workers,
+                     variants='--variants' in sys.argv[1:], trim_pad=trim_pad, ocr_text='--ocr-text' in sys.argv[1:])
+    manifest.save()
+    print(f"  裁切: {stats_summary()}")
 
     # 複製 JSON 到 public
     print("\n複製 JSON 到 public 目錄...")
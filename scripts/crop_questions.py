@@ -6,156 +6,326 @@
 
 import os
 import sys
+import argparse
 import re
+import time
 from pathlib import Path
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 from PIL import Image, ImageDraw
 import cv2
 import numpy as np
 
+from build_manifest import BuildManifest, file_digest, params_digest
+from crop_executor import crop_job, run_crop_jobs
+from jpeg_lossless import save_crop, stats_summary
+from ocr_cache import shared_ocr_cache
+from page_dedupe import dedupe_pages, find_duplicate, print_aliases
+from page_store import DEFAULT_BUDGET_MB, configure_shared_store, shared_store
+from segmentation import BINARIZE_METHODS, binarize, find_gaps, layout_blocks, skip_header_gap, split_by_gaps
+
 # 設定路徑
 BASE_DIR = Path(__file__).parent.parent
 SOURCE_DIR = BASE_DIR / "his" / "image"
 OUTPUT_DIR = BASE_DIR / "public" / "images" / "exams"
 
-def find_question_boundaries(image_path: Path, debug=False) -> List[Tuple[int, int, int, int]]:
+# 兩階段模式：先以 1/LAYOUT_SCALE 解析度分析版面，再只裁切全解析度的題目區域
+LAYOUT_SCALE = 4
+
+# 題號 OCR：只辨識區塊左側的長條（寬度為頁寬的比例，左側多留邊距），
+# 至少 NUMBER_STRIP_MIN_INK 個墨水像素的欄才算內容左緣（忽略掃描雜點）
+NUMBER_STRIP_RATIO = 0.06
+NUMBER_STRIP_PAD = 8
+NUMBER_STRIP_MIN_INK = 3
+
+# 題號的左緣與內容左緣的距離上限（頁寬的比例）
+NUMBER_ALIGN_RATIO = 0.015
+
+# tesseract 參數：--psm 4 假設為單欄文字，只允許數字與句點；信心度低於 NUMBER_MIN_CONF 的結果捨棄
+NUMBER_OCR_CONFIG = '--psm 4 -c tessedit_char_whitelist=0123456789.'
+NUMBER_MIN_CONF = 60
+
+
+def find_question_boundaries(image_path: Path, debug=False, method: str = 'adaptive') -> List[Tuple[int, int, int, int]]:
     """
     使用圖像處理找出題目的邊界
+    method: 二值化方法，見 segmentation.BINARIZE_METHODS
     返回: [(y_start, y_end, x_start, x_end), ...]
     """
-    # 讀取圖片
-    img = cv2.imread(str(image_path))
-    if img is None:
+    # 讀取灰階頁面（共用頁面快取，同一頁只解碼一次）
+    try:
+        gray = shared_store().gray(image_path)
+    except OSError:
         print(f"無法讀取圖片: {image_path}")
         return []
 
-    height, width = img.shape[:2]
+    return find_question_boundaries_in_gray(gray, debug=debug, method=method)
+
+
+def load_gray_lowres(image_path: Path, scale: int = LAYOUT_SCALE) -> Tuple[np.ndarray, float, Tuple[int, int]]:
+    """
+    以低解析度讀取灰階頁面
+    JPEG 使用 draft 模式直接以 1/2、1/4、1/8 解碼，不需先解出完整影像
+    返回: (灰階陣列, 實際縮放倍率, 原始尺寸 (寬, 高))
+    """
+    img = Image.open(image_path)
+    full_size = img.size
+
+    if img.format == 'JPEG':
+        img.draft('L', (full_size[0] // scale, full_size[1] // scale))
+        gray = np.asarray(img.convert('L'))
+    else:
+        gray = np.asarray(img.convert('L'))
+        gray = cv2.resize(
+            gray, (full_size[0] // scale, full_size[1] // scale),
+            interpolation=cv2.INTER_AREA
+        )
 
-    # 轉換為灰階
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    factor = full_size[1] / gray.shape[0]
+    return gray, factor, full_size
 
-    # 使用自適應閾值處理
-    binary = cv2.adaptiveThreshold(
-        gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-        cv2.THRESH_BINARY_INV, 11, 2
+
+def find_question_boundaries_two_pass(image_path: Path, scale: int = LAYOUT_SCALE, debug=False, method: str = 'adaptive') -> List[Tuple[int, int, int, int]]:
+    """
+    兩階段版面分析：在低解析度頁面上找題目邊界，再換算回原始座標
+    版面分析以 JPEG draft 模式只解碼低解析度影像（不經過頁面快取），全解析度影像只在裁切時解碼
+    返回: [(y_start, y_end, x_start, x_end), ...]（原始解析度）
+    """
+    gray, factor, (width, height) = load_gray_lowres(image_path, scale)
+
+    boundaries = find_question_boundaries_in_gray(
+        gray,
+        min_gap=max(1, round(30 / factor)),
+        block_size=max(3, int(11 / factor) | 1),
+        debug=debug,
+        method=method
     )
 
+    def to_full_x(x):
+        return width if x >= gray.shape[1] else int(x * factor)
+
+    return [
+        (int(y1 * factor), min(height, int(round(y2 * factor))), to_full_x(x1), to_full_x(x2))
+        for y1, y2, x1, x2 in boundaries
+    ]
+
+
+def find_question_boundaries_in_gray(gray: np.ndarray, min_gap: int = 30, block_size: int = 11, debug=False, method: str = 'adaptive') -> List[Tuple[int, int, int, int]]:
+    """
+    在灰階陣列上找出題目的邊界（可用於任何解析度）
+    多欄頁面先以垂直投影切成各欄區塊，再在每個區塊內依空白列切割
+    min_gap: 最小間隔（像素），block_size: 區域閾值的視窗大小
+    method: 二值化方法，見 segmentation.BINARIZE_METHODS
+    返回: [(y_start, y_end, x_start, x_end), ...]，依閱讀順序排列
+    """
+    # 二值化（預設為自適應閾值）
+    binary = binarize(gray, method, block_size)
+
+    boundaries = []
+    for bx1, by1, bx2, by2 in layout_blocks(binary > 0):
+        boundaries.extend(
+            (by1 + y1, by1 + y2, bx1, bx2)
+            for y1, y2 in split_block_rows(binary[by1:by2, bx1:bx2], min_gap, skip_header=(by1 == 0))
+        )
+
+    if debug:
+        print(f"找到 {len(boundaries)} 個題目區域")
+        for i, (y1, y2, x1, x2) in enumerate(boundaries):
+            print(f"  區域 {i+1}: X={x1}-{x2}, Y={y1}-{y2}, 高度={y2-y1}")
+
+    return boundaries
+
+
+def split_block_rows(binary: np.ndarray, min_gap: int, skip_header: bool = True) -> List[Tuple[int, int]]:
+    """
+    依空白列切割一個區塊（整頁或其中一欄）
+    skip_header: 跳過位於區塊上方 20% 內的第一個大空白（只有頁面頂端的區塊需要）
+    返回: [(y_start, y_end), ...]（區塊內座標）
+    """
+    height = binary.shape[0]
+
     # 計算每一行的黑色像素數量
     row_densities = np.sum(binary, axis=1) / 255
 
     # 找出文字密集的區域（題目通常有較高的像素密度）
     threshold = np.mean(row_densities) * 0.3
 
-    # 找出題目分隔線（空白區域）
-    separators = []
-    min_gap = 30  # 最小間隔（像素）
+    # 找出題目分隔線（空白區域），長度需大於 min_gap
     gap_threshold = threshold * 0.5
+    separators = find_gaps(row_densities < gap_threshold, min_gap + 1)
 
-    in_gap = False
-    gap_start = 0
-
-    for i, density in enumerate(row_densities):
-        if density < gap_threshold:
-            if not in_gap:
-                gap_start = i
-                in_gap = True
-        else:
-            if in_gap and (i - gap_start) > min_gap:
-                separators.append((gap_start, i))
-            in_gap = False
-
-    # 如果沒有找到分隔線，將整頁當作一個題目
+    # 如果沒有找到分隔線，將整個區塊當作一個題目
     if len(separators) == 0:
-        return [(0, height, 0, width)]
-
-    # 根據分隔線建立題目邊界
-    boundaries = []
+        return [(0, height)]
 
     # 跳過第一個大空白區域（通常是頁首）
     start_y = 0
-    if len(separators) > 0 and separators[0][0] < height * 0.2:
-        start_y = separators[0][1]
-        separators = separators[1:]
+    if skip_header:
+        start_y, separators = skip_header_gap(separators, height, 0.2)
 
-    # 處理每個分隔區域之間的內容
-    for i, (gap_start, gap_end) in enumerate(separators):
-        if gap_start - start_y > min_gap:  # 確保有足夠的內容
-            boundaries.append((start_y, gap_start, 0, width))
-        start_y = gap_end
+    # 根據分隔線建立題目邊界（確保有足夠的內容）
+    return split_by_gaps(separators, height, min_gap, start_y)
 
-    # 加上最後一個區域
-    if height - start_y > min_gap:
-        boundaries.append((start_y, height, 0, width))
 
-    if debug:
-        print(f"找到 {len(boundaries)} 個題目區域")
-        for i, (y1, y2, x1, x2) in enumerate(boundaries):
-            print(f"  區域 {i+1}: Y={y1}-{y2}, 高度={y2-y1}")
+def find_number_strip(ink: np.ndarray, block: Tuple[int, int, int, int]) -> Optional[Tuple[int, int, int, int]]:
+    """
+    找出區塊左側放題號的窄長條
+    左緣為區塊內第一個有墨水的欄（題號總是靠左），寬度為頁寬的 NUMBER_STRIP_RATIO
+    ink: 整頁的墨水遮罩，block: (x1, y1, x2, y2)
+    返回: 長條的 (x1, y1, x2, y2)，區塊內沒有墨水時返回 None
+    """
+    bx1, by1, bx2, by2 = block
+    col_ink = np.count_nonzero(ink[by1:by2, bx1:bx2], axis=0)
+    columns = np.flatnonzero(col_ink >= NUMBER_STRIP_MIN_INK)
+    if len(columns) == 0:
+        return None
+
+    left = bx1 + int(columns[0])
+    strip_width = int(ink.shape[1] * NUMBER_STRIP_RATIO)
+    return (max(bx1, left - NUMBER_STRIP_PAD), by1, min(bx2, left + strip_width), by2)
+
+
+def number_strips(image_path: Path) -> List[Tuple[Tuple[int, int, int, int], Tuple[int, int, int, int]]]:
+    """
+    頁面上每個版面區塊與其題號長條
+    返回: [(區塊, 長條), ...]，沒有墨水的區塊不列入
+    """
+    ink = binarize(shared_store().gray(image_path), 'otsu') > 0
+    strips = []
+    for block in layout_blocks(ink):
+        strip = find_number_strip(ink, block)
+        if strip is not None:
+            strips.append((block, strip))
+    return strips
+
+
+def strip_cache_params(strip: Tuple[int, int, int, int]) -> dict:
+    """題號長條在 OCR 快取中的前處理參數"""
+    return {'image': 'gray', 'strip': list(strip), 'config': NUMBER_OCR_CONFIG}
 
-    return boundaries
 
+def prefetch_number_ocr(image_paths: List[Path], manifest: BuildManifest = None, workers: int = 1) -> int:
+    """
+    先以批次 tesseract（tesseract_batch.py）辨識多頁的題號長條並寫入 OCR 快取，
+    之後 detect_question_number_ocr 逐頁處理時直接命中快取，不必每頁各啟動一次 tesseract
+    workers: tesseract 行程數
+    返回: 實際辨識的長條數（已在快取中的不算）
+    """
+    from tesseract_batch import image_to_data_batch
+
+    cache = shared_ocr_cache()
+    pending = []
+    for image_path in image_paths:
+        image_sha = manifest.digest(image_path) if manifest is not None else file_digest(image_path)
+        for _, strip in number_strips(image_path):
+            if not cache.has(image_sha, 'tesseract', 'eng', strip_cache_params(strip)):
+                pending.append((image_path, image_sha, strip))
+
+    if not pending:
+        return 0
+
+    results, elapsed = image_to_data_batch(
+        [(image_path, strip) for image_path, _, strip in pending],
+        lang='eng', config=NUMBER_OCR_CONFIG, workers=workers
+    )
+    for (_, image_sha, strip), data in zip(pending, results):
+        cache.put(image_sha, 'tesseract', 'eng', strip_cache_params(strip), data, elapsed / len(pending))
+
+    print(f"  tesseract 批次辨識 {len(pending)} 個題號長條，耗時 {elapsed:.2f} 秒 "
+          f"({len(pending) / max(elapsed, 1e-9):.1f} 個/秒，{max(1, min(workers or 1, len(pending)))} 個行程)")
+    return len(pending)
 
-def detect_question_number_ocr(image_path: Path) -> List[Tuple[int, int, int, int]]:
+
+def ocr_number_strip(gray: np.ndarray, strip: Tuple[int, int, int, int], image_sha: str = None) -> List[Tuple[int, int]]:
+    """
+    以 tesseract 辨識長條中的題號（只允許數字與句點、單欄模式）
+    長條右緣可能切到題目文字、選項（A. B. ...）比題號縮排，
+    只採用左緣與內容左緣對齊、以 "12." 或 "12" 開頭的結果
+    image_sha: 頁面的內容雜湊，提供時先查 OCR 快取（鍵值包含長條範圍與 tesseract 參數）
+    返回: [(題號, 頁面上的 y), ...]
+    """
+    x1, y1, x2, y2 = strip
+    align_tolerance = int(gray.shape[1] * NUMBER_ALIGN_RATIO)
+
+    cache = shared_ocr_cache()
+    cache_params = strip_cache_params(strip)
+    data = cache.get(image_sha, 'tesseract', 'eng', cache_params) if image_sha else None
+
+    if data is None:
+        import pytesseract
+
+        start_time = time.perf_counter()
+        data = pytesseract.image_to_data(
+            gray[y1:y2, x1:x2], lang='eng', config=NUMBER_OCR_CONFIG,
+            output_type=pytesseract.Output.DICT
+        )
+        if image_sha:
+            cache.put(image_sha, 'tesseract', 'eng', cache_params, data, time.perf_counter() - start_time)
+
+    positions = []
+    for text, left, top, conf in zip(data['text'], data['left'], data['top'], data['conf']):
+        match = re.match(r'^(\d{1,3})(\.|$)', text.strip())
+        if not match or float(conf) < NUMBER_MIN_CONF or left > NUMBER_STRIP_PAD + align_tolerance:
+            continue
+        num = int(match.group(1))
+        if 1 <= num <= 100:  # 合理的題號範圍
+            positions.append((num, y1 + top))
+    return positions
+
+
+def detect_numbered_questions_ocr(image_path: Path, manifest: BuildManifest = None) -> List[Tuple[Optional[int], Tuple[int, int, int, int]]]:
     """
     使用 OCR 和模式匹配來偵測題號並裁切
     尋找 "1.", "2.", "3." 等模式來分割題目
+    只辨識每個版面區塊左側的窄長條（題號所在處），不辨識整頁文字；辨識結果記錄在 OCR 快取
+    manifest: 建置清單，用來取得已快取的頁面雜湊（省略時重新計算）
+    返回: [(題號, (y_start, y_end, x_start, x_end)), ...]；OCR 沒找到題號而改用密度分析時，題號為 None
     """
-    import pytesseract
+    # 讀取灰階頁面（共用頁面快取）
+    gray = shared_store().gray(image_path)
+    image_sha = manifest.digest(image_path) if manifest is not None else file_digest(image_path)
+    questions = []
 
-    # 讀取圖片
-    img = Image.open(image_path)
-    width, height = img.size
+    for (bx1, by1, bx2, by2), strip in number_strips(image_path):
+        try:
+            positions = ocr_number_strip(gray, strip, image_sha)
+        except Exception as e:
+            print(f"OCR 失敗: {e}")
+            return [(None, boundary) for boundary in find_question_boundaries(image_path)]
 
-    # 使用 pytesseract 獲取文字位置
-    try:
-        data = pytesseract.image_to_data(img, lang='chi_tra+eng', output_type=pytesseract.Output.DICT)
-    except Exception as e:
-        print(f"OCR 失敗: {e}")
-        return find_question_boundaries(image_path)
-
-    # 尋找題號 (1., 2., 3., ... 或 1、2、3、...)
-    question_positions = []
-
-    for i, text in enumerate(data['text']):
-        if text.strip():
-            # 匹配題號模式
-            if re.match(r'^\d+[\.\、]$', text.strip()) or re.match(r'^\d+$', text.strip()):
-                try:
-                    num = int(re.sub(r'[\.\、]', '', text.strip()))
-                    if 1 <= num <= 100:  # 合理的題號範圍
-                        y = data['top'][i]
-                        question_positions.append((num, y))
-                except:
-                    pass
-
-    # 排序並去重
-    question_positions = sorted(set(question_positions), key=lambda x: x[1])
-
-    if len(question_positions) == 0:
-        # 如果 OCR 沒找到題號，使用基於密度的方法
-        return find_question_boundaries(image_path)
+        # 排序並去重
+        positions = sorted(set(positions), key=lambda x: x[1])
 
-    # 根據題號位置建立邊界
-    boundaries = []
+        # 根據題號位置建立邊界
+        for i, (num, y) in enumerate(positions):
+            y_start = y - 10  # 稍微往上一點包含題號
+            y_end = positions[i + 1][1] - 10 if i < len(positions) - 1 else by2
 
-    for i in range(len(question_positions)):
-        y_start = question_positions[i][1] - 10  # 稍微往上一點包含題號
+            # 確保邊界合理
+            if y_end - y_start > 50:  # 最小高度
+                questions.append((num, (max(by1, y_start), min(by2, y_end), bx1, bx2)))
 
-        if i < len(question_positions) - 1:
-            y_end = question_positions[i + 1][1] - 10
-        else:
-            y_end = height
+    if len(questions) == 0:
+        # 如果 OCR 沒找到題號，使用基於密度的方法
+        return [(None, boundary) for boundary in find_question_boundaries(image_path)]
 
-        # 確保邊界合理
-        if y_end - y_start > 50:  # 最小高度
-            boundaries.append((max(0, y_start), min(height, y_end), 0, width))
+    return questions
 
-    return boundaries
+
+def detect_question_number_ocr(image_path: Path, manifest: BuildManifest = None) -> List[Tuple[int, int, int, int]]:
+    """
+    以 OCR 找到的題號位置分割頁面（見 detect_numbered_questions_ocr），只返回邊界
+    返回: [(y_start, y_end, x_start, x_end), ...]
+    """
+    return [boundary for _, boundary in detect_numbered_questions_ocr(image_path, manifest)]
 
 
-def crop_questions_simple(image_path: Path, year: str, page_num: int) -> List[Path]:
+def crop_questions_simple(image_path: Path, year: str, page_num: int, manifest: BuildManifest = None, two_pass: bool = False, method: str = 'adaptive', lossless: bool = False) -> List[Path]:
     """
     簡單的裁切方法：基於圖像密度分析
+    manifest: 建置清單，頁面未變更時直接沿用上次的裁切結果
+    two_pass: 在低解析度頁面上分析版面，全解析度影像只用於裁切
+    method: 版面分析的二值化方法
+    lossless: JPEG 來源以 jpegtran 無損裁切（起點對齊 MCU）
     """
     print(f"處理 {image_path.name}...")
 
@@ -163,15 +333,27 @@ def crop_questions_simple(image_path: Path, year: str, page_num: int) -> List[Pa
     year_dir = OUTPUT_DIR / year / "questions"
     year_dir.mkdir(parents=True, exist_ok=True)
 
-    # 獲取題目邊界
-    boundaries = find_question_boundaries(image_path, debug=True)
+    if manifest is not None:
+        stage_key = f"crop_questions/density/{year}/{page_num}"
+        stage_inputs = params_digest(manifest.digest(image_path), page_num, two_pass, method, lossless)
+        if manifest.is_fresh(stage_key, stage_inputs):
+            manifest.mark_skipped()
+            cropped_images = manifest.outputs(stage_key)
+            print(f"  頁面未變更，沿用 {len(cropped_images)} 題")
+            return cropped_images
+
+    # 獲取題目邊界（單階段時版面分析與裁切共用同一份解碼結果；兩階段時版面分析只解碼低解析度影像）
+    store = shared_store()
+    if two_pass:
+        boundaries = find_question_boundaries_two_pass(image_path, debug=True, method=method)
+    else:
+        boundaries = find_question_boundaries(image_path, debug=True, method=method)
 
     if len(boundaries) == 0:
         print(f"  警告: 無法在 {image_path.name} 中偵測到題目")
         return []
 
-    # 開啟原始圖片
-    img = Image.open(image_path)
+    _, page_height = store.size(image_path)
 
     cropped_images = []
 
@@ -183,26 +365,29 @@ def crop_questions_simple(image_path: Path, year: str, page_num: int) -> List[Pa
         # 加上一些邊距
         margin = 10
         y1 = max(0, y1 - margin)
-        y2 = min(img.height, y2 + margin)
-
-        # 裁切圖片
-        cropped = img.crop((x1, y1, x2, y2))
+        y2 = min(page_height, y2 + margin)
 
-        # 儲存裁切後的圖片
+        # 裁切並儲存圖片
         question_num = base_question_num + idx
         output_path = year_dir / f"q{question_num:03d}.jpg"
-        cropped.save(output_path, 'JPEG', quality=95)
+        save_crop(image_path, (x1, y1, x2, y2), output_path, lossless, store)
         cropped_images.append(output_path)
 
         print(f"  已裁切題目 {question_num}: {y2-y1}px 高")
 
+    if manifest is not None:
+        manifest.record(stage_key, stage_inputs, cropped_images)
+
     return cropped_images
 
 
-def process_year_manual_split(year: str, questions_per_page: List[int]):
+def process_year_manual_split(year: str, questions_per_page: List[int], manifest: BuildManifest = None, lossless: bool = False, workers: int = None):
     """
     手動指定每頁的題目數量進行裁切
     questions_per_page: 每頁題目數量的列表，例如 [0, 3, 4, 3, 4, ...]
+    manifest: 建置清單，頁面、題數與起始題號都未變更時跳過該頁
+    lossless: JPEG 來源以 jpegtran 無損裁切（起點對齊 MCU）
+    workers: 裁切行程數（見 crop_executor.run_crop_jobs）
     """
     source_year_dir = SOURCE_DIR / year
 
@@ -219,8 +404,14 @@ def process_year_manual_split(year: str, questions_per_page: List[int]):
     print(f"\n處理 {year} 年，共 {len(files)} 頁")
 
     all_cropped = []
+    jobs = []
+    page_records = []
     current_question = 1
 
+    # 重複的頁面只處理一次（封面除外）
+    canonical = dedupe_pages(files[1:], manifest)
+    print_aliases(canonical)
+
     for page_idx, image_path in enumerate(files):
         page_num = page_idx + 1
 
@@ -229,6 +420,11 @@ def process_year_manual_split(year: str, questions_per_page: List[int]):
             print(f"第 {page_num} 頁: 封面，跳過")
             continue
 
+        duplicate = find_duplicate(image_path, canonical)
+        if duplicate is not None:
+            print(f"第 {page_num} 頁: 與 {duplicate.name} 相同，跳過")
+            continue
+
         print(f"\n第 {page_num} 頁:")
 
         # 獲取這一頁的題目數量
@@ -241,36 +437,57 @@ def process_year_manual_split(year: str, questions_per_page: List[int]):
             print(f"  跳過此頁")
             continue
 
-        # 開啟圖片
-        img = Image.open(image_path)
-        height = img.height
+        year_dir = OUTPUT_DIR / year / "questions"
+        year_dir.mkdir(parents=True, exist_ok=True)
+
+        if manifest is not None:
+            stage_key = f"crop_questions/manual/{year}/{page_num}"
+            stage_inputs = params_digest(manifest.digest(image_path), num_questions, current_question, lossless)
+            if manifest.is_fresh(stage_key, stage_inputs):
+                manifest.mark_skipped()
+                page_outputs = manifest.outputs(stage_key)
+                all_cropped.extend(page_outputs)
+                current_question += len(page_outputs)
+                print(f"  頁面未變更，沿用 {len(page_outputs)} 題")
+                continue
+
+        # 只讀取頁面尺寸，裁切最後一次交給裁切執行器
+        store = shared_store()
+        width, height = store.size(image_path)
 
         # 簡單平均分割
         section_height = height // num_questions
-
-        year_dir = OUTPUT_DIR / year / "questions"
-        year_dir.mkdir(parents=True, exist_ok=True)
+        page_outputs = []
 
         for i in range(num_questions):
             y1 = i * section_height
             y2 = (i + 1) * section_height if i < num_questions - 1 else height
 
-            # 裁切
-            cropped = img.crop((0, y1, img.width, y2))
-
-            # 儲存
             output_path = year_dir / f"q{current_question:03d}.jpg"
-            cropped.save(output_path, 'JPEG', quality=95)
+            jobs.append(crop_job(image_path, (0, y1, width, y2), output_path))
             all_cropped.append(output_path)
+            page_outputs.append(output_path)
 
             print(f"  題目 {current_question}: {y2-y1}px")
             current_question += 1
 
+        if manifest is not None:
+            page_records.append((stage_key, stage_inputs, page_outputs))
+
+    results = run_crop_jobs(jobs, workers, lossless)
+
+    # 裁切失敗的題目不列入結果，所在頁面也不記錄到建置清單
+    failed = {job.output for job in jobs} - results.keys()
+    all_cropped = [path for path in all_cropped if path not in failed]
+    for stage_key, stage_inputs, page_outputs in page_records:
+        if not failed.intersection(page_outputs):
+            manifest.record(stage_key, stage_inputs, page_outputs)
+
     print(f"\n完成！共裁切 {len(all_cropped)} 題")
     return all_cropped
 
 
-def process_year_auto(year: str):
+def process_year_auto(year: str, manifest: BuildManifest = None, two_pass: bool = False, method: str = 'adaptive', lossless: bool = False):
     """
     自動偵測並裁切題目
     """
@@ -292,6 +509,10 @@ def process_year_auto(year: str):
 
     all_cropped = []
 
+    # 重複的頁面只處理一次（封面除外）
+    canonical = dedupe_pages(files[1:], manifest)
+    print_aliases(canonical)
+
     for page_idx, image_path in enumerate(files):
         page_num = page_idx + 1
 
@@ -300,8 +521,13 @@ def process_year_auto(year: str):
             print(f"\n第 {page_num} 頁: 封面，跳過")
             continue
 
+        duplicate = find_duplicate(image_path, canonical)
+        if duplicate is not None:
+            print(f"\n第 {page_num} 頁: 與 {duplicate.name} 相同，跳過")
+            continue
+
         print(f"\n第 {page_num} 頁:")
-        cropped = crop_questions_simple(image_path, year, page_num)
+        cropped = crop_questions_simple(image_path, year, page_num, manifest, two_pass, method, lossless)
         all_cropped.extend(cropped)
 
     print(f"\n{'='*60}")
@@ -311,8 +537,34 @@ def process_year_auto(year: str):
     return all_cropped
 
 
+def parse_args():
+    """解析命令列參數"""
+    parser = argparse.ArgumentParser(description="試卷題目自動裁切工具")
+    parser.add_argument("--force", action="store_true", help="忽略建置清單，全部重新裁切")
+    parser.add_argument("--two-pass", action="store_true", help="在低解析度頁面上分析版面")
+    parser.add_argument(
+        "--binarize", choices=BINARIZE_METHODS, default='adaptive',
+        help="版面分析的二值化方法 (預設 adaptive)"
+    )
+    parser.add_argument(
+        "--page-cache-mb", type=int, default=DEFAULT_BUDGET_MB,
+        help=f"解碼頁面快取的上限 (MB，預設 {DEFAULT_BUDGET_MB})"
+    )
+    parser.add_argument(
+        "--disk-cache", action="store_true",
+        help="將解碼後的灰階頁面存在 scripts/.cache/pages，重新執行時以 memory map 開啟"
+    )
+    parser.add_argument(
+        "--lossless", action="store_true",
+        help="JPEG 來源以 jpegtran 無損裁切（起點往上對齊 MCU），不重新編碼"
+    )
+    return parser.parse_args()
+
+
 def main():
     """主程式"""
+    args = parse_args()
+
     # 設定 Windows 控制台編碼
     if sys.platform == 'win32':
         import locale
@@ -331,13 +583,25 @@ def main():
 
     years = ['2020', '2021', '2022', '2023']
 
+    # 建置清單：頁面未變更就跳過（加上 --force 可全部重新裁切）
+    manifest = BuildManifest()
+    if args.force:
+        manifest.entries.clear()
+
+    store = configure_shared_store(args.page_cache_mb, disk_cache=args.disk_cache)
+
     for year in years:
         try:
-            process_year_auto(year)
+            process_year_auto(year, manifest, two_pass=args.two_pass, method=args.binarize, lossless=args.lossless)
         except Exception as e:
             print(f"\nERROR - 處理 {year} 年時發生錯誤: {e}")
             import traceback
             traceback.print_exc()
+        manifest.save()
+
+    print(f"\n建置清單: {manifest.summary()}")
+    print(f"頁面快取: {store.summary()}")
+    print(f"裁切: {stats_summary()}")
 
     print("\n" + "="*60)
     print("所有年份處理完成！")
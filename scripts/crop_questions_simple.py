@@ -7,63 +7,82 @@
 import os
 import sys
 import re
-import json
+import time
 from pathlib import Path
 from PIL import Image
-import cv2
 import numpy as np
 
+from asset_manifest import load_asset_manifest, publish_year, question_urls
+from build_manifest import BuildManifest, params_digest, write_json_if_changed
+from crop_executor import crop_job, run_crop_jobs
+from image_variants import build_variants
+from jpeg_lossless import stats_summary
+from page_dedupe import dedupe_pages, find_duplicate, print_aliases, unique_pages
+from page_words import crop_ocr_texts
+from page_store import DEFAULT_BUDGET_MB, PageStore, configure_shared_store, shared_store
+from segmentation import (
+    find_gaps, drop_header_gaps, split_by_gaps,
+    load_page_stacks, batch_profiles, batch_column_ink, find_gaps_batch,
+    find_gutters, layout_blocks, MIN_GUTTER_RATIO, GUTTER_INK_RATIO,
+)
+
 # 設定路徑
 BASE_DIR = Path(__file__).parent.parent
 SOURCE_DIR = BASE_DIR / "his" / "image"
 OUTPUT_DIR = BASE_DIR / "public" / "images" / "exams"
 DATA_DIR = BASE_DIR / "scripts" / "output"
 
+# 空白分割參數
+WHITE_THRESHOLD = 240  # 接近白色
+MIN_GAP = 40
+
 # 確保輸出目錄存在
 DATA_DIR.mkdir(parents=True, exist_ok=True)
 
 
-def find_horizontal_gaps(image_path: Path, min_gap=40):
-    """找出水平空白區域來分割題目"""
-    img = cv2.imread(str(image_path), cv2.IMREAD_GRAYSCALE)
-    if img is None:
-        return []
-
-    height, width = img.shape
-
-    # 計算每一行的平均亮度（白色=255，黑色=0）
-    row_brightness = np.mean(img, axis=1)
-
-    # 找出明顯的空白行（亮度高的區域）
-    threshold = 240  # 接近白色
-    white_rows = row_brightness > threshold
-
-    # 找出連續的空白區域
-    gaps = []
-    in_gap = False
-    gap_start = 0
-
-    for i, is_white in enumerate(white_rows):
-        if is_white:
-            if not in_gap:
-                gap_start = i
-                in_gap = True
-        else:
-            if in_gap and (i - gap_start) >= min_gap:
-                gaps.append((gap_start, i))
-            in_gap = False
-
-    return gaps
-
-
-def crop_page_smart(image_path: Path, expected_questions=3):
-    """智能裁切：根據空白區域分割題目"""
-    img = Image.open(image_path)
-    width, height = img.size
-
-    # 找出空白區域
-    gaps = find_horizontal_gaps(image_path)
-
+def crop_page_smart(image_path: Path, expected_questions=3, store: PageStore = None):
+    """
+    智能裁切：根據空白區域分割題目
+    store: 頁面快取（預設為共用快取）
+    返回: [(y_start, y_end, x_start, x_end), ...]
+    """
+    try:
+        gray = (store or shared_store()).gray(image_path)
+    except OSError:
+        # 無法解碼時平均分割
+        width, height = Image.open(image_path).size
+        return [(y1, y2, 0, width) for y1, y2 in boundaries_from_gaps([], height, expected_questions)]
+
+    return segment_page(gray, expected_questions)
+
+
+def segment_page(gray: np.ndarray, expected_questions=3, col_ink: np.ndarray = None):
+    """
+    分割一頁灰階影像；多欄頁面先依欄切成區塊，再在每個區塊內找空白列
+    col_ink: 預先計算好的每欄墨水比例（批次模式使用）
+    返回: [(y_start, y_end, x_start, x_end), ...]，依閱讀順序排列
+    """
+    height, width = gray.shape
+    blocks = layout_blocks(gray < WHITE_THRESHOLD, col_ink)
+
+    # 單欄頁面維持原本的整頁分割
+    if len(blocks) == 1:
+        gaps = find_gaps(np.mean(gray, axis=1) > WHITE_THRESHOLD, MIN_GAP)
+        return [(y1, y2, 0, width) for y1, y2 in boundaries_from_gaps(gaps, height, expected_questions)]
+
+    regions = []
+    for bx1, by1, bx2, by2 in blocks:
+        block_height = by2 - by1
+        gaps = find_gaps(np.mean(gray[by1:by2, bx1:bx2], axis=1) > WHITE_THRESHOLD, MIN_GAP)
+        regions.extend(
+            (by1 + y1, by1 + y2, bx1, bx2)
+            for y1, y2 in split_by_gaps(drop_header_gaps(gaps, block_height, 0.1), block_height, 100)
+        )
+    return regions
+
+
+def boundaries_from_gaps(gaps, height, expected_questions=3):
+    """根據空白區域決定題目範圍"""
     if len(gaps) == 0:
         # 沒有明顯空白，平均分割
         section_height = height // expected_questions
@@ -72,27 +91,86 @@ def crop_page_smart(image_path: Path, expected_questions=3):
             for i in range(expected_questions)
         ]
     else:
-        # 根據空白區域分割
-        boundaries = []
-        start_y = 0
-
         # 過濾掉頁首的大空白
-        filtered_gaps = [g for g in gaps if g[0] > height * 0.1]
-
-        for gap_start, gap_end in filtered_gaps:
-            if gap_start - start_y > 100:  # 確保有足夠內容
-                boundaries.append((start_y, gap_start))
-            start_y = gap_end
+        filtered_gaps = drop_header_gaps(gaps, height, 0.1)
 
-        # 加上最後一段
-        if height - start_y > 100:
-            boundaries.append((start_y, height))
+        # 根據空白區域分割（確保有足夠內容）
+        boundaries = split_by_gaps(filtered_gaps, height, 100)
 
     return boundaries
 
 
-def process_year_simple(year: str):
-    """簡單處理：基於觀察的頁面結構"""
+def crop_pages_smart_batch(image_paths, expected_questions=3, store: PageStore = None):
+    """
+    crop_page_smart 的批次版本
+    同尺寸的頁面疊成一個陣列，一次計算所有頁面的列亮度、每欄墨水比例與空白區段，
+    只有偵測到多欄的頁面才逐頁分割
+    store: 頁面快取（預設為共用快取）
+    返回: {圖片路徑: [(y_start, y_end, x_start, x_end), ...]}
+    """
+    results = {}
+
+    for paths, stack, sizes in load_page_stacks(list(image_paths), loader=(store or shared_store()).gray):
+        row_brightness, _ = batch_profiles(stack, sizes)
+        all_gaps = find_gaps_batch(row_brightness > WHITE_THRESHOLD, MIN_GAP)
+        col_ink = batch_column_ink(stack, sizes, WHITE_THRESHOLD)
+
+        for i, (path, (height, width), gaps) in enumerate(zip(paths, sizes.tolist(), all_gaps)):
+            if find_gutters(col_ink[i], width):
+                results[path] = segment_page(stack[i, :height, :width], expected_questions, col_ink[i])
+            else:
+                results[path] = [(y1, y2, 0, width) for y1, y2 in boundaries_from_gaps(gaps, height, expected_questions)]
+
+    return results
+
+
+def segment_year_pages(files, year, manifest: BuildManifest = None):
+    """
+    批次分割一個年份的所有頁面
+    manifest: 建置清單，頁面未變更時直接沿用上次的分割結果
+    返回: {圖片路徑: [(y_start, y_end, x_start, x_end), ...]}
+    """
+    results = {}
+    pending = []
+
+    for image_path in files:
+        if manifest is not None:
+            stage_key = f"crop_questions_simple/segment/{year}/{image_path.name}"
+            stage_inputs = params_digest(manifest.digest(image_path), WHITE_THRESHOLD, MIN_GAP, MIN_GUTTER_RATIO, GUTTER_INK_RATIO)
+            if manifest.is_fresh(stage_key, stage_inputs):
+                manifest.mark_skipped()
+                results[image_path] = [tuple(b) for b in manifest.meta(stage_key)['boundaries']]
+                continue
+        pending.append(image_path)
+
+    if pending:
+        start_time = time.perf_counter()
+        segmented = crop_pages_smart_batch(pending)
+        elapsed = time.perf_counter() - start_time
+        print(f"批次分割 {len(segmented)} 頁，耗時 {elapsed:.2f} 秒 ({len(segmented) / max(elapsed, 1e-9):.1f} 頁/秒)")
+
+        for image_path, boundaries in segmented.items():
+            results[image_path] = boundaries
+            if manifest is not None:
+                manifest.record(
+                    f"crop_questions_simple/segment/{year}/{image_path.name}",
+                    params_digest(manifest.digest(image_path), WHITE_THRESHOLD, MIN_GAP, MIN_GUTTER_RATIO, GUTTER_INK_RATIO),
+                    [],
+                    {'boundaries': boundaries}
+                )
+
+    return results
+
+
+def process_year_simple(year: str, manifest: BuildManifest = None, lossless: bool = False, workers: int = None, variants: bool = False, ocr_text: bool = False):
+    """
+    簡單處理：基於觀察的頁面結構
+    manifest: 建置清單，頁面與起始題號都未變更時跳過該頁
+    lossless: JPEG 來源以 jpegtran 無損裁切（起點對齊 MCU）
+    workers: 裁切行程數（見 crop_executor.run_crop_jobs）
+    variants: 另外產生 WebP / AVIF 多尺寸版本（見 image_variants.py），imageUrls 改用 WebP
+    ocr_text: 由頁面 OCR 的字詞框組出每題的 ocrText（見 page_words.py）；這個腳本本身不做 OCR，OCR 快取中沒有的頁面會另外整頁辨識一次
+    """
     source_year_dir = SOURCE_DIR / year
 
     if not source_year_dir.exists():
@@ -113,8 +191,17 @@ def process_year_simple(year: str):
     year_dir.mkdir(parents=True, exist_ok=True)
 
     all_cropped = []
+    jobs = []
+    page_records = []
     question_num = 1
 
+    # 重複的頁面只處理一次（封面除外）
+    canonical = dedupe_pages(files[1:], manifest)
+    print_aliases(canonical)
+
+    # 一次分割所有不重複的頁面
+    page_boundaries = segment_year_pages(unique_pages(files[1:], canonical), year, manifest)
+
     for page_idx, image_path in enumerate(files):
         page_num = page_idx + 1
 
@@ -123,10 +210,26 @@ def process_year_simple(year: str):
             print(f"第 {page_num} 頁: 封面，跳過")
             continue
 
+        duplicate = find_duplicate(image_path, canonical)
+        if duplicate is not None:
+            print(f"第 {page_num} 頁: 與 {duplicate.name} 相同，跳過")
+            continue
+
         print(f"\n第 {page_num} 頁:")
 
+        if manifest is not None:
+            stage_key = f"crop_questions_simple/{year}/{page_num}"
+            stage_inputs = params_digest(manifest.digest(image_path), question_num, page_boundaries.get(image_path), lossless)
+            if manifest.is_fresh(stage_key, stage_inputs):
+                manifest.mark_skipped()
+                page_outputs = manifest.outputs(stage_key)
+                all_cropped.extend(page_outputs)
+                question_num += len(page_outputs)
+                print(f"  頁面未變更，沿用 {len(page_outputs)} 題")
+                continue
+
         # 智能裁切
-        boundaries = crop_page_smart(image_path)
+        boundaries = page_boundaries.get(image_path)
 
         if not boundaries:
             print("  無法分割，跳過")
@@ -134,36 +237,63 @@ def process_year_simple(year: str):
 
         print(f"  找到 {len(boundaries)} 個題目區域")
 
-        # 開啟並裁切
-        img = Image.open(image_path)
+        # 先規劃所有頁面的裁切，最後一次交給裁切執行器
+        store = shared_store()
+        page_width, page_height = store.size(image_path)
+        page_outputs = []
 
-        for i, (y_start, y_end) in enumerate(boundaries):
+        for i, (y_start, y_end, x_start, x_end) in enumerate(boundaries):
             # 加上邊距
             margin = 10
             y1 = max(0, y_start - margin)
-            y2 = min(img.height, y_end + margin)
+            y2 = min(page_height, y_end + margin)
+            x1 = max(0, x_start - margin)
+            x2 = min(page_width, x_end + margin)
 
-            # 裁切
-            cropped = img.crop((0, y1, img.width, y2))
-
-            # 儲存
             output_path = year_dir / f"q{question_num:03d}.jpg"
-            cropped.save(output_path, 'JPEG', quality=95)
+            jobs.append(crop_job(image_path, (x1, y1, x2, y2), output_path))
             all_cropped.append(output_path)
+            page_outputs.append(output_path)
 
             print(f"  題目 {question_num}: {y2-y1}px")
             question_num += 1
 
+        if manifest is not None:
+            page_records.append((stage_key, stage_inputs, page_outputs))
+
+    results = run_crop_jobs(jobs, workers, lossless)
+
+    # 裁切失敗的題目不列入結果，所在頁面也不記錄到建置清單
+    failed = {job.output for job in jobs} - results.keys()
+    all_cropped = [path for path in all_cropped if path not in failed]
+    for stage_key, stage_inputs, page_outputs in page_records:
+        if not failed.intersection(page_outputs):
+            manifest.record(stage_key, stage_inputs, page_outputs)
+
     print(f"\n完成！共裁切 {len(all_cropped)} 題")
 
+    if variants:
+        build_variants(list(all_cropped), manifest, workers)
+
+    # 以內容雜湊命名的檔案與 manifest.json，未變更的圖片網址不變
+    publish_year(year, {idx + 1: path for idx, path in enumerate(all_cropped)}, manifest)
+
+    ocr_texts = crop_ocr_texts(all_cropped, manifest) if ocr_text else None
+
     # 生成 JSON
-    generate_exam_json(year, all_cropped)
+    generate_exam_json(year, all_cropped, ocr_texts)
 
     return all_cropped
 
 
-def generate_exam_json(year: str, image_paths):
-    """生成試卷 JSON 檔案"""
+def generate_exam_json(year: str, image_paths, ocr_texts: dict = None):
+    """
+    生成試卷 JSON 檔案
+    ocr_texts: {圖片路徑: 文字}，提供時每題加上 ocrText
+    """
+    # 以內容雜湊命名的網址（見 asset_manifest.py）
+    assets = load_asset_manifest()
+
     exam_data = {
         "title": f"{year}年感染症專科醫師甄審筆試",
         "year": int(year),
@@ -172,15 +302,14 @@ def generate_exam_json(year: str, image_paths):
     }
 
     for idx, img_path in enumerate(image_paths):
-        rel_path = img_path.relative_to(BASE_DIR / "public")
-        url_path = "/" + str(rel_path).replace("\\", "/")
+        image_url, image_urls = question_urls(year, idx + 1, img_path, assets)
 
         question = {
             "order": idx,
             "content": f"第 {idx + 1} 題",
             "type": "CHOICE",
-            "imageUrl": url_path,
-            "imageUrls": [url_path],
+            "imageUrl": image_url,
+            "imageUrls": image_urls,
             "options": [
                 {"text": "A", "order": 0},
                 {"text": "B", "order": 1},
@@ -191,14 +320,16 @@ def generate_exam_json(year: str, image_paths):
             "correctAnswer": "",
             "answerExplanation": ""
         }
+        if ocr_texts is not None:
+            question["ocrText"] = ocr_texts.get(img_path) or None
         exam_data["questions"].append(question)
 
     # 儲存 JSON
     output_path = DATA_DIR / f"exam_{year}.json"
-    with open(output_path, 'w', encoding='utf-8') as f:
-        json.dump(exam_data, f, ensure_ascii=False, indent=2)
-
-    print(f"已生成 JSON: {output_path}")
+    if write_json_if_changed(output_path, exam_data):
+        print(f"已生成 JSON: {output_path}")
+    else:
+        print(f"JSON 未變更: {output_path}")
 
 
 def main():
@@ -222,13 +353,34 @@ def main():
 
     years = ['2020', '2021', '2022', '2023']
 
+    # 建置清單：頁面未變更就跳過（加上 --force 可全部重新裁切）
+    manifest = BuildManifest()
+    if '--force' in sys.argv[1:]:
+        manifest.entries.clear()
+
+    # 加上 --disk-cache 時灰階頁面存在磁碟上，重新執行的版面分析不必再解碼
+    configure_shared_store(DEFAULT_BUDGET_MB, disk_cache='--disk-cache' in sys.argv[1:])
+
+    # --variants: 另外產生 WebP / AVIF 多尺寸版本，imageUrls 改用 WebP
+    # --ocr-text: 由頁面 OCR 的字詞框組出每題的 ocrText（OCR 快取中沒有的頁面會另外以 EasyOCR 整頁辨識，需要安裝 easyocr）
+    # --workers N: 裁切行程數（預設為 CPU 核心數，1 表示不使用行程池）
+    workers = int(sys.argv[sys.argv.index('--workers') + 1]) if '--workers' in sys.argv[1:] else None
+
     for year in years:
         try:
-            process_year_simple(year)
+            process_year_simple(
+                year, manifest, lossless='--lossless' in sys.argv[1:], workers=workers,
+                variants='--variants' in sys.argv[1:], ocr_text='--ocr-text' in sys.argv[1:]
+            )
         except Exception as e:
             print(f"\nERROR - {year}: {e}")
             import traceback
             traceback.print_exc()
+        manifest.save()
+
+    print(f"\n建置清單: {manifest.summary()}")
+    print(f"頁面快取: {shared_store().summary()}")
+    print(f"裁切: {stats_summary()}")
 
     # 複製 JSON 到 public
     print("\n複製 JSON 到 public 目錄...")
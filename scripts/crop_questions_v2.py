@@ -4,40 +4,41 @@
 Version 2: 使用 EasyOCR 進行更準確的題號辨識
 """
 
+import json
 import os
 import sys
 import re
 from pathlib import Path
-from PIL import Image
-import cv2
-import numpy as np
+from typing import Dict, List, Tuple
+
+from asset_manifest import hashed_path, is_hashed_name
+from build_manifest import BuildManifest, file_digest, params_digest, write_json_if_changed
+from crop_executor import CropJob, CropResult, crop_job, load_crop_index, write_crop_index
+from jpeg_lossless import crop_stats, stats_summary, write_crop
+from page_dedupe import dedupe_pages, find_duplicate, print_aliases
+from ocr_cache import shared_ocr_cache
+from ocr_engine import OcrEngine
+from page_store import shared_store
+from page_words import WordIndex, words_from_easyocr
 
 # 設定路徑
 BASE_DIR = Path(__file__).parent.parent
 SOURCE_DIR = BASE_DIR / "his" / "image"
 OUTPUT_DIR = BASE_DIR / "public" / "images" / "exams"
+DATA_DIR = BASE_DIR / "scripts" / "output"
 
+# OCR 辨識語言
+OCR_LANGUAGES = ('ch_tra', 'en')
 
-def find_question_numbers_with_ocr(image_path: Path):
-    """使用 EasyOCR 找出題號位置"""
-    try:
-        import easyocr
-    except ImportError:
-        print("正在安裝 EasyOCR，請稍候...")
-        import subprocess
-        subprocess.check_call([sys.executable, "-m", "pip", "install", "easyocr"])
-        import easyocr
-
-    # 初始化 OCR reader (第一次會下載模型)
-    reader = easyocr.Reader(['ch_tra', 'en'], gpu=False)
-
-    # 讀取圖片
-    img = cv2.imread(str(image_path))
-    if img is None:
-        return []
 
-    # OCR 辨識
-    results = reader.readtext(str(image_path))
+def find_question_numbers_with_ocr(image_path: Path, results: list = None):
+    """
+    使用 EasyOCR 找出題號位置
+    results: 已辨識的結果（OcrEngine.readtext_batch），省略時以目前行程的常駐 Reader 辨識（先查 OCR 快取）
+    """
+    if results is None:
+        # OCR 辨識（Reader 在行程中只建立一次，第一次會下載模型；頁面放入共用頁面快取，之後裁切不必再解碼）
+        results = OcrEngine(1, OCR_LANGUAGES).readtext(image_path)
 
     # 找出題號
     question_numbers = []
@@ -57,16 +58,56 @@ def find_question_numbers_with_ocr(image_path: Path):
     return question_numbers
 
 
-def crop_by_question_numbers(image_path: Path, year: str) -> List[Path]:
-    """根據辨識到的題號裁切圖片"""
+def question_boxes(question_numbers, width: int, height: int) -> List[Tuple[int, Tuple[int, int, int, int]]]:
+    """
+    每個題號的裁切範圍：從題號上方 20px 到下一題題號上方 20px（最後一題到頁尾）
+    返回: [(題號, (x1, y1, x2, y2)), ...]
+    """
+    boxes = []
+    for i, (qnum, y_pos, bbox) in enumerate(question_numbers):
+        y_start = y_pos - 20  # 稍微往上一點包含題號
+
+        # 下一題的起始位置
+        if i < len(question_numbers) - 1:
+            y_end = question_numbers[i + 1][1] - 20
+        else:
+            y_end = height
+
+        # 確保邊界合理
+        boxes.append((qnum, (0, max(0, y_start), width, min(height, y_end))))
+    return boxes
+
+
+def _stage(image_path: Path, year: str, manifest: BuildManifest, lossless: bool):
+    """建置清單中該頁的 (鍵值, 輸入)"""
+    stage_key = f"crop_questions_v2/{year}/{image_path.name}"
+    stage_inputs = params_digest(manifest.digest(image_path), 'easyocr', list(OCR_LANGUAGES), lossless)
+    return stage_key, stage_inputs
+
+
+def crop_by_question_numbers(image_path: Path, year: str, manifest: BuildManifest = None, lossless: bool = False, ocr_results: list = None) -> List[Path]:
+    """
+    根據辨識到的題號裁切圖片
+    manifest: 建置清單，頁面未變更時跳過 OCR 與裁切
+    lossless: JPEG 來源以 jpegtran 無損裁切（起點對齊 MCU）
+    ocr_results: 已批次辨識的結果，省略時在此辨識
+    """
     print(f"處理 {image_path.name}...")
 
     # 建立輸出目錄
     year_dir = OUTPUT_DIR / year / "questions"
     year_dir.mkdir(parents=True, exist_ok=True)
 
+    if manifest is not None:
+        stage_key, stage_inputs = _stage(image_path, year, manifest, lossless)
+        if manifest.is_fresh(stage_key, stage_inputs):
+            manifest.mark_skipped()
+            cropped_images = manifest.outputs(stage_key)
+            print(f"  頁面未變更，沿用 {len(cropped_images)} 題")
+            return cropped_images
+
     # 使用 OCR 找題號
-    question_numbers = find_question_numbers_with_ocr(image_path)
+    question_numbers = find_question_numbers_with_ocr(image_path, ocr_results)
 
     if len(question_numbers) == 0:
         print(f"  警告: 未找到題號，跳過")
@@ -74,40 +115,120 @@ def crop_by_question_numbers(image_path: Path, year: str) -> List[Path]:
 
     print(f"  找到 {len(question_numbers)} 個題號: {[q[0] for q in question_numbers]}")
 
-    # 開啟圖片
-    img = Image.open(image_path)
+    # 讀取頁面（OCR 時已解碼並放入共用快取）
+    store = shared_store()
+    width, height = store.size(image_path)
 
     cropped_images = []
+    jobs: List[CropJob] = []
+    results: Dict[Path, CropResult] = {}
 
-    for i, (qnum, y_pos, bbox) in enumerate(question_numbers):
-        # 計算裁切區域
-        y_start = y_pos - 20  # 稍微往上一點包含題號
+    for qnum, box in question_boxes(question_numbers, width, height):
+        _, y_start, _, y_end = box
 
-        # 下一題的起始位置
-        if i < len(question_numbers) - 1:
-            y_end = question_numbers[i + 1][1] - 20
-        else:
-            y_end = img.height
-
-        # 確保邊界合理
-        y_start = max(0, y_start)
-        y_end = min(img.height, y_end)
-
-        # 裁切
-        cropped = img.crop((0, y_start, img.width, y_end))
-
-        # 儲存
+        # 裁切並儲存
         output_path = year_dir / f"q{qnum:03d}.jpg"
-        cropped.save(output_path, 'JPEG', quality=95)
+        mode, cropped_box = write_crop(image_path, box, output_path, lossless, store)
+        crop_stats[mode] += 1
         cropped_images.append(output_path)
+        jobs.append(crop_job(image_path, box, output_path))
+        results[output_path] = CropResult(mode, [cropped_box])
 
         print(f"  題目 {qnum}: {y_end - y_start}px 高")
 
+    # 裁切範圍記錄在 crops.json（write_ocr_texts 以此確認題目圖片仍是這裡裁切的）
+    write_crop_index(jobs, results)
+
+    if manifest is not None:
+        manifest.record(stage_key, stage_inputs, cropped_images)
+
     return cropped_images
 
 
-def process_year_with_ocr(year: str):
-    """處理一個年份的所有頁面"""
+def page_ocr_texts(image_path: Path, results: list) -> Dict[int, Tuple[Path, Tuple[int, int, int, int], str]]:
+    """
+    由整頁的辨識結果組出該頁每題的 ocrText（與裁切使用同一份題號位置與裁切範圍）
+    返回: {題號: (頁面, 裁切範圍, 文字)}
+    """
+    index = WordIndex(words_from_easyocr(results))
+    width, height = shared_store().size(image_path)
+    return {
+        qnum: (image_path, box, index.text(box))
+        for qnum, box in question_boxes(find_question_numbers_with_ocr(image_path, results), width, height)
+    }
+
+
+def _same_crop(year_dir: Path, qnum: int, image_path: Path, box: Tuple[int, int, int, int], crop_index: Dict, manifest: BuildManifest, image_url: str) -> bool:
+    """
+    JSON 中的題目圖片是否就是這個腳本以 (image_path, box) 裁切的 qNNN.jpg
+    - crops.json 中 qNNN.jpg 的來源頁面與裁切範圍必須相同（其他裁切腳本會以各自的範圍覆寫）
+    - imageUrl 必須指向 qNNN.jpg，或內容雜湊與目前 qNNN.jpg 相同的 qNNN.<雜湊>.jpg
+    """
+    output_path = year_dir / f"q{qnum:03d}.jpg"
+    entry = crop_index.get(output_path.name)
+    if not entry or len(entry) != 1 or not output_path.exists():
+        return False
+    if (BASE_DIR / entry[0]['page']).resolve() != image_path.resolve() or tuple(entry[0]['requested']) != tuple(box):
+        return False
+
+    name = Path(image_url).name
+    if name == output_path.name:
+        return True
+    sha = manifest.digest(output_path) if manifest is not None else file_digest(output_path)
+    return is_hashed_name(name) and name == hashed_path(output_path, sha).name
+
+
+def write_ocr_texts(year: str, ocr_texts: Dict[int, Tuple[Path, Tuple[int, int, int, int], str]], manifest: BuildManifest = None):
+    """
+    將每題的 ocrText 寫入已生成的 scripts/output/exam_{year}.json（依圖片檔名 qNNN 對應題號）
+    這個腳本只裁切圖片，JSON 由 organize_images.js 或其他裁切腳本生成，題目圖片可能來自其他裁切範圍；
+    只有圖片與 crops.json 的裁切範圍都與這裡相同的題目才寫入，其餘題目不變
+    """
+    output_path = DATA_DIR / f"exam_{year}.json"
+    if not output_path.exists():
+        print(f"  警告: 找不到 {output_path}，請先生成 JSON 再加上 --ocr-text")
+        return
+
+    with open(output_path, 'r', encoding='utf-8') as f:
+        exam_data = json.load(f)
+
+    year_dir = OUTPUT_DIR / year / "questions"
+    crop_index = load_crop_index(year_dir)
+
+    matched = 0
+    mismatched = []
+    for question in exam_data.get('questions', []):
+        image_url = question.get('imageUrl', '')
+        match = re.match(r'q(\d+)', Path(image_url).name)
+        if not match or int(match.group(1)) not in ocr_texts:
+            continue
+
+        qnum = int(match.group(1))
+        image_path, box, text = ocr_texts[qnum]
+        if not _same_crop(year_dir, qnum, image_path, box, crop_index, manifest, image_url):
+            mismatched.append(qnum)
+            continue
+
+        question['ocrText'] = text or None
+        matched += 1
+
+    if mismatched:
+        print(f"  警告: {len(mismatched)} 題的圖片或裁切範圍與這次裁切不同，未寫入 ocrText: {mismatched}")
+        print("        請以相同的裁切結果重新生成 JSON（或加上 --force 重新裁切）後再執行")
+
+    if write_json_if_changed(output_path, exam_data):
+        print(f"  題目文字: 已寫入 {matched} 題的 ocrText: {output_path}")
+    else:
+        print(f"  題目文字: {output_path} 未變更（{matched} 題）")
+
+
+def process_year_with_ocr(year: str, manifest: BuildManifest = None, lossless: bool = False, engine: OcrEngine = None, ocr_text: bool = False):
+    """
+    處理一個年份的所有頁面
+    engine: 常駐的 OCR 引擎；需要辨識的頁面先一次送出整批辨識，再逐頁裁切
+    ocr_text: 由辨識題號時的整頁字詞框組出每題的 ocrText（見 page_words.py），寫入已生成的 JSON；
+              未變更的頁面從 OCR 快取取得辨識結果，不會重新辨識
+    """
     source_year_dir = SOURCE_DIR / year
 
     if not source_year_dir.exists():
@@ -126,6 +247,23 @@ def process_year_with_ocr(year: str):
 
     all_cropped = []
 
+    # 重複的頁面只處理一次（封面除外）
+    canonical = dedupe_pages(files[1:], manifest)
+    print_aliases(canonical)
+
+    # 需要重新辨識的頁面（封面、重複頁面與未變更的頁面除外）整批辨識
+    # 需要 ocrText 時未變更的頁面也一併送出（由 OCR 快取取得結果）
+    ocr_results = {}
+    if engine is not None:
+        pending = [
+            image_path for image_path in files[1:]
+            if find_duplicate(image_path, canonical) is None
+            and (ocr_text or not (manifest is not None and manifest.is_fresh(*_stage(image_path, year, manifest, lossless))))
+        ]
+        if pending:
+            print(f"\nOCR 辨識 {len(pending)} 頁...")
+            ocr_results = engine.readtext_batch(pending)
+
     for page_idx, image_path in enumerate(files):
         page_num = page_idx + 1
 
@@ -134,15 +272,26 @@ def process_year_with_ocr(year: str):
             print(f"\n第 {page_num} 頁: 封面，跳過")
             continue
 
+        duplicate = find_duplicate(image_path, canonical)
+        if duplicate is not None:
+            print(f"\n第 {page_num} 頁: 與 {duplicate.name} 相同，跳過")
+            continue
+
         print(f"\n第 {page_num} 頁:")
 
         try:
-            cropped = crop_by_question_numbers(image_path, year)
+            cropped = crop_by_question_numbers(image_path, year, manifest, lossless, ocr_results.get(image_path))
             all_cropped.extend(cropped)
         except Exception as e:
             print(f"  錯誤: {e}")
             continue
 
+    if ocr_text and engine is not None:
+        ocr_texts = {}
+        for image_path, results in ocr_results.items():
+            ocr_texts.update(page_ocr_texts(image_path, results))
+        write_ocr_texts(year, ocr_texts, manifest)
+
     print(f"\n{'='*60}")
     print(f"完成！{year} 年共裁切 {len(all_cropped)} 題")
     print('='*60)
@@ -172,13 +321,31 @@ def main():
 
     years = ['2020']  # 先測試一個年份
 
-    for year in years:
-        try:
-            process_year_with_ocr(year)
-        except Exception as e:
-            print(f"\nERROR - 處理 {year} 年時發生錯誤: {e}")
-            import traceback
-            traceback.print_exc()
+    # 建置清單：頁面未變更就跳過（加上 --force 可全部重新辨識）
+    manifest = BuildManifest()
+    if '--force' in sys.argv[1:]:
+        manifest.entries.clear()
+
+    # --ocr-text: 以辨識題號時的整頁字詞框組出每題的 ocrText，寫入 scripts/output/exam_{year}.json
+    # --workers N: OCR 行程數（每個行程載入一次模型，預設 1 表示在目前行程中辨識）
+    workers = int(sys.argv[sys.argv.index('--workers') + 1]) if '--workers' in sys.argv[1:] else 1
+
+    # 整個執行期間共用同一個 OCR 引擎，模型只載入一次
+    with OcrEngine(workers, OCR_LANGUAGES, manifest=manifest) as engine:
+        for year in years:
+            try:
+                process_year_with_ocr(year, manifest, lossless='--lossless' in sys.argv[1:], engine=engine,
+                                     ocr_text='--ocr-text' in sys.argv[1:])
+            except Exception as e:
+                print(f"\nERROR - 處理 {year} 年時發生錯誤: {e}")
+                import traceback
+                traceback.print_exc()
+            manifest.save()
+
+    print(f"\n{engine.summary()}")
+    print(shared_ocr_cache().summary())
+    print(f"建置清單: {manifest.summary()}")
+    print(f"裁切: {stats_summary()}")
 
     print("\n" + "="*60)
     print("處理完成！")
@@ -186,6 +353,4 @@ def main():
 
 
 if __name__ == "__main__":
-    # 加上 typing import
-    from typing import List, Tuple
     main()
@@ -9,15 +9,62 @@ import sys
 import json
 import base64
 from pathlib import Path
-from PIL import Image
 import anthropic
 
+from asset_manifest import load_asset_manifest, publish_year, question_urls
+from build_manifest import BuildManifest, params_digest, write_json_if_changed
+from crop_executor import DEFAULT_TRIM_PAD, crop_job, run_crop_jobs
+from image_variants import build_variants
+from jpeg_lossless import stats_summary
+from page_dedupe import dedupe_pages, find_duplicate, print_aliases
+from page_words import crop_ocr_texts
+from page_store import shared_store
+
 # 設定路徑
 BASE_DIR = Path(__file__).parent.parent
 SOURCE_DIR = BASE_DIR / "his" / "image"
 OUTPUT_DIR = BASE_DIR / "public" / "images" / "exams"
 DATA_DIR = BASE_DIR / "scripts" / "output"
 
+# Claude 模型（變更時所有頁面都會重新分析）
+CLAUDE_MODEL = "claude-3-5-sonnet-20241022"
+
+# 分析頁面的提示（{width}、{height}、{half} 為頁面尺寸；變更時所有頁面都會重新分析）
+PROMPT_TEMPLATE = """請仔細分析這張試卷圖片（尺寸：{width}x{height}像素）。
+
+這是一份醫學考試試卷的頁面。請幫我找出這一頁中所有題目的位置。
+
+要求：
+1. 辨識出每個題目的題號（例如：1., 2., 3. 或 26., 27., 28. 等）
+2. 對於每個題目，提供其在圖片中的垂直位置範圍（Y座標的起始和結束位置）
+3. 題目的起始位置應該包含題號，結束位置應該是下一題開始之前
+4. 如果頁面是雙欄（或多欄）排版，另外提供該題所在欄的水平範圍（X座標的起始和結束位置）
+
+請以 JSON 格式回應，格式如下：
+{{
+  "questions": [
+    {{"number": 1, "y_start": 100, "y_end": 400}},
+    {{"number": 2, "y_start": 400, "y_end": 700}},
+    ...
+  ]
+}}
+
+雙欄排版時：
+{{
+  "questions": [
+    {{"number": 1, "y_start": 100, "y_end": 400, "x_start": 0, "x_end": {half}}},
+    {{"number": 2, "y_start": 100, "y_end": 400, "x_start": {half}, "x_end": {width}}},
+    ...
+  ]
+}}
+
+注意：
+- Y座標的範圍是 0 到 {height}，X座標的範圍是 0 到 {width}
+- 單欄排版時省略 x_start 與 x_end
+- 確保每個題目的 y_end 等於或略小於下一題的 y_start
+- 如果這是封面頁或沒有題目，返回空的 questions 陣列
+- 只返回 JSON，不要有其他文字"""
+
 # 確保輸出目錄存在
 DATA_DIR.mkdir(parents=True, exist_ok=True)
 
@@ -44,7 +91,10 @@ def get_image_media_type(image_path):
 
 
 def analyze_page_with_claude(image_path, api_key):
-    """使用 Claude 分析頁面中的題目"""
+    """
+    使用 Claude 分析頁面中的題目
+    返回: 題目列表（沒有題目時為空列表）；API、網路或 JSON 解析失敗時返回 None
+    """
     print(f"  使用 Claude 分析 {image_path.name}...")
 
     client = anthropic.Anthropic(api_key=api_key)
@@ -53,38 +103,15 @@ def analyze_page_with_claude(image_path, api_key):
     image_data = encode_image_to_base64(image_path)
     media_type = get_image_media_type(image_path)
 
-    # 讀取圖片尺寸
-    img = Image.open(image_path)
-    width, height = img.size
+    # 讀取圖片尺寸（只讀取檔頭）
+    width, height = shared_store().size(image_path)
 
     # 建立提示
-    prompt = f"""請仔細分析這張試卷圖片（尺寸：{width}x{height}像素）。
-
-這是一份醫學考試試卷的頁面。請幫我找出這一頁中所有題目的位置。
-
-要求：
-1. 辨識出每個題目的題號（例如：1., 2., 3. 或 26., 27., 28. 等）
-2. 對於每個題目，提供其在圖片中的垂直位置範圍（Y座標的起始和結束位置）
-3. 題目的起始位置應該包含題號，結束位置應該是下一題開始之前
-
-請以 JSON 格式回應，格式如下：
-{{
-  "questions": [
-    {{"number": 1, "y_start": 100, "y_end": 400}},
-    {{"number": 2, "y_start": 400, "y_end": 700}},
-    ...
-  ]
-}}
-
-注意：
-- Y座標的範圍是 0 到 {height}
-- 確保每個題目的 y_end 等於或略小於下一題的 y_start
-- 如果這是封面頁或沒有題目，返回空的 questions 陣列
-- 只返回 JSON，不要有其他文字"""
+    prompt = PROMPT_TEMPLATE.format(width=width, height=height, half=width // 2)
 
     try:
         message = client.messages.create(
-            model="claude-3-5-sonnet-20241022",
+            model=CLAUDE_MODEL,
             max_tokens=2000,
             messages=[
                 {
@@ -127,43 +154,50 @@ def analyze_page_with_claude(image_path, api_key):
 
     except Exception as e:
         print(f"  錯誤: {e}")
-        return []
+        return None
 
 
-def crop_questions_from_analysis(image_path, questions, year):
-    """根據 Claude 的分析結果裁切題目"""
-    if not questions:
-        return []
-
+def plan_question_crops(image_path, questions, year):
+    """
+    根據 Claude 的分析結果規劃裁切工作
+    返回: [(題號, CropJob), ...]
+    """
     # 建立輸出目錄
     year_dir = OUTPUT_DIR / year / "questions"
     year_dir.mkdir(parents=True, exist_ok=True)
 
-    # 開啟圖片
-    img = Image.open(image_path)
+    # 只讀取頁面尺寸（共用頁面快取）
+    width, height = shared_store().size(image_path)
 
-    cropped_images = []
+    planned = []
 
     for q in questions:
         qnum = q['number']
         y_start = max(0, q['y_start'] - 10)  # 加上一點邊距
-        y_end = min(img.height, q['y_end'] + 10)
+        y_end = min(height, q['y_end'] + 10)
 
-        # 裁切
-        cropped = img.crop((0, y_start, img.width, y_end))
+        # 多欄頁面只裁切該題所在的欄
+        x_start = max(0, q.get('x_start', 0))
+        x_end = min(width, q.get('x_end', width))
 
-        # 儲存
         output_path = year_dir / f"q{qnum:03d}.jpg"
-        cropped.save(output_path, 'JPEG', quality=95)
-        cropped_images.append((qnum, output_path))
+        planned.append((qnum, crop_job(image_path, (x_start, y_start, x_end, y_end), output_path)))
 
         print(f"  題目 {qnum}: {y_end - y_start}px")
 
-    return cropped_images
+    return planned
 
 
-def process_year_with_claude(year, api_key):
-    """使用 Claude 處理一個年份"""
+def process_year_with_claude(year, api_key, manifest=None, lossless=False, workers=None, variants=False, trim_pad=None, ocr_text=False):
+    """
+    使用 Claude 處理一個年份
+    manifest: 建置清單，頁面未變更時沿用上次的分析結果，不再呼叫 API
+    lossless: JPEG 來源以 jpegtran 無損裁切（切換時只重新裁切，不重新分析）
+    workers: 裁切行程數（所有頁面分析完後一次裁切，見 crop_executor.run_crop_jobs）
+    variants: 另外產生 WebP / AVIF 多尺寸版本（見 image_variants.py），imageUrls 改用 WebP
+    ocr_text: 由頁面 OCR 的字詞框組出每題的 ocrText（見 page_words.py）；這個腳本本身不做 OCR，OCR 快取中沒有的頁面會另外整頁辨識一次
+    trim_pad: 裁掉題目四周的空白（與 lossless 相同，切換時只重新裁切，不重新分析）
+    """
     source_year_dir = SOURCE_DIR / year
 
     if not source_year_dir.exists():
@@ -182,6 +216,11 @@ def process_year_with_claude(year, api_key):
     print('='*60)
 
     all_questions = {}
+    page_plans = []
+
+    # 重複的頁面只處理一次（封面除外）
+    canonical = dedupe_pages(files[1:], manifest)
+    print_aliases(canonical)
 
     for page_idx, image_path in enumerate(files):
         page_num = page_idx + 1
@@ -191,21 +230,57 @@ def process_year_with_claude(year, api_key):
             print(f"\n第 {page_num} 頁: 封面，跳過")
             continue
 
+        duplicate = find_duplicate(image_path, canonical)
+        if duplicate is not None:
+            print(f"\n第 {page_num} 頁: 與 {duplicate.name} 相同，跳過")
+            continue
+
         print(f"\n第 {page_num} 頁:")
 
         try:
-            # 使用 Claude 分析
-            questions = analyze_page_with_claude(image_path, api_key)
+            stage_key = f"crop_with_claude/{year}/{page_num}"
+            stage_inputs = None
+            cached = None
+
+            if manifest is not None:
+                stage_inputs = params_digest(manifest.digest(image_path), CLAUDE_MODEL, PROMPT_TEMPLATE)
+                previous = manifest.meta(stage_key, stage_inputs)
+                same_crop_mode = (
+                    previous is not None
+                    and previous.get('lossless', False) == lossless
+                    and previous.get('trim_pad') == trim_pad
+                )
+                if same_crop_mode and manifest.is_fresh(stage_key, stage_inputs):
+                    manifest.mark_skipped()
+                    cached = manifest.meta(stage_key)
+                    for q, path in zip(cached['questions'], manifest.outputs(stage_key)):
+                        all_questions[q['number']] = path
+                    print(f"  頁面未變更，沿用 {len(cached['questions'])} 題")
+                    continue
+
+                # 裁切結果被刪除或裁切方式改變，但頁面未變更時，仍可沿用分析結果
+                cached = previous
+
+            if cached is not None:
+                questions = cached['questions']
+                print(f"  沿用上次的分析結果: {len(questions)} 個題目")
+            else:
+                # 使用 Claude 分析
+                questions = analyze_page_with_claude(image_path, api_key)
+
+            # 分析失敗不記錄到建置清單，下次重新分析
+            if questions is None:
+                print("  分析失敗，下次執行時重新分析")
+                continue
 
             if not questions:
                 print("  未找到題目，跳過")
+                if manifest is not None:
+                    manifest.record(stage_key, stage_inputs, [], {'questions': [], 'lossless': lossless, 'trim_pad': trim_pad})
                 continue
 
-            # 裁切題目
-            cropped = crop_questions_from_analysis(image_path, questions, year)
-
-            for qnum, path in cropped:
-                all_questions[qnum] = path
+            # 規劃裁切，所有頁面分析完後一次裁切
+            page_plans.append((stage_key, stage_inputs, questions, plan_question_crops(image_path, questions, year)))
 
         except Exception as e:
             print(f"  錯誤: {e}")
@@ -213,18 +288,43 @@ def process_year_with_claude(year, api_key):
             traceback.print_exc()
             continue
 
+    results = run_crop_jobs([job for *_, planned in page_plans for _, job in planned], workers, lossless, trim_pad=trim_pad)
+
+    for stage_key, stage_inputs, questions, planned in page_plans:
+        cropped = [(qnum, job.output) for qnum, job in planned if job.output in results]
+        for qnum, path in cropped:
+            all_questions[qnum] = path
+
+        # 有題目裁切失敗的頁面不記錄，下次重新處理
+        if manifest is not None and len(cropped) == len(planned):
+            manifest.record(stage_key, stage_inputs, [path for _, path in cropped], {'questions': questions, 'lossless': lossless, 'trim_pad': trim_pad})
+
     print(f"\n{'='*60}")
     print(f"完成！{year} 年共裁切 {len(all_questions)} 題")
     print('='*60)
 
+    if variants:
+        build_variants(list(all_questions.values()), manifest, workers)
+
+    # 以內容雜湊命名的檔案與 manifest.json，未變更的圖片網址不變
+    publish_year(year, all_questions, manifest)
+
+    ocr_texts = crop_ocr_texts(all_questions.values(), manifest) if ocr_text else None
+
     # 生成 JSON
-    generate_exam_json(year, all_questions)
+    generate_exam_json(year, all_questions, ocr_texts)
 
     return all_questions
 
 
-def generate_exam_json(year, questions_dict):
-    """生成試卷 JSON 檔案"""
+def generate_exam_json(year, questions_dict, ocr_texts=None):
+    """
+    生成試卷 JSON 檔案
+    ocr_texts: {圖片路徑: 文字}，提供時每題加上 ocrText
+    """
+    # 以內容雜湊命名的網址（見 asset_manifest.py）
+    assets = load_asset_manifest()
+
     exam_data = {
         "title": f"{year}年感染症專科醫師甄審筆試",
         "year": int(year),
@@ -236,15 +336,14 @@ def generate_exam_json(year, questions_dict):
     sorted_questions = sorted(questions_dict.items(), key=lambda x: x[0])
 
     for idx, (qnum, img_path) in enumerate(sorted_questions):
-        rel_path = img_path.relative_to(BASE_DIR / "public")
-        url_path = "/" + str(rel_path).replace("\\", "/")
+        image_url, image_urls = question_urls(year, qnum, img_path, assets)
 
         question = {
             "order": idx,
             "content": f"第 {qnum} 題",
             "type": "CHOICE",
-            "imageUrl": url_path,
-            "imageUrls": [url_path],
+            "imageUrl": image_url,
+            "imageUrls": image_urls,
             "options": [
                 {"text": "A", "order": 0},
                 {"text": "B", "order": 1},
@@ -255,14 +354,16 @@ def generate_exam_json(year, questions_dict):
             "correctAnswer": "",
             "answerExplanation": ""
         }
+        if ocr_texts is not None:
+            question["ocrText"] = ocr_texts.get(img_path) or None
         exam_data["questions"].append(question)
 
     # 儲存 JSON
     output_path = DATA_DIR / f"exam_{year}.json"
-    with open(output_path, 'w', encoding='utf-8') as f:
-        json.dump(exam_data, f, ensure_ascii=False, indent=2)
-
-    print(f"已生成 JSON: {output_path}")
+    if write_json_if_changed(output_path, exam_data):
+        print(f"已生成 JSON: {output_path}")
+    else:
+        print(f"JSON 未變更: {output_path}")
 
 
 def main():
@@ -285,13 +386,37 @@ def main():
     # 先處理一個年份測試
     years = ['2020']
 
+    # 建置清單：頁面未變更就不再呼叫 API（加上 --force 可全部重新分析）
+    manifest = BuildManifest()
+    if '--force' in sys.argv[1:]:
+        manifest.entries.clear()
+
+    # --trim: 裁掉題目四周的空白，保留 DEFAULT_TRIM_PAD 像素邊距（--trim-pad N 可調整邊距）
+    trim_pad = None
+    if '--trim-pad' in sys.argv[1:]:
+        trim_pad = int(sys.argv[sys.argv.index('--trim-pad') + 1])
+    elif '--trim' in sys.argv[1:]:
+        trim_pad = DEFAULT_TRIM_PAD
+
+    # --variants: 另外產生 WebP / AVIF 多尺寸版本，imageUrls 改用 WebP
+    # --ocr-text: 由頁面 OCR 的字詞框組出每題的 ocrText（OCR 快取中沒有的頁面會另外以 EasyOCR 整頁辨識，需要安裝 easyocr）
+    # --workers N: 裁切行程數（預設為 CPU 核心數，1 表示不使用行程池）
+    workers = int(sys.argv[sys.argv.index('--workers') + 1]) if '--workers' in sys.argv[1:] else None
+
     for year in years:
         try:
-            process_year_with_claude(year, api_key)
+            process_year_with_claude(
+                year, api_key, manifest, lossless='--lossless' in sys.argv[1:], workers=workers,
+                variants='--variants' in sys.argv[1:], trim_pad=trim_pad, ocr_text='--ocr-text' in sys.argv[1:]
+            )
         except Exception as e:
             print(f"\nERROR - {year}: {e}")
             import traceback
             traceback.print_exc()
+        manifest.save()
+
+    print(f"\n建置清單: {manifest.summary()}")
+    print(f"裁切: {stats_summary()}")
 
     # 複製 JSON 到 public
     print("\n複製 JSON 到 public 目錄...")
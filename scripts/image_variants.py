@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+題目圖片的 WebP / AVIF 多尺寸版本
+裁切結果為全解析度 quality=95 JPEG，網頁只需要顯示寬度的圖片；
+這裡為每張題目圖片產生數種寬度的 WebP（Pillow 支援時另加 AVIF），
+編碼品質以二分搜尋找出 SSIM 達到 TARGET_SSIM 的最低值
+
+每年的 questions 目錄會寫入 variants.json：
+{"q001.jpg": {"sha256": 來源雜湊, "variants": [{"url", "format", "width", "height", "quality", "ssim", "bytes"}, ...]}}
+generate_exam_json 以 image_urls() 讀取，將 imageUrls 換成 PREFERRED_FORMAT / PREFERRED_WIDTH 的版本；
+題目圖片在產生版本之後又被重新裁切時（雜湊不符），仍使用原本的 JPEG
+"""
+
+import io
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image, features
+
+from build_manifest import BuildManifest, file_digest, params_digest, write_json_if_changed
+
+# 設定路徑
+BASE_DIR = Path(__file__).parent.parent
+PUBLIC_DIR = BASE_DIR / "public"
+
+VARIANTS_FILE = "variants.json"
+
+# 產生的寬度（超過原圖寬度的改為原圖寬度，不放大；全解析度仍由原本的 JPEG 提供）
+VARIANT_WIDTHS = (480, 960)
+
+# 編碼品質：SSIM（灰階，11x11 高斯視窗）達到目標的最低品質，以 QUALITY_STEP 為單位搜尋
+TARGET_SSIM = 0.995
+QUALITY_RANGE = (30, 95)
+QUALITY_STEP = 5
+
+# imageUrls 使用的版本（題目卡片的顯示寬度）
+PREFERRED_FORMAT = "webp"
+PREFERRED_WIDTH = 960
+
+# 各格式的編碼參數
+ENCODE_OPTIONS = {
+    "webp": {"method": 4},
+    "avif": {"speed": 8},
+}
+
+
+def variant_formats() -> List[str]:
+    """可用的輸出格式（AVIF 需要 Pillow 支援）"""
+    return [fmt for fmt in ("webp", "avif") if features.check(fmt)]
+
+
+def ssim(reference: np.ndarray, test: np.ndarray) -> float:
+    """平均 SSIM（Wang et al. 2004，灰階 uint8，11x11 高斯視窗 σ=1.5）"""
+    c1 = (0.01 * 255) ** 2
+    c2 = (0.03 * 255) ** 2
+
+    a = reference.astype(np.float32)
+    b = test.astype(np.float32)
+
+    def blur(x):
+        return cv2.GaussianBlur(x, (11, 11), 1.5)
+
+    mu_a, mu_b = blur(a), blur(b)
+    var_a = blur(a * a) - mu_a * mu_a
+    var_b = blur(b * b) - mu_b * mu_b
+    cov = blur(a * b) - mu_a * mu_b
+
+    ssim_map = ((2 * mu_a * mu_b + c1) * (2 * cov + c2)) / ((mu_a * mu_a + mu_b * mu_b + c1) * (var_a + var_b + c2))
+    return float(ssim_map.mean())
+
+
+def _encode(image: Image.Image, fmt: str, quality: int) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, fmt.upper(), quality=quality, **ENCODE_OPTIONS.get(fmt, {}))
+    return buffer.getvalue()
+
+
+def encode_for_ssim(image: Image.Image, fmt: str, target: float = TARGET_SSIM) -> Tuple[bytes, int, float]:
+    """
+    在 QUALITY_RANGE 內（以 QUALITY_STEP 為單位）二分搜尋 SSIM >= target 的最低品質
+    返回: (編碼結果, 品質, SSIM)；最高品質仍未達標時返回最高品質的結果
+    """
+    reference = np.asarray(image.convert('L'))
+    qualities = list(range(QUALITY_RANGE[0], QUALITY_RANGE[1] + 1, QUALITY_STEP))
+    low, high = 0, len(qualities) - 1
+    best = None
+    last = None
+
+    while low <= high:
+        mid = (low + high) // 2
+        data = _encode(image, fmt, qualities[mid])
+        with Image.open(io.BytesIO(data)) as decoded:
+            score = ssim(reference, np.asarray(decoded.convert('L')))
+        last = (data, qualities[mid], score)
+
+        if score >= target:
+            best = last
+            high = mid - 1
+        else:
+            low = mid + 1
+
+    if best is None:
+        # 最高品質仍未達標（最後一次嘗試必為最高品質）
+        best = last
+
+    return best
+
+
+def variant_widths(width: int) -> List[int]:
+    """原圖寬度為 width 時要產生的寬度（遞增、不重複、不放大）"""
+    return sorted({min(w, width) for w in VARIANT_WIDTHS})
+
+
+def variant_path(image_path: Path, width: int, fmt: str) -> Path:
+    """q001.jpg -> q001.w960.webp"""
+    return image_path.with_name(f"{image_path.stem}.w{width}.{fmt}")
+
+
+def public_url(path: Path) -> str:
+    """public/ 之下檔案的網址"""
+    return "/" + Path(path).resolve().relative_to(PUBLIC_DIR.resolve()).as_posix()
+
+
+def write_variants(image_path: Path, formats: List[str], target: float = TARGET_SSIM) -> List[Dict]:
+    """
+    產生一張題目圖片的所有版本
+    返回: [{"url", "format", "width", "height", "quality", "ssim", "bytes"}, ...]
+    """
+    records = []
+
+    with Image.open(image_path) as img:
+        source = img.convert('RGB')
+
+    for width in variant_widths(source.width):
+        height = max(1, round(source.height * width / source.width))
+        resized = source if width == source.width else source.resize((width, height), Image.LANCZOS)
+
+        for fmt in formats:
+            data, quality, score = encode_for_ssim(resized, fmt, target)
+            output_path = variant_path(image_path, width, fmt)
+            output_path.write_bytes(data)
+            records.append({
+                "url": public_url(output_path),
+                "format": fmt,
+                "width": width,
+                "height": height,
+                "quality": quality,
+                "ssim": round(score, 5),
+                "bytes": len(data),
+            })
+
+    return records
+
+
+def build_variants(
+    image_paths: List[Path],
+    manifest: BuildManifest = None,
+    workers: int = None,
+    target: float = TARGET_SSIM,
+) -> Dict[Path, List[Dict]]:
+    """
+    為多張題目圖片產生 WebP / AVIF 版本，並更新各目錄的 variants.json
+    manifest: 建置清單，圖片與參數都未變更時沿用上次的結果
+    workers: 行程數（預設為 CPU 核心數）
+    返回: {圖片路徑: 版本列表}
+    """
+    formats = variant_formats()
+    results: Dict[Path, List[Dict]] = {}
+    pending = {}
+
+    for image_path in image_paths:
+        stage_key = f"image_variants/{public_url(image_path)}"
+        stage_inputs = None
+
+        if manifest is not None:
+            stage_inputs = params_digest(manifest.digest(image_path), formats, VARIANT_WIDTHS, target, QUALITY_RANGE, QUALITY_STEP, ENCODE_OPTIONS)
+            if manifest.is_fresh(stage_key, stage_inputs):
+                manifest.mark_skipped()
+                results[image_path] = manifest.meta(stage_key)['variants']
+                continue
+
+        pending[image_path] = (stage_key, stage_inputs)
+
+    start_time = time.perf_counter()
+    workers = min(workers or os.cpu_count() or 1, max(1, len(pending)))
+
+    def collect(image_path, records):
+        results[image_path] = records
+        if manifest is not None:
+            stage_key, stage_inputs = pending[image_path]
+            manifest.record(stage_key, stage_inputs, [variant_path(image_path, r['width'], r['format']) for r in records], {'variants': records})
+
+    if workers == 1:
+        for image_path in pending:
+            try:
+                collect(image_path, write_variants(image_path, formats, target))
+            except Exception as e:
+                print(f"  錯誤: 產生 {image_path.name} 的圖片版本失敗: {e}")
+    elif pending:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(write_variants, image_path, formats, target): image_path for image_path in pending}
+            for future in as_completed(futures):
+                try:
+                    collect(futures[future], future.result())
+                except Exception as e:
+                    print(f"  錯誤: 產生 {futures[future].name} 的圖片版本失敗: {e}")
+
+    if pending:
+        elapsed = time.perf_counter() - start_time
+        print(f"  圖片版本: {len(pending)} 張（{', '.join(formats)}），耗時 {elapsed:.2f} 秒 "
+              f"({len(pending) / max(elapsed, 1e-9):.1f} 張/秒)，沿用 {len(image_paths) - len(pending)} 張")
+
+    # 每個目錄一份 variants.json（保留目錄中其他圖片的紀錄）
+    by_dir: Dict[Path, Dict[str, Dict]] = {}
+    for image_path, records in results.items():
+        entry = {"sha256": file_digest(image_path), "variants": records}
+        by_dir.setdefault(image_path.parent, {})[image_path.name] = entry
+
+    for directory, entries in by_dir.items():
+        variants = load_variants(directory)
+        variants.update(entries)
+        write_json_if_changed(directory / VARIANTS_FILE, dict(sorted(variants.items())))
+
+    return results
+
+
+def load_variants(directory: Path) -> Dict[str, Dict]:
+    """讀取目錄的 variants.json，沒有時返回空字典"""
+    path = Path(directory) / VARIANTS_FILE
+    if not path.exists():
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def preferred_variant(records: List[Dict]) -> Optional[Dict]:
+    """PREFERRED_FORMAT 中寬度最接近且不小於 PREFERRED_WIDTH 的版本（都較小時取最寬的）"""
+    candidates = [r for r in records if r['format'] == PREFERRED_FORMAT]
+    if not candidates:
+        return None
+    wide_enough = [r for r in candidates if r['width'] >= PREFERRED_WIDTH]
+    if wide_enough:
+        return min(wide_enough, key=lambda r: r['width'])
+    return max(candidates, key=lambda r: r['width'])
+
+
+def image_urls(image_path: Path, variants: Dict[str, Dict] = None) -> List[str]:
+    """
+    題目的 imageUrls：variants.json 有這張圖片（且雜湊相符）的紀錄時使用偏好的 WebP 版本，否則使用原本的 JPEG
+    variants: 已讀取的 variants.json（省略時讀取圖片所在目錄的檔案）
+    """
+    if variants is None:
+        variants = load_variants(Path(image_path).parent)
+
+    entry = variants.get(Path(image_path).name)
+    if entry is not None and Path(image_path).exists() and entry['sha256'] == file_digest(image_path):
+        variant = preferred_variant(entry['variants'])
+        if variant is not None:
+            return [variant['url']]
+
+    return [public_url(image_path)]
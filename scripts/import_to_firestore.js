@@ -57,6 +57,7 @@ async function importExam(examData) {
         type: question.type,
         imageUrl: question.imageUrl || null,
         imageUrls: question.imageUrls || [],
+        ocrText: question.ocrText || null,
         options: question.options || [],
         correctAnswer: question.correctAnswer || null,
         answerExplanation: question.answerExplanation || null,
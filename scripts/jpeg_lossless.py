@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+JPEG 無損裁切
+題目多半是整頁寬的水平區塊，起點落在 MCU（最小編碼單元）邊界時，
+可以用 jpegtran -crop 直接複製 DCT 係數，不需要解碼再以 quality=95 重新編碼，
+省下 CPU 也不會多一次畫質損失
+
+PNG 來源、起點未對齊 MCU 或系統沒有 jpegtran 時，改用原本的解碼裁切方式
+需要 libjpeg-turbo 的 jpegtran（Ubuntu: apt install libjpeg-turbo-progs）
+"""
+
+import shutil
+import subprocess
+from collections import Counter
+from pathlib import Path
+from typing import Optional, Tuple
+
+from PIL import Image
+
+from page_store import PageStore, shared_store
+
+JPEG_QUALITY = 95
+
+# 本次執行各種裁切方式的次數
+crop_stats = Counter()
+
+_jpegtran: Optional[str] = None
+_jpegtran_checked = False
+
+
+def jpegtran_path() -> Optional[str]:
+    """jpegtran 的路徑，找不到時返回 None（只檢查一次）"""
+    global _jpegtran, _jpegtran_checked
+    if not _jpegtran_checked:
+        _jpegtran = shutil.which("jpegtran")
+        _jpegtran_checked = True
+    return _jpegtran
+
+
+def jpeg_geometry(image_path: Path) -> Optional[Tuple[Tuple[int, int], Tuple[int, int]]]:
+    """
+    讀取 JPEG 檔頭
+    返回: ((寬, 高), (MCU 寬, MCU 高))；不是 JPEG 時返回 None
+    """
+    with Image.open(image_path) as img:
+        if img.format != 'JPEG':
+            return None
+
+        # layer: [(元件 id, 水平取樣, 垂直取樣, 量化表), ...]，MCU 為 8 x 最大取樣倍數
+        layers = getattr(img, 'layer', None) or [(1, 1, 1, 0)]
+        mcu_width = 8 * max(h for _, h, _, _ in layers)
+        mcu_height = 8 * max(v for _, _, v, _ in layers)
+        return img.size, (mcu_width, mcu_height)
+
+
+def snap_box(box: Tuple[int, int, int, int], mcu: Tuple[int, int]) -> Tuple[int, int, int, int]:
+    """將裁切範圍的左上角往左、往上對齊到 MCU 邊界（最多多出 MCU 寬/高 - 1 像素）"""
+    x1, y1, x2, y2 = box
+    return (x1 - x1 % mcu[0], y1 - y1 % mcu[1], x2, y2)
+
+
+def lossless_crop(image_path: Path, box: Tuple[int, int, int, int], output_path: Path, snap: bool = True) -> Optional[Tuple[int, int, int, int]]:
+    """
+    以 jpegtran 無損裁切 (x1, y1, x2, y2)，座標會限制在頁面範圍內
+    snap: 左上角未對齊 MCU 時往左上對齊；False 時未對齊就放棄
+    返回: 實際裁切的範圍（對齊後），失敗時返回 None（不會留下輸出檔案）
+    """
+    jpegtran = jpegtran_path()
+    if jpegtran is None:
+        return None
+
+    geometry = jpeg_geometry(image_path)
+    if geometry is None:
+        return None
+
+    (width, height), mcu = geometry
+    x1, y1, x2, y2 = box
+    x1, y1, x2, y2 = max(0, x1), max(0, y1), min(width, x2), min(height, y2)
+    if x2 <= x1 or y2 <= y1:
+        return None
+
+    if snap:
+        x1, y1, x2, y2 = snap_box((x1, y1, x2, y2), mcu)
+    elif x1 % mcu[0] or y1 % mcu[1]:
+        return None
+
+    result = subprocess.run(
+        [
+            jpegtran, "-crop", f"{x2 - x1}x{y2 - y1}+{x1}+{y1}",
+            "-copy", "none", "-optimize",
+            "-outfile", str(output_path), str(image_path)
+        ],
+        capture_output=True
+    )
+    if result.returncode != 0:
+        Path(output_path).unlink(missing_ok=True)
+        return None
+
+    return (x1, y1, x2, y2)
+
+
+def write_crop(
+    image_path: Path,
+    box: Tuple[int, int, int, int],
+    output_path: Path,
+    lossless: bool = False,
+    store: PageStore = None,
+    quality: int = JPEG_QUALITY,
+) -> Tuple[str, Tuple[int, int, int, int]]:
+    """
+    裁切並儲存一個題目區域 (x1, y1, x2, y2)，不計入 crop_stats（供工作行程使用）
+    lossless: 先嘗試無損裁切（左上角對齊 MCU），不適用時改用解碼裁切
+    store: 解碼裁切使用的頁面快取（預設為共用快取）
+    返回: ('lossless' 或 'reencode', 實際裁切的範圍)
+    """
+    if lossless:
+        cropped_box = lossless_crop(image_path, box, output_path)
+        if cropped_box is not None:
+            return 'lossless', cropped_box
+
+    store = store or shared_store()
+    store.crop(image_path, box).save(output_path, 'JPEG', quality=quality)
+
+    width, height = store.size(image_path)
+    x1, y1, x2, y2 = box
+    return 'reencode', (max(0, x1), max(0, y1), min(width, x2), min(height, y2))
+
+
+def save_crop(
+    image_path: Path,
+    box: Tuple[int, int, int, int],
+    output_path: Path,
+    lossless: bool = False,
+    store: PageStore = None,
+    quality: int = JPEG_QUALITY,
+) -> str:
+    """write_crop 並計入本次執行的裁切統計"""
+    mode, _ = write_crop(image_path, box, output_path, lossless, store, quality)
+    crop_stats[mode] += 1
+    return mode
+
+
+def stats_summary() -> str:
+    return f"無損裁切 {crop_stats['lossless']} 張，解碼後重新編碼 {crop_stats['reencode']} 張"
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+OCR 結果快取
+每次執行 crop_questions.py、crop_questions_v2.py 或 process_pdf.py 都會重新 OCR 每一頁，即使只是調整閾值或重新裁切
+這裡以 SQLite（scripts/.cache/ocr_cache.sqlite）記錄完整的字詞框輸出，鍵值為
+(圖片內容雜湊, 引擎, 語言, 前處理參數)；所有 OCR 呼叫先查快取，同樣的輸入不會 OCR 兩次
+
+- 圖片內容雜湊：來源頁面的 SHA-256（與建置清單相同），頁面內容變更時自然失效
+- 前處理參數：影響辨識結果的所有設定（辨識區域、tesseract 參數、影像格式等），以排序過的 JSON 儲存
+- --force 只忽略建置清單，不清除 OCR 快取；需要重新辨識時刪除 ocr_cache.sqlite 即可
+"""
+
+import json
+import sqlite3
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from build_manifest import CACHE_DIR
+
+OCR_CACHE_PATH = CACHE_DIR / "ocr_cache.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS ocr_results (
+    image_sha TEXT NOT NULL,
+    engine TEXT NOT NULL,
+    language TEXT NOT NULL,
+    params TEXT NOT NULL,
+    words TEXT NOT NULL,
+    seconds REAL NOT NULL,
+    created REAL NOT NULL,
+    PRIMARY KEY (image_sha, engine, language, params)
+)
+"""
+
+
+def _params_key(params: Dict[str, Any]) -> str:
+    """前處理參數的正規化 JSON（鍵值排序，元組與串列視為相同）"""
+    return json.dumps(params or {}, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+
+
+class OcrCache:
+    """
+    以 SQLite 儲存的 OCR 結果快取
+    words 可為任何可 JSON 化的字詞框輸出（EasyOCR 的 [(bbox, 文字, 信心度), ...]、tesseract 的 image_to_data 字典）
+    """
+
+    def __init__(self, path: Path = OCR_CACHE_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # 多個腳本可能同時使用同一個快取檔案
+        self.conn = sqlite3.connect(str(self.path), timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(SCHEMA)
+        self.conn.commit()
+
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+
+    def get(self, image_sha: str, engine: str, language: str, params: Dict[str, Any] = None) -> Optional[Any]:
+        """查詢快取，沒有紀錄時返回 None"""
+        row = self.conn.execute(
+            "SELECT words, seconds FROM ocr_results WHERE image_sha = ? AND engine = ? AND language = ? AND params = ?",
+            (image_sha, engine, language, _params_key(params)),
+        ).fetchone()
+
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.saved_seconds += row[1]
+        return json.loads(row[0])
+
+    def has(self, image_sha: str, engine: str, language: str, params: Dict[str, Any] = None) -> bool:
+        """是否已有紀錄（不計入命中統計）"""
+        return self.conn.execute(
+            "SELECT 1 FROM ocr_results WHERE image_sha = ? AND engine = ? AND language = ? AND params = ?",
+            (image_sha, engine, language, _params_key(params)),
+        ).fetchone() is not None
+
+    def put(self, image_sha: str, engine: str, language: str, params: Dict[str, Any], words: Any, seconds: float = 0.0):
+        """寫入（或取代）一筆辨識結果；seconds 為辨識耗時，用來統計快取省下的時間"""
+        self.conn.execute(
+            "INSERT OR REPLACE INTO ocr_results VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (image_sha, engine, language, _params_key(params),
+             json.dumps(words, ensure_ascii=False), seconds, time.time()),
+        )
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def summary(self) -> str:
+        """命中統計"""
+        return (f"OCR 快取: 命中 {self.hits} 次（省下約 {self.saved_seconds:.1f} 秒），"
+                f"重新辨識 {self.misses} 次")
+
+
+# 各 OCR 呼叫共用的快取
+_shared_cache: Optional[OcrCache] = None
+
+
+def shared_ocr_cache() -> OcrCache:
+    """取得各 OCR 呼叫共用的快取"""
+    global _shared_cache
+    if _shared_cache is None:
+        _shared_cache = OcrCache()
+    return _shared_cache
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+常駐的 EasyOCR 辨識引擎
+建立 easyocr.Reader 時會從磁碟載入偵測與辨識模型（每次數秒），原本每頁都重新建立一次，佔掉大部分的執行時間
+這裡每個行程只建立一次 Reader：
+- workers = 1：在目前行程中載入一次，頁面使用共用頁面快取（之後裁切不必再解碼）
+- workers > 1：行程池的每個工作行程啟動時各載入一次模型，之後分批處理頁面
+
+模型載入時間與每頁辨識時間分開統計（summary()）
+辨識結果記錄在 OCR 快取（ocr_cache.py），同一頁不會辨識兩次
+
+使用方式:
+    with OcrEngine(workers=2) as engine:
+        results = engine.readtext_batch(pages)   # {頁面: [(bbox, 文字, 信心度), ...]}
+    print(engine.summary())
+"""
+
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from build_manifest import BuildManifest, file_digest
+from ocr_cache import OcrCache, shared_ocr_cache
+from page_store import PageStore, init_worker_store, shared_store, shared_store_settings
+
+# 預設辨識語言
+DEFAULT_LANGUAGES = ('ch_tra', 'en')
+
+# 每批送到工作行程的頁面數
+DEFAULT_BATCH_SIZE = 4
+
+# OCR 快取中的引擎名稱與前處理參數（readtext 直接辨識整頁 RGB）
+CACHE_ENGINE = 'easyocr'
+CACHE_PARAMS = {'image': 'rgb'}
+
+# 目前行程中已建立的 Reader 與其模型載入時間（秒），鍵值為 (語言, gpu)
+_readers: Dict[tuple, object] = {}
+_load_seconds: Dict[tuple, float] = {}
+
+
+def import_easyocr():
+    """匯入 easyocr（未安裝時自動安裝）"""
+    try:
+        import easyocr
+    except ImportError:
+        print("正在安裝 EasyOCR，請稍候...")
+        subprocess.check_call([sys.executable, "-m", "pip", "install", "easyocr"])
+        import easyocr
+    return easyocr
+
+
+def get_reader(languages: Tuple[str, ...] = DEFAULT_LANGUAGES, gpu: bool = False):
+    """取得目前行程的 Reader（第一次呼叫時載入模型，第一次執行還會下載模型）"""
+    key = (tuple(languages), gpu)
+    if key not in _readers:
+        easyocr = import_easyocr()
+        start_time = time.perf_counter()
+        _readers[key] = easyocr.Reader(list(languages), gpu=gpu, verbose=False)
+        _load_seconds[key] = time.perf_counter() - start_time
+    return _readers[key]
+
+
+def _plain_results(results) -> List[Tuple[List[List[int]], str, float]]:
+    """將 readtext 的結果轉成一般的 Python 型別（numpy 數值無法直接 JSON 化，跨行程傳遞也較小）"""
+    return [
+        ([[int(x), int(y)] for x, y in bbox], str(text), float(conf))
+        for bbox, text, conf in results
+    ]
+
+
+def _init_worker(languages: Tuple[str, ...], gpu: bool, store_settings: tuple):
+    """工作行程啟動時建立頁面快取（沿用主行程的設定）並載入模型"""
+    init_worker_store(*store_settings)
+    get_reader(languages, gpu)
+
+
+def _read_batch(paths: List[Path], languages: Tuple[str, ...], gpu: bool, store: PageStore = None) -> Tuple[int, float, List[Tuple[Path, list, float]]]:
+    """
+    辨識一批頁面
+    返回: (行程 ID, 該行程的模型載入秒數, [(頁面, 辨識結果, 辨識秒數), ...])；無法讀取的頁面結果為 None
+    """
+    reader = get_reader(languages, gpu)
+    store = store or shared_store()
+
+    pages = []
+    for path in paths:
+        try:
+            page = store.rgb(path)
+        except OSError:
+            pages.append((path, None, 0.0))
+            continue
+
+        start_time = time.perf_counter()
+        results = _plain_results(reader.readtext(page))
+        pages.append((path, results, time.perf_counter() - start_time))
+
+    return os.getpid(), _load_seconds[(tuple(languages), gpu)], pages
+
+
+class OcrEngine:
+    """常駐的 OCR 引擎：Reader 在引擎存在期間只載入一次（每個行程一個）"""
+
+    def __init__(self, workers: int = 1, languages: Tuple[str, ...] = DEFAULT_LANGUAGES, gpu: bool = False, batch_size: int = DEFAULT_BATCH_SIZE,
+                 cache: OcrCache = None, manifest: BuildManifest = None):
+        """
+        workers: 工作行程數；1 表示在目前行程中辨識
+        batch_size: 每批送到工作行程的頁面數
+        cache: OCR 結果快取（預設為共用快取）
+        manifest: 建置清單，用來取得已快取的頁面雜湊（省略時重新計算）
+        """
+        self.workers = max(1, workers or 1)
+        self.languages = tuple(languages)
+        self.gpu = gpu
+        self.batch_size = batch_size
+        self.cache = cache if cache is not None else shared_ocr_cache()
+        self.manifest = manifest
+        self._executor = None
+
+        # 統計：各行程的模型載入秒數、辨識頁數與辨識總秒數
+        self.load_seconds: Dict[int, float] = {}
+        self.pages = 0
+        self.inference_seconds = 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """關閉行程池（已載入的模型隨工作行程釋放）"""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def _pool(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=_init_worker,
+                initargs=(self.languages, self.gpu, shared_store_settings()),
+            )
+        return self._executor
+
+    def _digest(self, path: Path) -> str:
+        return self.manifest.digest(path) if self.manifest is not None else file_digest(path)
+
+    def _collect(self, batch_result, results: Dict[Path, list], digests: Dict[Path, str]):
+        pid, load_seconds, pages = batch_result
+        self.load_seconds.setdefault(pid, load_seconds)
+        for path, page_results, seconds in pages:
+            if page_results is None:
+                results[path] = []
+                continue
+            results[path] = page_results
+            self.pages += 1
+            self.inference_seconds += seconds
+            self.cache.put(digests[path], CACHE_ENGINE, '+'.join(self.languages), CACHE_PARAMS, page_results, seconds)
+
+    def readtext_batch(self, paths: List[Path]) -> Dict[Path, list]:
+        """
+        辨識多個頁面
+        返回: {頁面: [(bbox, 文字, 信心度), ...]}，bbox 為四個角的 [x, y]
+        """
+        results: Dict[Path, list] = {}
+
+        # 先查 OCR 快取，只辨識沒有紀錄的頁面
+        digests: Dict[Path, str] = {}
+        pending = []
+        for path in paths:
+            try:
+                digests[path] = self._digest(path)
+            except OSError:
+                results[path] = []
+                continue
+            cached = self.cache.get(digests[path], CACHE_ENGINE, '+'.join(self.languages), CACHE_PARAMS)
+            if cached is not None:
+                results[path] = cached
+            else:
+                pending.append(path)
+
+        if not pending:
+            return results
+
+        if self.workers == 1:
+            self._collect(_read_batch(pending, self.languages, self.gpu, shared_store()), results, digests)
+            return results
+
+        batches = [pending[i:i + self.batch_size] for i in range(0, len(pending), self.batch_size)]
+        futures = [self._pool().submit(_read_batch, batch, self.languages, self.gpu) for batch in batches]
+        for batch, future in zip(batches, futures):
+            try:
+                self._collect(future.result(), results, digests)
+            except Exception as e:
+                print(f"  錯誤: OCR {batch[0].name} 等 {len(batch)} 頁失敗: {e}")
+        return results
+
+    def readtext(self, path: Path) -> list:
+        """辨識單一頁面"""
+        return self.readtext_batch([path]).get(path, [])
+
+    def summary(self) -> str:
+        """模型載入與辨識時間的統計"""
+        load_total = sum(self.load_seconds.values())
+        return (f"OCR 模型載入 {load_total:.2f} 秒（{len(self.load_seconds)} 個行程），"
+                f"辨識 {self.pages} 頁耗時 {self.inference_seconds:.2f} 秒 "
+                f"({self.pages / max(self.inference_seconds, 1e-9):.2f} 頁/秒)")
@@ -7,6 +7,7 @@
  * 3. 執行此腳本： node scripts/organize_images.js [year]
  */
 
+const crypto = require('crypto');
 const fs = require('fs');
 const path = require('path');
 
@@ -34,6 +35,7 @@ function getQuestionImages(year) {
   // 讀取所有圖片檔案
   const files = fs.readdirSync(questionsDir)
     .filter(f => /\.(png|jpg|jpeg)$/i.test(f))
+    .filter(f => !HASHED_NAME.test(f))  // 以內容雜湊命名的副本（見 asset_manifest.py）
     .sort();
 
   if (files.length === 0) {
@@ -47,7 +49,74 @@ function getQuestionImages(year) {
   });
 }
 
+// image_variants.py 產生的 WebP 版本（與 PREFERRED_FORMAT / PREFERRED_WIDTH 相同）
+const PREFERRED_FORMAT = 'webp';
+const PREFERRED_WIDTH = 960;
+
+// asset_manifest.py 產生的以內容雜湊命名的檔案：q001.<SHA-256 前 12 字元>.jpg
+const HASHED_NAME = /\.[0-9a-f]{12}\.[^.]+$/;
+
+function fileDigest(filePath) {
+  return crypto.createHash('sha256').update(fs.readFileSync(filePath)).digest('hex');
+}
+
+function loadAssetManifest(year) {
+  const manifestPath = path.join(IMAGES_DIR, 'manifest.json');
+  if (!fs.existsSync(manifestPath)) {
+    return {};
+  }
+  return JSON.parse(fs.readFileSync(manifestPath, 'utf8'))[year] || {};
+}
+
+function publishedUrls(imageUrl, entry) {
+  // manifest.json 的紀錄指向這張圖片目前的內容時，使用以雜湊命名的網址
+  if (!entry) {
+    return null;
+  }
+  const stem = path.basename(imageUrl, path.extname(imageUrl));
+  const digest = fileDigest(path.join(PUBLIC_DIR, imageUrl)).slice(0, 12);
+  if (path.basename(entry.imageUrl) !== `${stem}.${digest}${path.extname(imageUrl)}`) {
+    return null;
+  }
+  return entry;
+}
+
+function loadVariants(year) {
+  const variantsPath = path.join(IMAGES_DIR, year, 'questions', 'variants.json');
+  if (!fs.existsSync(variantsPath)) {
+    return {};
+  }
+  return JSON.parse(fs.readFileSync(variantsPath, 'utf8'));
+}
+
+function preferredImageUrls(imageUrl, variants) {
+  // variants.json 有這張圖片且雜湊相符時使用 WebP 版本，否則使用原圖
+  const file = path.basename(imageUrl);
+  const entry = variants[file];
+  if (!entry) {
+    return [imageUrl];
+  }
+
+  if (fileDigest(path.join(PUBLIC_DIR, imageUrl)) !== entry.sha256) {
+    return [imageUrl];
+  }
+
+  const candidates = entry.variants.filter(v => v.format === PREFERRED_FORMAT);
+  if (candidates.length === 0) {
+    return [imageUrl];
+  }
+
+  const wideEnough = candidates.filter(v => v.width >= PREFERRED_WIDTH);
+  const variant = wideEnough.length > 0
+    ? wideEnough.reduce((a, b) => (b.width < a.width ? b : a))
+    : candidates.reduce((a, b) => (b.width > a.width ? b : a));
+  return [variant.url];
+}
+
 function generateExamData(year, imageUrls) {
+  const variants = loadVariants(year);
+  const assets = loadAssetManifest(year);
+
   const examData = {
     title: `${year}年感染症專科醫師甄審筆試`,
     year: parseInt(year),
@@ -56,12 +125,13 @@ function generateExamData(year, imageUrls) {
   };
 
   imageUrls.forEach((imageUrl, index) => {
+    const published = publishedUrls(imageUrl, assets[String(index + 1)]);
     const question = {
       order: index,
       content: `第 ${index + 1} 題`,
       type: "CHOICE",
-      imageUrl: imageUrl,
-      imageUrls: [imageUrl],
+      imageUrl: published ? published.imageUrl : imageUrl,
+      imageUrls: published ? published.imageUrls : preferredImageUrls(imageUrl, variants),
       options: [
         { text: "A", order: 0 },
         { text: "B", order: 1 },
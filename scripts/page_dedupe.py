@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+重複頁面偵測
+his/image/<年份>/ 中有些頁面以不同檔名重複存放（例如 2020 的 14.jpg、15.jpg、16.jpg 與 2020_Page6.jpg 完全相同），
+每個 OCR、Claude 分析與裁切階段都會重複處理
+這裡以內容雜湊（SHA-256）在昂貴的處理階段之前將位元組完全相同的頁面合併成一頁
+
+感知雜湊（dHash）相近的頁面只在執行本腳本時列出，不會合併：
+整頁的 dHash 與縮圖平均差異對整行文字的差異不敏感（換掉一段 80px 的文字帶仍然判定相近），
+合併後裁切與 OCR 會改用另一頁的內容
+dHash 記錄在建置清單中（不計入重建統計），頁面未變更時不會重新計算
+
+使用方式: python scripts/page_dedupe.py [年份 ...]
+"""
+
+import sys
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from build_manifest import BuildManifest, file_digest, params_digest
+from page_store import PageStore, shared_store
+
+# 設定路徑
+BASE_DIR = Path(__file__).parent.parent
+SOURCE_DIR = BASE_DIR / "his" / "image"
+
+# dHash 大小（DHASH_SIZE x DHASH_SIZE 位元）
+DHASH_SIZE = 16
+
+# 近似重複的判斷門檻
+DHASH_MAX_DISTANCE = 8
+NEAR_DUP_SCALE = 8
+NEAR_DUP_MAX_MAD = 2.0
+
+
+class PageHash(NamedTuple):
+    sha256: str
+    dhash: int
+    size: tuple
+
+
+def dhash(gray: np.ndarray, hash_size: int = DHASH_SIZE) -> int:
+    """差異雜湊：縮成 (hash_size + 1) x hash_size，比較水平相鄰像素的亮度"""
+    small = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA).astype(np.int16)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def page_hash(path: Path, manifest: BuildManifest = None, store: PageStore = None) -> PageHash:
+    """
+    計算頁面的內容雜湊與感知雜湊
+    manifest: 建置清單，頁面未變更時直接使用記錄的 dHash，不必解碼
+    """
+    store = store or shared_store()
+    sha = manifest.digest(path) if manifest is not None else file_digest(path)
+
+    # 以內容雜湊為鍵值，同樣內容的頁面只計算一次
+    stage_key = f"page_dedupe/{sha}"
+    stage_inputs = params_digest(DHASH_SIZE)
+
+    if manifest is not None:
+        cached = manifest.meta(stage_key, stage_inputs)
+        if cached is not None:
+            return PageHash(sha, int(cached['dhash'], 16), tuple(cached['size']))
+
+    gray = store.gray(path)
+    result = PageHash(sha, dhash(gray), (gray.shape[1], gray.shape[0]))
+
+    if manifest is not None:
+        manifest.cache_meta(stage_key, stage_inputs, {'dhash': f"{result.dhash:x}", 'size': list(result.size)})
+
+    return result
+
+
+def _near_identical(a: Path, b: Path, store: PageStore) -> bool:
+    """以 1/NEAR_DUP_SCALE 縮圖的平均絕對差確認近似重複"""
+    small_a = store.downsampled(a, NEAR_DUP_SCALE)
+    small_b = store.downsampled(b, NEAR_DUP_SCALE)
+    if small_a.shape != small_b.shape:
+        return False
+    return float(np.mean(cv2.absdiff(small_a, small_b))) <= NEAR_DUP_MAX_MAD
+
+
+def dedupe_pages(paths: List[Path], manifest: BuildManifest = None) -> Dict[Path, Path]:
+    """
+    找出位元組完全相同的頁面
+    返回: {頁面: 代表頁面}，每一頁都有一項；代表頁面為同一組中在 paths 裡最先出現的頁面
+    """
+    canonical: Dict[Path, Path] = {}
+    by_sha: Dict[str, Path] = {}
+
+    for path in paths:
+        sha = manifest.digest(path) if manifest is not None else file_digest(path)
+        canonical[path] = by_sha.setdefault(sha, path)
+
+    return canonical
+
+
+def similar_pages(paths: List[Path], canonical: Dict[Path, Path], manifest: BuildManifest = None, store: PageStore = None) -> List[Tuple[Path, Path, int]]:
+    """
+    找出內容不同但看起來相近的頁面（dHash 接近、尺寸相同且縮圖像素幾乎相同），只供人工檢查，不會合併
+    返回: [(頁面, 相近的代表頁面, dHash 漢明距離), ...]
+    """
+    store = store or shared_store()
+    representatives = unique_pages(paths, canonical)
+    hashes = {path: page_hash(path, manifest, store) for path in representatives}
+
+    similar = []
+    for i, path in enumerate(representatives):
+        for rep in representatives[:i]:
+            distance = bin(hashes[rep].dhash ^ hashes[path].dhash).count('1')
+            if (hashes[rep].size == hashes[path].size and distance <= DHASH_MAX_DISTANCE
+                    and _near_identical(rep, path, store)):
+                similar.append((path, rep, distance))
+                break
+
+    return similar
+
+
+def unique_pages(paths: List[Path], canonical: Dict[Path, Path]) -> List[Path]:
+    """去除重複後的頁面（保持原本順序）"""
+    return [path for path in paths if canonical[path] == path]
+
+
+def alias_groups(canonical: Dict[Path, Path]) -> Dict[Path, List[Path]]:
+    """{代表頁面: [重複的頁面, ...]}，只包含有重複的頁面"""
+    groups: Dict[Path, List[Path]] = {}
+    for path, rep in canonical.items():
+        if path != rep:
+            groups.setdefault(rep, []).append(path)
+    return groups
+
+
+def print_aliases(canonical: Dict[Path, Path], indent: str = "  "):
+    """列出被合併的重複頁面"""
+    groups = alias_groups(canonical)
+    if not groups:
+        print(f"{indent}沒有重複的頁面")
+        return
+
+    aliased = sum(len(paths) for paths in groups.values())
+    print(f"{indent}重複頁面: {aliased} 頁合併為 {len(groups)} 頁")
+    for rep, paths in groups.items():
+        print(f"{indent}  {rep.name} <- {', '.join(p.name for p in paths)}")
+
+
+def find_duplicate(path: Path, canonical: Optional[Dict[Path, Path]]) -> Optional[Path]:
+    """頁面是其他頁面的重複時返回代表頁面，否則返回 None"""
+    if canonical is None:
+        return None
+    rep = canonical.get(path, path)
+    return rep if rep != path else None
+
+
+def main():
+    """列出各年份的重複頁面與相近的頁面"""
+    if sys.platform == 'win32':
+        sys.stdout.reconfigure(encoding='utf-8')
+
+    years = sys.argv[1:] or sorted(d.name for d in SOURCE_DIR.iterdir() if d.is_dir())
+    manifest = BuildManifest()
+
+    for year in years:
+        paths = sorted(
+            p for p in (SOURCE_DIR / year).iterdir()
+            if p.suffix.lower() in ['.jpg', '.png', '.jpeg']
+        )
+        canonical = dedupe_pages(paths, manifest)
+        print(f"{year} 年: {len(paths)} 頁，不重複 {len(unique_pages(paths, canonical))} 頁")
+        print_aliases(canonical)
+
+        for path, rep, distance in similar_pages(paths, canonical, manifest):
+            print(f"  相近但內容不同（不合併，請人工確認）: {path.name} ~ {rep.name}（dHash 距離 {distance}）")
+
+    manifest.save()
+
+
+if __name__ == "__main__":
+    main()
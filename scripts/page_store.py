@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+共用的頁面解碼快取
+每一頁只解碼一次，版面分析、OCR 與裁切共用同一份 NumPy 陣列（灰階、RGB、縮圖）
+以 LRU 與位元組上限控制記憶體用量
+可選擇將灰階頁面以 .npy 存在磁碟上（以來源檔案雜湊為鍵值），之後以 memory map 開啟，
+重新執行時不必再解碼，多個行程也共用同一份作業系統頁面快取
+
+所有返回的陣列都是唯讀的，需要修改時請先 copy()
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from build_manifest import CACHE_DIR, file_digest
+
+# 預設快取上限（RGB 1143x1664 約 5.7 MB/頁，灰階約 1.9 MB/頁）
+DEFAULT_BUDGET_MB = 512
+
+# 磁碟灰階頁面快取（可直接刪除整個目錄）
+PAGE_CACHE_DIR = CACHE_DIR / "pages"
+
+
+def _resident_bytes(array: np.ndarray) -> int:
+    """陣列佔用的記憶體；memory map 由作業系統管理，不計入快取上限"""
+    return 0 if isinstance(array, np.memmap) else array.nbytes
+
+
+class PageStore:
+    """
+    頁面解碼快取
+    鍵值為 (檔案路徑, 修改時間, 大小, 種類)，檔案被修改後會重新解碼
+    rgb:  以 Pillow 解碼（與原本 Image.open 裁切的像素相同）
+    gray: 由快取的 RGB 轉換，不再重新解碼
+    downsampled: 灰階縮圖（INTER_AREA）
+    disk_cache: 灰階頁面另存為 PAGE_CACHE_DIR/<來源 SHA-256>.npy，之後以唯讀 memory map 開啟
+    可在多個執行緒間共用（解碼在鎖外進行）
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_BUDGET_MB * 1024 * 1024, disk_cache: bool = False, cache_dir: Path = PAGE_CACHE_DIR):
+        self.max_bytes = max_bytes
+        self.disk_cache = disk_cache
+        self.cache_dir = Path(cache_dir)
+        self.disk_hits = 0
+        self.digests = {}
+        self.entries: "OrderedDict[Tuple, np.ndarray]" = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.decodes = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def _key(self, path: Path, kind: Tuple) -> Tuple:
+        stat = os.stat(path)
+        return (str(Path(path).resolve()), stat.st_mtime_ns, stat.st_size) + kind
+
+    def _get(self, key: Tuple) -> Optional[np.ndarray]:
+        with self.lock:
+            array = self.entries.get(key)
+            if array is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return array
+
+    def _put(self, key: Tuple, array: np.ndarray) -> np.ndarray:
+        """放入快取；多個執行緒同時解碼同一頁時沿用先放入的那一份"""
+        array.setflags(write=False)
+        with self.lock:
+            if key in self.entries:
+                return self.entries[key]
+
+            self.entries[key] = array
+            self.nbytes += _resident_bytes(array)
+
+            # 超過上限時淘汰最久未使用的項目（至少保留剛放入的這一項）
+            while self.nbytes > self.max_bytes and len(self.entries) > 1:
+                _, evicted = self.entries.popitem(last=False)
+                self.nbytes -= _resident_bytes(evicted)
+                self.evictions += 1
+
+        return array
+
+    def rgb(self, path: Path) -> np.ndarray:
+        """RGB 頁面 (H, W, 3)"""
+        key = self._key(path, ('rgb',))
+        array = self._get(key)
+        if array is None:
+            with Image.open(path) as img:
+                array = np.asarray(img.convert('RGB'))
+            self.decodes += 1
+            array = self._put(key, array)
+        return array
+
+    def gray(self, path: Path) -> np.ndarray:
+        """灰階頁面 (H, W)"""
+        key = self._key(path, ('gray',))
+        array = self._get(key)
+        if array is None:
+            if self.disk_cache:
+                array = self._put(key, self._gray_from_disk(path, key))
+            else:
+                array = self._put(key, cv2.cvtColor(self.rgb(path), cv2.COLOR_RGB2GRAY))
+        return array
+
+    def _digest(self, path: Path, key: Tuple) -> str:
+        """來源檔案的 SHA-256（同一個路徑、修改時間與大小只計算一次）"""
+        stat_key = key[:3]
+        if stat_key not in self.digests:
+            self.digests[stat_key] = file_digest(path)
+        return self.digests[stat_key]
+
+    def _gray_from_disk(self, path: Path, key: Tuple) -> np.ndarray:
+        """從磁碟快取以 memory map 開啟灰階頁面，沒有快取時解碼並寫入"""
+        cache_path = self.cache_dir / f"{self._digest(path, key)}.npy"
+
+        if cache_path.exists():
+            try:
+                array = np.load(cache_path, mmap_mode='r')
+                self.disk_hits += 1
+                return array
+            except (OSError, ValueError):
+                print(f"警告: 頁面快取損毀，重新解碼: {cache_path}")
+
+        gray = cv2.cvtColor(self.rgb(path), cv2.COLOR_RGB2GRAY)
+
+        # 先寫暫存檔再取代，避免其他行程讀到寫到一半的檔案
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = cache_path.with_suffix(f'.{os.getpid()}.{threading.get_ident()}.tmp')
+        with open(tmp_path, 'wb') as f:
+            np.save(f, gray)
+        os.replace(tmp_path, cache_path)
+
+        return np.load(cache_path, mmap_mode='r')
+
+    def downsampled(self, path: Path, scale: int) -> np.ndarray:
+        """縮小為 1/scale 的灰階頁面"""
+        key = self._key(path, ('gray', scale))
+        array = self._get(key)
+        if array is None:
+            gray = self.gray(path)
+            height, width = gray.shape
+            array = self._put(key, cv2.resize(
+                gray, (max(1, width // scale), max(1, height // scale)),
+                interpolation=cv2.INTER_AREA
+            ))
+        return array
+
+    def size(self, path: Path) -> Tuple[int, int]:
+        """頁面尺寸 (寬, 高)；頁面不在快取中時只讀取檔頭，不解碼"""
+        key = self._key(path, ('rgb',))
+        with self.lock:
+            array = self.entries.get(key)
+        if array is not None:
+            height, width = array.shape[:2]
+            return width, height
+
+        with Image.open(path) as img:
+            return img.size
+
+    def crop(self, path: Path, box: Tuple[int, int, int, int]) -> Image.Image:
+        """
+        裁切頁面的一個區域 (x1, y1, x2, y2)，座標會限制在頁面範圍內
+        只複製裁切範圍的像素
+        """
+        array = self.rgb(path)
+        height, width = array.shape[:2]
+        x1, y1, x2, y2 = box
+        x1, x2 = max(0, x1), min(width, x2)
+        y1, y2 = max(0, y1), min(height, y2)
+        return Image.fromarray(array[y1:y2, x1:x2])
+
+    def release(self, path: Path):
+        """從快取移除一頁的所有陣列（RGB、灰階、縮圖），用完即丟的頁面不必等到 LRU 淘汰"""
+        resolved = str(Path(path).resolve())
+        with self.lock:
+            for key in [key for key in self.entries if key[0] == resolved]:
+                self.nbytes -= _resident_bytes(self.entries.pop(key))
+
+    def summary(self) -> str:
+        summary = (
+            f"解碼 {self.decodes} 頁，命中 {self.hits} 次，未命中 {self.misses} 次，"
+            f"淘汰 {self.evictions} 項，目前 {self.nbytes / 1024 / 1024:.1f} MB"
+        )
+        if self.disk_cache:
+            summary += f"，磁碟快取命中 {self.disk_hits} 頁"
+        return summary
+
+
+_shared_store: Optional[PageStore] = None
+
+
+def shared_store() -> PageStore:
+    """取得各處理階段共用的頁面快取"""
+    global _shared_store
+    if _shared_store is None:
+        _shared_store = PageStore()
+    return _shared_store
+
+
+def configure_shared_store(budget_mb: int, disk_cache: bool = False) -> PageStore:
+    """以指定的位元組上限（與是否使用磁碟快取）重新建立共用的頁面快取"""
+    global _shared_store
+    _shared_store = PageStore(budget_mb * 1024 * 1024, disk_cache=disk_cache)
+    return _shared_store
+
+
+def shared_store_settings() -> Tuple[int, bool, Path]:
+    """共用頁面快取的設定 (位元組上限, 是否使用磁碟快取, 磁碟快取目錄)，傳給行程池的工作行程"""
+    store = shared_store()
+    return store.max_bytes, store.disk_cache, store.cache_dir
+
+
+def init_worker_store(max_bytes: int, disk_cache: bool = False, cache_dir: Path = PAGE_CACHE_DIR):
+    """
+    行程池的 initializer：以主行程的設定建立工作行程的共用頁面快取
+    使用磁碟快取時，各工作行程以 memory map 開啟同一份 .npy，共用作業系統的頁面快取
+    """
+    global _shared_store
+    _shared_store = PageStore(max_bytes, disk_cache=disk_cache, cache_dir=cache_dir)
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+頁面字詞框索引與題目文字
+Question.ocrText 原本由 run-ocr.js 對每張裁切好的題目圖片再做一次 OCR（另外 clean-ocr.js 清理），
+但 crop_questions_v2.py 辨識題號時已經對整頁做過 OCR
+這裡將整頁的字詞框（OCR 快取中的 EasyOCR 結果，沒有時以 OcrEngine 辨識整頁一次）放進依 y 排序的空間索引，
+再依 crops.json 記錄的裁切範圍查詢範圍內的字詞，組成每題的 ocrText，不再對題目圖片做第二次 OCR
+
+字詞以中心點是否落在裁切範圍內判斷；同一行的字詞依 x 排序，中文字之間不加空白
+"""
+
+import re
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Tuple
+
+import numpy as np
+
+from build_manifest import BASE_DIR, BuildManifest
+from crop_executor import load_crop_index
+from ocr_engine import OcrEngine
+
+# 信心度低於此值的字詞不列入
+MIN_WORD_CONF = 0.3
+
+# 兩個字詞的垂直重疊超過較矮者高度的此比例時視為同一行
+LINE_OVERLAP_RATIO = 0.5
+
+CJK = re.compile(r'[　-〿㐀-鿿＀-￯]')
+
+
+class Word(NamedTuple):
+    x1: int
+    y1: int
+    x2: int
+    y2: int
+    text: str
+    conf: float
+
+
+def words_from_easyocr(results) -> List[Word]:
+    """將 EasyOCR 的 [(bbox 四個角, 文字, 信心度), ...] 轉成外接矩形的字詞框"""
+    words = []
+    for bbox, text, conf in results:
+        if not str(text).strip() or conf < MIN_WORD_CONF:
+            continue
+        xs = [point[0] for point in bbox]
+        ys = [point[1] for point in bbox]
+        words.append(Word(int(min(xs)), int(min(ys)), int(max(xs)), int(max(ys)), str(text).strip(), float(conf)))
+    return words
+
+
+class WordIndex:
+    """
+    一頁字詞框的空間索引
+    字詞依中心點的 y 排序，查詢時以二分搜尋找出 y 範圍內的字詞，再以 x 篩選
+    （題目範圍多為整行寬的橫條，y 方向的篩選已排除大部分字詞）
+    """
+
+    def __init__(self, words: List[Word]):
+        centers_y = np.array([(w.y1 + w.y2) / 2 for w in words], dtype=np.float64)
+        order = np.argsort(centers_y, kind='stable')
+        self.words = [words[i] for i in order]
+        self.centers_y = centers_y[order]
+        self.centers_x = np.array([(w.x1 + w.x2) / 2 for w in self.words], dtype=np.float64)
+
+    def __len__(self) -> int:
+        return len(self.words)
+
+    def query(self, box: Tuple[int, int, int, int]) -> List[Word]:
+        """中心點落在 (x1, y1, x2, y2) 內的字詞"""
+        x1, y1, x2, y2 = box
+        start = int(np.searchsorted(self.centers_y, y1, side='left'))
+        end = int(np.searchsorted(self.centers_y, y2, side='left'))
+        xs = self.centers_x[start:end]
+        hits = np.flatnonzero((xs >= x1) & (xs < x2))
+        return [self.words[start + i] for i in hits.tolist()]
+
+    def text(self, box: Tuple[int, int, int, int]) -> str:
+        """範圍內的文字（依閱讀順序）"""
+        return assemble_text(self.query(box))
+
+
+def _join(left: str, right: str) -> str:
+    """中文字之間不加空白，其餘以空白分隔"""
+    if CJK.match(left[-1]) or CJK.match(right[0]):
+        return left + right
+    return left + ' ' + right
+
+
+def assemble_text(words: List[Word]) -> str:
+    """將字詞依行分組（垂直重疊），每行依 x 排序後組成文字，行與行以換行分隔"""
+    lines: List[List[Word]] = []
+    for word in sorted(words, key=lambda w: (w.y1 + w.y2) / 2):
+        if lines:
+            last = lines[-1]
+            top = max(min(w.y1 for w in last), word.y1)
+            bottom = min(max(w.y2 for w in last), word.y2)
+            shorter = min(max(w.y2 for w in last) - min(w.y1 for w in last), word.y2 - word.y1)
+            if shorter > 0 and bottom - top >= shorter * LINE_OVERLAP_RATIO:
+                last.append(word)
+                continue
+        lines.append([word])
+
+    texts = []
+    for line in lines:
+        text = ''
+        for word in sorted(line, key=lambda w: w.x1):
+            text = _join(text, word.text) if text else word.text
+        texts.append(text)
+    return '\n'.join(texts)
+
+
+def build_indexes(pages: Iterable[Path], engine: OcrEngine) -> Dict[Path, WordIndex]:
+    """
+    為多個頁面建立字詞索引
+    頁面的 OCR 結果優先取自 OCR 快取（crop_questions_v2.py 已辨識過的頁面），沒有時整頁辨識一次
+    """
+    pages = list(dict.fromkeys(pages))
+    results = engine.readtext_batch(pages)
+    return {page: WordIndex(words_from_easyocr(results.get(page, []))) for page in pages}
+
+
+def crop_ocr_texts(image_paths: Iterable[Path], manifest: BuildManifest = None, workers: int = 1) -> Dict[Path, str]:
+    """
+    由頁面字詞框組出每張題目圖片的 ocrText
+    image_paths: 題目圖片（同目錄的 crops.json 必須有裁切範圍紀錄，沒有紀錄的圖片不列入結果）
+    workers: 需要辨識整頁時的 OCR 行程數
+    返回: {圖片路徑: 文字}；跨頁題目的各部分依序以換行連接
+    """
+    image_paths = list(image_paths)
+    crop_indexes = {}
+    regions: Dict[Path, List[Tuple[Path, Tuple[int, int, int, int]]]] = {}
+
+    for image_path in image_paths:
+        directory = image_path.parent
+        if directory not in crop_indexes:
+            crop_indexes[directory] = load_crop_index(directory)
+        entry = crop_indexes[directory].get(image_path.name)
+        if entry:
+            regions[image_path] = [(BASE_DIR / part['page'], tuple(part['box'])) for part in entry]
+
+    if not regions:
+        return {}
+
+    with OcrEngine(workers, manifest=manifest) as engine:
+        indexes = build_indexes((page for parts in regions.values() for page, _ in parts), engine)
+
+    texts = {
+        image_path: '\n'.join(filter(None, (indexes[page].text(box) for page, box in parts)))
+        for image_path, parts in regions.items()
+    }
+
+    print(f"  題目文字: {len(texts)} 題，由 {len(indexes)} 頁的字詞框組成"
+          f"（{sum(len(index) for index in indexes.values())} 個字詞）")
+    return texts
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+PDF 文字層讀取
+直接從 PDF 取得每個字詞的位置，找出題號與每題的垂直範圍
+有文字層的頁面不需要點陣化後再做 OCR
+
+使用 poppler 的 pdftotext -bbox（pdf2image 已經需要 poppler）
+"""
+
+import re
+import sys
+import html
+import subprocess
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+# 題號格式: "12." "12、" "12．"，可能與題目文字黏在一起，例如 "12.下列何者"
+QUESTION_NUMBER_PATTERN = re.compile(r'^(\d{1,3})[\.、．]')
+
+# 題號只會出現在頁面左側
+MAX_NUMBER_X_RATIO = 0.25
+
+# 少於這個字數視為沒有文字層（例如只有頁碼的掃描頁）
+MIN_WORDS_FOR_TEXT_LAYER = 5
+
+PAGE_PATTERN = re.compile(r'<page width="([\d.]+)" height="([\d.]+)">(.*?)</page>', re.S)
+WORD_PATTERN = re.compile(
+    r'<word xMin="([\d.]+)" yMin="([\d.]+)" xMax="([\d.]+)" yMax="([\d.]+)">(.*?)</word>', re.S
+)
+
+
+def extract_word_boxes(pdf_path: Path, first_page: Optional[int] = None, last_page: Optional[int] = None) -> Dict[int, Dict]:
+    """
+    讀取 PDF 文字層的字詞位置
+    返回: {頁碼: {"width": 寬, "height": 高, "words": [(文字, x0, y0, x1, y1), ...]}}
+    座標單位為點 (1/72 英吋)，原點在左上角
+    """
+    first_page = first_page or 1
+    cmd = ["pdftotext", "-bbox", "-f", str(first_page)]
+    if last_page is not None:
+        cmd += ["-l", str(last_page)]
+    cmd += [str(pdf_path), "-"]
+
+    result = subprocess.run(cmd, check=True, capture_output=True)
+    content = result.stdout.decode('utf-8', errors='replace')
+
+    pages = {}
+    for offset, match in enumerate(PAGE_PATTERN.finditer(content)):
+        words = [
+            (html.unescape(text), float(x0), float(y0), float(x1), float(y1))
+            for x0, y0, x1, y1, text in WORD_PATTERN.findall(match.group(3))
+        ]
+        pages[first_page + offset] = {
+            'width': float(match.group(1)),
+            'height': float(match.group(2)),
+            'words': words,
+        }
+
+    return pages
+
+
+def has_text_layer(text_page: Optional[Dict]) -> bool:
+    """頁面是否有可用的文字層"""
+    return bool(text_page) and len(text_page['words']) >= MIN_WORDS_FOR_TEXT_LAYER
+
+
+def find_question_numbers(text_page: Dict, max_number: int = 100) -> List[Tuple[int, float]]:
+    """
+    從文字層找出題號
+    返回: [(題號, 題號頂端 y 座標), ...]，依 y 座標排序
+    """
+    max_x = text_page['width'] * MAX_NUMBER_X_RATIO
+    numbers = {}
+
+    for text, x0, y0, x1, y1 in text_page['words']:
+        if x0 > max_x:
+            continue
+
+        match = QUESTION_NUMBER_PATTERN.match(text.strip())
+        if not match:
+            continue
+
+        num = int(match.group(1))
+        if 1 <= num <= max_number and num not in numbers:
+            numbers[num] = y0
+
+    return sorted(numbers.items(), key=lambda x: x[1])
+
+
+def question_ranges(text_page: Dict, scale: float = 1.0, padding: float = 5.0, max_number: int = 100) -> List[Tuple[int, int, int]]:
+    """
+    計算每題在頁面上的垂直範圍
+    scale: 點到像素的換算倍率（DPI / 72）
+    返回: [(題號, y_start, y_end), ...]（像素）
+    """
+    numbers = find_question_numbers(text_page, max_number)
+    page_bottom = text_page['height']
+
+    ranges = []
+    for i, (num, y) in enumerate(numbers):
+        y_start = max(0.0, y - padding)
+        y_end = numbers[i + 1][1] - padding if i < len(numbers) - 1 else page_bottom
+        ranges.append((num, int(y_start * scale), int(y_end * scale)))
+
+    return ranges
+
+
+def main():
+    """列出每頁找到的題號範圍"""
+    if sys.platform == 'win32':
+        sys.stdout.reconfigure(encoding='utf-8')
+
+    if len(sys.argv) < 2:
+        print("Usage: python scripts/pdf_text_layer.py <pdf>")
+        sys.exit(1)
+
+    pages = extract_word_boxes(Path(sys.argv[1]))
+    for page_num, text_page in pages.items():
+        if not has_text_layer(text_page):
+            print(f"第 {page_num} 頁: 沒有文字層")
+            continue
+
+        ranges = question_ranges(text_page)
+        print(f"第 {page_num} 頁: {len(text_page['words'])} 個字詞，題號 {[r[0] for r in ranges]}")
+        for num, y_start, y_end in ranges:
+            print(f"  題目 {num}: y={y_start}-{y_end} pt")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,95 +6,592 @@ PDF 試卷處理腳本
 
 import os
 import sys
-import json
+import argparse
 import re
+import shutil
+import subprocess
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
-from typing import List, Dict, Tuple
-from pdf2image import convert_from_path
+from typing import List, Dict, Optional, Tuple
+from pdf2image import convert_from_path, pdfinfo_from_path
 from PIL import Image
 
+from build_manifest import BuildManifest, params_digest, write_json_if_changed
+from ocr_cache import shared_ocr_cache
+from pdf_text_layer import extract_word_boxes, has_text_layer, question_ranges
+
 # 設定路徑
 BASE_DIR = Path(__file__).parent.parent
 PDF_DIR = BASE_DIR / "his" / "pdf"
 OUTPUT_DIR = BASE_DIR / "public" / "images" / "exams"
 DATA_DIR = BASE_DIR / "scripts" / "output"
 
+# 點陣化設定
+DEFAULT_DPI = 200  # 高解析度
+LAYOUT_DPI = 50  # 兩階段模式中版面分析使用的低解析度
+DEFAULT_MAX_MEMORY_MB = 512  # 串流模式下同時保留在記憶體中的頁面上限
+
 # 建立輸出目錄
 OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 DATA_DIR.mkdir(parents=True, exist_ok=True)
 
 
-def extract_pages_as_images(pdf_path: Path, year: str) -> List[Path]:
-    """將 PDF 的每一頁轉換成圖片"""
+def page_size_px(pdf_path: Path, dpi: int = DEFAULT_DPI) -> Tuple[int, int, int]:
+    """
+    讀取 PDF 頁數與頁面在指定 DPI 下的像素尺寸
+    返回: (總頁數, 寬, 高)
+    """
+    info = pdfinfo_from_path(str(pdf_path))
+    total_pages = int(info.get("Pages", 0))
+
+    # "Page size" 例如 "595.276 x 841.89 pts (A4)"，單位為點 (1/72 英吋)
+    match = re.match(r'([\d.]+)\s*x\s*([\d.]+)', info.get("Page size", ""))
+    if match:
+        width_pt, height_pt = float(match.group(1)), float(match.group(2))
+    else:
+        width_pt, height_pt = 595.0, 842.0  # 預設 A4
+
+    width_px = int(width_pt / 72 * dpi) + 1
+    height_px = int(height_pt / 72 * dpi) + 1
+    return total_pages, width_px, height_px
+
+
+def estimate_page_bytes(pdf_path: Path, dpi: int = DEFAULT_DPI) -> Tuple[int, int]:
+    """
+    估算單頁點陣化後佔用的記憶體
+    返回: (總頁數, 每頁位元組數)
+    """
+    total_pages, width_px, height_px = page_size_px(pdf_path, dpi)
+
+    # RGB 每像素 3 bytes；poppler 輸出緩衝與 PIL 影像各佔一份
+    return total_pages, width_px * height_px * 3 * 2
+
+
+def extract_pages_as_images(
+    pdf_path: Path,
+    year: str,
+    dpi: int = DEFAULT_DPI,
+    streaming: bool = True,
+    max_memory_mb: int = DEFAULT_MAX_MEMORY_MB,
+    manifest: BuildManifest = None,
+) -> List[Path]:
+    """
+    將 PDF 的每一頁轉換成圖片
+
+    streaming=True 時每次只點陣化一小段頁面並立即寫入磁碟，
+    同時在記憶體中的頁數由 max_memory_mb 決定（至少一頁）
+    提供 manifest 時，PDF 與 DPI 未變更就直接沿用上次的頁面圖片
+    """
     print(f"處理 PDF: {pdf_path}")
 
+    if manifest is not None:
+        stage_key = rasterize_stage_key(year)
+        stage_inputs = rasterize_stage_inputs(manifest, pdf_path, dpi)
+        if manifest.is_fresh(stage_key, stage_inputs):
+            manifest.mark_skipped()
+            image_paths = manifest.outputs(stage_key)
+            print(f"  PDF 未變更，沿用 {len(image_paths)} 頁既有圖片")
+            return image_paths
+
     year_dir = OUTPUT_DIR / year
     year_dir.mkdir(exist_ok=True)
 
     # 使用 pdf2image 轉換 PDF
     # 需要安裝 poppler: https://github.com/oschwartz10612/poppler-windows/releases/
     try:
-        images = convert_from_path(
-            str(pdf_path),
-            dpi=200,  # 高解析度
-            fmt='png'
-        )
+        total_pages, page_bytes = estimate_page_bytes(pdf_path, dpi)
     except Exception as e:
-        print(f"錯誤: 無法轉換 PDF。請確認已安裝 poppler。")
+        print(f"錯誤: 無法讀取 PDF。請確認已安裝 poppler。")
         print(f"下載位置: https://github.com/oschwartz10612/poppler-windows/releases/")
         raise e
 
+    if streaming:
+        window = max(1, (max_memory_mb * 1024 * 1024) // page_bytes)
+        print(f"  串流模式: 共 {total_pages} 頁，每批 {window} 頁 (上限 {max_memory_mb} MB)")
+    else:
+        # 一次轉換全部頁面（整份 PDF 都會留在記憶體中）
+        window = max(1, total_pages)
+
     image_paths = []
 
-    for page_num, image in enumerate(images):
-        # 儲存圖片
-        img_path = year_dir / f"page_{page_num + 1:03d}.png"
-        image.save(str(img_path), 'PNG')
-        image_paths.append(img_path)
+    for first_page in range(1, total_pages + 1, window):
+        last_page = min(total_pages, first_page + window - 1)
+        for page_num, img_path in rasterize_page_range(pdf_path, year, first_page, last_page, dpi):
+            image_paths.append(img_path)
+            print(f"  已轉換第 {page_num}/{total_pages} 頁")
 
-        print(f"  已轉換第 {page_num + 1}/{len(images)} 頁")
+    if manifest is not None:
+        manifest.record(stage_key, stage_inputs, image_paths)
 
     print(f"完成！共 {len(image_paths)} 頁")
     return image_paths
 
 
-def detect_question_regions(image_path: Path) -> List[Tuple[int, int, int, int]]:
+def rasterize_stage_key(year: str) -> str:
+    return f"process_pdf/rasterize/{year}"
+
+
+def rasterize_stage_inputs(manifest: BuildManifest, pdf_path: Path, dpi: int) -> str:
+    return params_digest(manifest.digest(pdf_path), dpi)
+
+
+def rasterize_page_range(
+    pdf_path: Path,
+    year: str,
+    first_page: int,
+    last_page: int,
+    dpi: int = DEFAULT_DPI,
+) -> List[Tuple[int, Path]]:
+    """
+    點陣化 PDF 的指定頁碼範圍並寫入 page_NNN.png
+    返回: [(頁碼, 圖片路徑), ...]
+
+    這個函數也是平行模式中每個工作行程執行的單位
+    """
+    year_dir = OUTPUT_DIR / year
+    year_dir.mkdir(parents=True, exist_ok=True)
+
+    images = convert_from_path(
+        str(pdf_path),
+        dpi=dpi,
+        fmt='png',
+        first_page=first_page,
+        last_page=last_page
+    )
+
+    results = []
+    for offset, image in enumerate(images):
+        # 儲存圖片
+        page_num = first_page + offset
+        img_path = year_dir / f"page_{page_num:03d}.png"
+        image.save(str(img_path), 'PNG')
+        image.close()
+        results.append((page_num, img_path))
+
+    # 釋放這一批的影像，再處理下一批
+    del images
+    return results
+
+
+def plan_rasterize_jobs(
+    pdf_files: List[Path],
+    workers: int,
+    dpi: int = DEFAULT_DPI,
+    max_memory_mb: int = DEFAULT_MAX_MEMORY_MB,
+) -> Tuple[List[Tuple[Path, str, int, int]], Dict[str, int]]:
+    """
+    將所有 PDF 切成 (PDF, 頁碼範圍) 工作
+    每個工作行程的記憶體上限為 max_memory_mb / workers
+    無法讀取頁面資訊的 PDF 會列出錯誤並跳過（不出現在工作與頁數中）
+    返回: ([(pdf 路徑, 年份, 起始頁, 結束頁), ...], {年份: 總頁數})
+    """
+    per_worker_bytes = (max_memory_mb * 1024 * 1024) // max(1, workers)
+
+    jobs = []
+    page_counts = {}
+
+    for pdf_path in pdf_files:
+        year = pdf_path.stem
+        try:
+            total_pages, page_bytes = estimate_page_bytes(pdf_path, dpi)
+        except Exception as e:
+            print(f"  錯誤: 無法讀取 {pdf_path.name}，跳過: {e}")
+            continue
+        page_counts[year] = total_pages
+
+        # 頁數少的 PDF 也要切小，讓所有核心都有工作
+        window = max(1, per_worker_bytes // page_bytes)
+        window = min(window, max(1, -(-total_pages // workers)))
+
+        for first_page in range(1, total_pages + 1, window):
+            last_page = min(total_pages, first_page + window - 1)
+            jobs.append((pdf_path, year, first_page, last_page))
+
+    return jobs, page_counts
+
+
+def rasterize_all_parallel(
+    pdf_files: List[Path],
+    workers: int = None,
+    dpi: int = DEFAULT_DPI,
+    max_memory_mb: int = DEFAULT_MAX_MEMORY_MB,
+    manifest: BuildManifest = None,
+) -> Dict[str, List[Path]]:
+    """
+    使用行程池平行點陣化多份 PDF
+    返回: {年份: [依頁碼排序的圖片路徑]}，無法完整轉換的年份不會出現在結果中
+    """
+    workers = workers or os.cpu_count() or 1
+
+    # 未變更的 PDF 直接沿用上次的頁面圖片
+    unchanged = {}
+    if manifest is not None:
+        for pdf_path in pdf_files:
+            year = pdf_path.stem
+            if manifest.is_fresh(rasterize_stage_key(year), rasterize_stage_inputs(manifest, pdf_path, dpi)):
+                manifest.mark_skipped()
+                unchanged[year] = manifest.outputs(rasterize_stage_key(year))
+                print(f"  {pdf_path.name} 未變更，沿用 {len(unchanged[year])} 頁既有圖片")
+        pdf_files = [p for p in pdf_files if p.stem not in unchanged]
+
+    jobs, page_counts = plan_rasterize_jobs(pdf_files, workers, dpi, max_memory_mb)
+    total_pages = sum(page_counts.values())
+
+    if not jobs:
+        return dict(sorted(unchanged.items()))
+
+    print(f"平行點陣化: {len(page_counts)} 份 PDF，共 {total_pages} 頁，"
+          f"{len(jobs)} 個工作，{workers} 個行程")
+
+    pages_by_year = {year: {} for year in page_counts}
+    failed_years = set()
+    done_pages = 0
+    start_time = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(rasterize_page_range, pdf_path, year, first, last, dpi): (year, first, last)
+            for pdf_path, year, first, last in jobs
+        }
+
+        for future in as_completed(futures):
+            year, first, last = futures[future]
+            try:
+                results = future.result()
+            except Exception as e:
+                print(f"  錯誤: {year} 第 {first}-{last} 頁轉換失敗: {e}")
+                failed_years.add(year)
+                continue
+
+            for page_num, img_path in results:
+                pages_by_year[year][page_num] = img_path
+
+            done_pages += len(results)
+            elapsed = time.perf_counter() - start_time
+            print(f"  {year} 第 {first}-{last} 頁完成 "
+                  f"({done_pages}/{total_pages} 頁, {done_pages / elapsed:.1f} 頁/秒)")
+
+    elapsed = time.perf_counter() - start_time
+    print(f"完成！共 {done_pages} 頁，耗時 {elapsed:.1f} 秒 "
+          f"({done_pages / max(elapsed, 1e-9):.1f} 頁/秒)")
+
+    # 依年份、頁碼排序合併，結果與逐頁處理相同
+    results = dict(unchanged)
+    for year, pages in pages_by_year.items():
+        if year in failed_years:
+            continue
+        results[year] = [pages[page_num] for page_num in sorted(pages)]
+
+        if manifest is not None:
+            pdf_path = next(p for p in pdf_files if p.stem == year)
+            manifest.record(
+                rasterize_stage_key(year),
+                rasterize_stage_inputs(manifest, pdf_path, dpi),
+                results[year]
+            )
+
+    return dict(sorted(results.items()))
+
+
+def render_band(pdf_path: Path, page_num: int, box: Tuple[int, int, int, int], output_path: Path, dpi: int = DEFAULT_DPI):
+    """
+    只點陣化頁面中的一個區域 (x, y, width, height)，座標為指定 DPI 下的像素
+    pdf2image 沒有提供裁切參數，直接呼叫 poppler 的 pdftoppm
+    """
+    x, y, w, h = box
+    subprocess.run(
+        [
+            "pdftoppm", "-r", str(dpi),
+            "-f", str(page_num), "-l", str(page_num),
+            "-x", str(x), "-y", str(y), "-W", str(w), "-H", str(h),
+            "-png", "-singlefile",
+            str(pdf_path), str(output_path.with_suffix(''))
+        ],
+        check=True, capture_output=True
+    )
+
+
+def extract_question_bands(
+    pdf_path: Path,
+    year: str,
+    dpi: int = DEFAULT_DPI,
+    layout_dpi: int = LAYOUT_DPI,
+    manifest: BuildManifest = None,
+) -> List[Path]:
+    """
+    兩階段模式：以 layout_dpi 點陣化灰階頁面找出題目邊界，
+    再以 dpi 只點陣化要裁切的題目區域，不產生整頁的高解析度圖片
+    返回: 依序排列的題目圖片路徑
+    """
+    import numpy as np
+    from crop_questions import find_question_boundaries_in_gray
+
+    print(f"處理 PDF (兩階段): {pdf_path}")
+
+    total_pages, width_px, height_px = page_size_px(pdf_path, dpi)
+    factor = dpi / layout_dpi
+
+    year_dir = OUTPUT_DIR / year / "questions"
+    year_dir.mkdir(parents=True, exist_ok=True)
+
+    pdf_digest = manifest.digest(pdf_path) if manifest is not None else None
+    question_images = []
+
+    for page_num in range(1, total_pages + 1):
+        if manifest is not None:
+            stage_key = f"process_pdf/bands/{year}/{page_num}"
+            stage_inputs = params_digest(pdf_digest, page_num, dpi, layout_dpi, len(question_images))
+            if manifest.is_fresh(stage_key, stage_inputs):
+                manifest.mark_skipped()
+                question_images.extend(manifest.outputs(stage_key))
+                print(f"  第 {page_num}/{total_pages} 頁未變更")
+                continue
+
+        # 低解析度版面分析
+        page = convert_from_path(
+            str(pdf_path), dpi=layout_dpi, grayscale=True,
+            first_page=page_num, last_page=page_num
+        )[0]
+        gray = np.asarray(page.convert('L'))
+        page.close()
+
+        boundaries = find_question_boundaries_in_gray(
+            gray,
+            min_gap=max(1, round(30 / factor)),
+            block_size=max(3, int(11 / factor) | 1)
+        )
+
+        # 只點陣化要裁切的區域
+        page_outputs = []
+        for y1, y2, x1, x2 in boundaries:
+            top = int(y1 * factor)
+            bottom = min(height_px, int(round(y2 * factor)))
+            left = int(x1 * factor)
+            right = width_px if x2 >= gray.shape[1] else int(x2 * factor)
+            output_path = year_dir / f"q{len(question_images) + len(page_outputs) + 1:03d}.png"
+            render_band(pdf_path, page_num, (left, top, right - left, bottom - top), output_path, dpi)
+            page_outputs.append(output_path)
+
+        question_images.extend(page_outputs)
+        print(f"  已處理第 {page_num}/{total_pages} 頁: {len(page_outputs)} 題")
+
+        if manifest is not None:
+            manifest.record(stage_key, stage_inputs, page_outputs)
+
+    print(f"完成！共 {len(question_images)} 題")
+    return question_images
+
+
+def detect_question_regions(image_path: Path, text_page: Dict = None) -> List[Tuple[Optional[int], Tuple[int, int, int, int]]]:
     """
     檢測圖片中的題目區域
-    返回: [(x, y, width, height), ...]
+    返回: [(題號, (x, y, width, height)), ...]，無法得知題號時為 None
 
-    注意：這是一個簡化版本，實際可能需要更複雜的圖像處理
-    這裡假設題目是按照固定格式排列的
+    text_page: 此頁的 PDF 文字層（見 pdf_text_layer.extract_word_boxes）
+    有文字層時直接由字詞座標找出題號，沒有文字層的頁面才使用 OCR
     """
-    # 這個函數需要根據實際 PDF 格式來實作
-    # 暫時返回整頁作為一個題目
     img = Image.open(image_path)
     width, height = img.size
-    return [(0, 0, width, height)]
 
+    if has_text_layer(text_page):
+        scale = height / text_page['height']
+        return [
+            (num, (0, y_start, width, min(height, y_end) - y_start))
+            for num, y_start, y_end in question_ranges(text_page, scale=scale)
+            if y_end - y_start > 0
+        ]
+
+    # 沒有文字層：使用 OCR 偵測題號（失敗時會退回密度分析，此時沒有題號）
+    from crop_questions import detect_numbered_questions_ocr
+    return [
+        (num, (x1, y1, x2 - x1, y2 - y1))
+        for num, (y1, y2, x1, x2) in detect_numbered_questions_ocr(image_path)
+    ]
 
-def crop_questions(image_path: Path, year: str, page_num: int) -> List[Path]:
-    """裁切圖片中的各個題目"""
+
+def crop_questions(image_path: Path, year: str, page_num: int, text_page: Dict = None, next_number: int = 1) -> List[Tuple[int, Path]]:
+    """
+    裁切圖片中的各個題目
+    next_number: 無法得知題號時使用的流水號起點；題號必須遞增，
+                 小於 next_number 的題號（OCR 誤認或文字層中的其他數字）改用流水號，避免覆寫已裁切的題目
+    返回: [(題號, 圖片路徑), ...]
+    """
     img = Image.open(image_path)
-    regions = detect_question_regions(image_path)
+    regions = detect_question_regions(image_path, text_page)
 
     cropped_images = []
     year_dir = OUTPUT_DIR / year / "questions"
-    year_dir.mkdir(exist_ok=True)
+    year_dir.mkdir(parents=True, exist_ok=True)
 
-    for idx, (x, y, w, h) in enumerate(regions):
+    for num, (x, y, w, h) in regions:
         # 裁切題目
         cropped = img.crop((x, y, x + w, y + h))
 
+        if num is not None and num < next_number:
+            print(f"    警告: 題號 {num} 未接續前一題（應從 {next_number} 開始），改用流水號")
+            num = None
+
         # 儲存裁切後的圖片
-        question_num = (page_num - 1) * len(regions) + idx + 1
+        question_num = num if num is not None else next_number
+        next_number = question_num + 1
         crop_path = year_dir / f"q{question_num:03d}.png"
         cropped.save(crop_path)
-        cropped_images.append(crop_path)
+        cropped_images.append((question_num, crop_path))
 
     return cropped_images
 
 
+def split_stage(manifest: BuildManifest, year: str, page_num: int, page_img: Path, text_page: Dict, next_number: int) -> Tuple[str, str]:
+    """建置清單中分割階段的 (鍵值, 輸入)"""
+    return f"process_pdf/split/{year}/{page_num}", params_digest(manifest.digest(page_img), text_page, next_number)
+
+
+def pages_needing_ocr(year: str, page_images: List[Path], text_pages: Dict, manifest: BuildManifest = None) -> List[Path]:
+    """
+    需要以 OCR 找題號的頁面：沒有文字層、且無法沿用建置清單的頁面
+    題號接續前一頁，因此第一個需要重新分割的頁面之後全部視為需要重新分割
+    """
+    pages = []
+    next_number = 1
+    stale = manifest is None
+
+    for page_num, page_img in enumerate(page_images, start=1):
+        text_page = text_pages.get(page_num)
+        if not stale:
+            stage_key, stage_inputs = split_stage(manifest, year, page_num, page_img, text_page, next_number)
+            if manifest.is_fresh(stage_key, stage_inputs):
+                numbers = manifest.meta(stage_key)['numbers']
+                if numbers:
+                    next_number = numbers[-1] + 1
+                continue
+            stale = True
+
+        if not has_text_layer(text_page):
+            pages.append(page_img)
+
+    return pages
+
+
+def split_pages_into_questions(
+    pdf_path: Path,
+    year: str,
+    page_images: List[Path],
+    manifest: BuildManifest = None,
+    ocr_workers: int = 1,
+) -> List[Path]:
+    """
+    依題號將每頁裁切成個別題目
+    優先使用 PDF 文字層，沒有文字層的頁面才使用 OCR
+    需要 OCR 的頁面先以批次 tesseract 一次辨識（ocr_workers 個行程），再逐頁分割
+    返回: 依題號排序的題目圖片路徑
+    """
+    try:
+        text_pages = extract_word_boxes(pdf_path)
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"  警告: 無法讀取文字層，全部使用 OCR: {e}")
+        text_pages = {}
+
+    with_text = sum(1 for page in text_pages.values() if has_text_layer(page))
+    print(f"  文字層: {with_text}/{len(page_images)} 頁，其餘使用 OCR")
+
+    ocr_pages = pages_needing_ocr(year, page_images, text_pages, manifest)
+    if ocr_pages:
+        from crop_questions import prefetch_number_ocr
+        try:
+            prefetch_number_ocr(ocr_pages, manifest, ocr_workers)
+        except (OSError, subprocess.CalledProcessError) as e:
+            print(f"  警告: 批次 OCR 失敗，改為逐頁辨識: {e}")
+
+    questions = {}
+    next_number = 1
+
+    for page_num, page_img in enumerate(page_images, start=1):
+        text_page = text_pages.get(page_num)
+
+        if manifest is not None:
+            stage_key, stage_inputs = split_stage(manifest, year, page_num, page_img, text_page, next_number)
+            if manifest.is_fresh(stage_key, stage_inputs):
+                manifest.mark_skipped()
+                numbers = manifest.meta(stage_key)['numbers']
+                cropped = list(zip(numbers, manifest.outputs(stage_key)))
+            else:
+                cropped = crop_questions(page_img, year, page_num, text_page, next_number)
+                manifest.record(stage_key, stage_inputs, [p for _, p in cropped], {'numbers': [n for n, _ in cropped]})
+        else:
+            cropped = crop_questions(page_img, year, page_num, text_page, next_number)
+
+        source = "文字層" if has_text_layer(text_page) else "OCR"
+        print(f"  第 {page_num} 頁 ({source}): {len(cropped)} 題")
+
+        for num, path in cropped:
+            if num in questions:
+                print(f"  警告: 第 {page_num} 頁的題號 {num} 與先前的題目重複，{path.name} 已被覆寫")
+            questions[num] = path
+            next_number = num + 1
+
+    return [questions[num] for num in sorted(questions)]
+
+
+def _reflink(src: Path, dst: Path) -> bool:
+    """嘗試以 copy-on-write 方式複製檔案（Linux btrfs/XFS 等支援 FICLONE 的檔案系統）"""
+    try:
+        import fcntl
+    except ImportError:
+        return False
+
+    FICLONE = 0x40049409
+    try:
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        return True
+    except OSError:
+        if dst.exists():
+            dst.unlink()
+        return False
+
+
+def _same_bytes(a: Path, b: Path) -> bool:
+    """比較兩個檔案內容是否相同"""
+    if a.stat().st_size != b.stat().st_size:
+        return False
+    with open(a, 'rb') as fa, open(b, 'rb') as fb:
+        while True:
+            chunk_a = fa.read(1024 * 1024)
+            if chunk_a != fb.read(1024 * 1024):
+                return False
+            if not chunk_a:
+                return True
+
+
+def materialize_file(src: Path, dst: Path, mode: str = 'link') -> str:
+    """
+    讓 dst 與 src 內容相同，盡量不複製資料
+    mode='link': 依序嘗試硬連結、reflink，都不支援時才複製
+    mode='copy': 一律複製
+    目標已存在且內容相同時不做任何事
+    返回: 實際使用的方式 ('unchanged', 'hardlink', 'reflink', 'copy')
+    """
+    if dst.exists():
+        if os.path.samefile(src, dst) or _same_bytes(src, dst):
+            return 'unchanged'
+        dst.unlink()
+
+    if mode == 'link':
+        try:
+            os.link(src, dst)
+            return 'hardlink'
+        except OSError:
+            # 跨檔案系統或不支援硬連結
+            pass
+
+        if _reflink(src, dst):
+            return 'reflink'
+
+    shutil.copyfile(src, dst)
+    return 'copy'
+
+
 def generate_exam_data(year: str, question_images: List[Path]) -> Dict:
     """生成試卷資料結構"""
     # 將絕對路徑轉換成相對於 public/ 的路徑
@@ -133,8 +630,26 @@ def generate_exam_data(year: str, question_images: List[Path]) -> Dict:
     return exam_data
 
 
-def process_pdf(pdf_path: Path):
-    """處理單一 PDF 檔案"""
+def process_pdf(
+    pdf_path: Path,
+    streaming: bool = True,
+    max_memory_mb: int = DEFAULT_MAX_MEMORY_MB,
+    page_images: List[Path] = None,
+    manifest: BuildManifest = None,
+    link_mode: str = 'link',
+    two_pass: bool = False,
+    split: bool = False,
+    ocr_workers: int = 1,
+):
+    """
+    處理單一 PDF 檔案
+    page_images: 已由平行模式點陣化好的頁面，提供時跳過步驟 1
+    manifest: 建置清單，輸入未變更的頁面與題目會被跳過
+    link_mode: 整頁題目的產生方式，見 materialize_file；'alias' 則直接引用頁面圖片
+    two_pass: 以低解析度分析版面，只以高解析度點陣化題目區域（取代步驟 1、2）
+    split: 依題號將每頁裁切成個別題目（文字層優先，否則 OCR），而非整頁一題
+    ocr_workers: 分割時批次 tesseract 的行程數
+    """
     # 從檔名取得年份
     year = pdf_path.stem  # 例如 "2020"
 
@@ -142,42 +657,124 @@ def process_pdf(pdf_path: Path):
     print(f"處理 {year} 年試卷")
     print(f"{'='*60}\n")
 
+    if two_pass:
+        question_images = extract_question_bands(pdf_path, year, manifest=manifest)
+        return save_exam_data(year, question_images)
+
     # 步驟 1: 將 PDF 轉換成圖片
-    page_images = extract_pages_as_images(pdf_path, year)
+    if page_images is None:
+        page_images = extract_pages_as_images(
+            pdf_path, year,
+            streaming=streaming,
+            max_memory_mb=max_memory_mb,
+            manifest=manifest
+        )
 
-    # 步驟 2: 裁切各題目（暫時跳過，使用整頁）
+    # 步驟 2: 裁切各題目
     print(f"\n處理題目...")
+
+    if split:
+        question_images = split_pages_into_questions(pdf_path, year, page_images, manifest, ocr_workers)
+        print(f"完成！共 {len(question_images)} 題")
+        return save_exam_data(year, question_images)
+
     question_images = []
+    materialized = {}
 
     # 簡化版：每頁當作一題
     for idx, page_img in enumerate(page_images):
         year_dir = OUTPUT_DIR / year / "questions"
         year_dir.mkdir(parents=True, exist_ok=True)
 
-        # 複製圖片到 questions 目錄
-        import shutil
+        # alias 模式：題目直接使用頁面圖片，不產生任何檔案
+        if link_mode == 'alias':
+            question_images.append(page_img)
+            if manifest is not None:
+                manifest.record(
+                    f"process_pdf/question/{year}/{idx + 1}",
+                    params_digest(manifest.digest(page_img), link_mode),
+                    [],
+                    {'alias_of': page_img.relative_to(BASE_DIR).as_posix()}
+                )
+            continue
+
+        # 將頁面圖片放到 questions 目錄（硬連結 / reflink / 複製）
         question_path = year_dir / f"q{idx + 1:03d}.png"
-        shutil.copy(page_img, question_path)
         question_images.append(question_path)
 
+        if manifest is not None:
+            stage_key = f"process_pdf/question/{year}/{idx + 1}"
+            stage_inputs = params_digest(manifest.digest(page_img), link_mode)
+            if manifest.is_fresh(stage_key, stage_inputs):
+                manifest.mark_skipped()
+                continue
+
+        method = materialize_file(page_img, question_path, link_mode)
+        materialized[method] = materialized.get(method, 0) + 1
+
+        if manifest is not None:
+            manifest.record(stage_key, stage_inputs, [question_path])
+
     print(f"完成！共 {len(question_images)} 題")
+    if materialized:
+        print("  " + "，".join(f"{method}: {count}" for method, count in sorted(materialized.items())))
 
-    # 步驟 3: 生成資料
+    return save_exam_data(year, question_images)
+
+
+def save_exam_data(year: str, question_images: List[Path]) -> Dict:
+    """步驟 3: 生成並儲存試卷資料"""
     exam_data = generate_exam_data(year, question_images)
 
     # 儲存 JSON
     json_path = DATA_DIR / f"exam_{year}.json"
-    with open(json_path, 'w', encoding='utf-8') as f:
-        json.dump(exam_data, f, ensure_ascii=False, indent=2)
-
-    print(f"\n資料已儲存到: {json_path}")
+    if write_json_if_changed(json_path, exam_data):
+        print(f"\n資料已儲存到: {json_path}")
+    else:
+        print(f"\n資料未變更: {json_path}")
     print(f"圖片已儲存到: {OUTPUT_DIR / year}")
 
     return exam_data
 
 
+def parse_args():
+    """解析命令列參數"""
+    parser = argparse.ArgumentParser(description="PDF 試卷處理工具")
+    parser.add_argument(
+        "--max-memory-mb", type=int, default=DEFAULT_MAX_MEMORY_MB,
+        help=f"串流模式下點陣化頁面的記憶體上限 (預設 {DEFAULT_MAX_MEMORY_MB} MB)"
+    )
+    parser.add_argument(
+        "--no-streaming", action="store_true",
+        help="一次將整份 PDF 點陣化到記憶體（舊行為）"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=os.cpu_count() or 1,
+        help="平行點陣化的行程數，也是 --split 時批次 tesseract 的行程數 (預設為 CPU 核心數，1 表示逐份處理)"
+    )
+    parser.add_argument(
+        "--link-mode", choices=['link', 'copy', 'alias'], default='link',
+        help="整頁題目的產生方式: link=硬連結/reflink (預設), copy=複製, alias=直接引用頁面圖片"
+    )
+    parser.add_argument(
+        "--two-pass", action="store_true",
+        help=f"以 {LAYOUT_DPI} DPI 分析版面，只以高解析度點陣化題目區域"
+    )
+    parser.add_argument(
+        "--split", action="store_true",
+        help="依題號將每頁裁切成個別題目（優先使用 PDF 文字層，沒有文字層的頁面才使用 OCR）"
+    )
+    parser.add_argument(
+        "--force", action="store_true",
+        help="忽略建置清單，重新產生所有頁面與題目"
+    )
+    return parser.parse_args()
+
+
 def main():
     """主程式"""
+    args = parse_args()
+
     print("PDF 試卷處理工具")
     print("=" * 60)
 
@@ -197,22 +794,59 @@ def main():
     for pdf in pdf_files:
         print(f"  - {pdf.name}")
 
+    # 建置清單：記錄輸入雜湊，未變更的階段直接跳過
+    manifest = BuildManifest()
+    if args.force:
+        manifest.entries.clear()
+
+    # 平行模式：先一次點陣化所有 PDF
+    rasterized = None
+    if args.workers > 1 and not args.no_streaming and not args.two_pass:
+        print()
+        rasterized = rasterize_all_parallel(
+            pdf_files,
+            workers=args.workers,
+            max_memory_mb=args.max_memory_mb,
+            manifest=manifest
+        )
+        manifest.save()
+
     # 處理每個 PDF
     all_exams = []
     for pdf_file in pdf_files:
+        if rasterized is not None and pdf_file.stem not in rasterized:
+            print(f"\n錯誤: {pdf_file.name} 點陣化失敗，跳過")
+            continue
+
         try:
-            exam_data = process_pdf(pdf_file)
+            exam_data = process_pdf(
+                pdf_file,
+                streaming=not args.no_streaming,
+                max_memory_mb=args.max_memory_mb,
+                page_images=rasterized[pdf_file.stem] if rasterized is not None else None,
+                manifest=manifest,
+                link_mode=args.link_mode,
+                two_pass=args.two_pass,
+                split=args.split,
+                ocr_workers=args.workers
+            )
             all_exams.append(exam_data)
         except Exception as e:
             print(f"\n錯誤: 處理 {pdf_file.name} 時發生錯誤: {e}")
             import traceback
             traceback.print_exc()
 
+        # 每份 PDF 處理完就寫入清單，中斷後重跑也能跳過已完成的部分
+        manifest.save()
+
     # 生成匯總報告
     print(f"\n{'='*60}")
     print("處理完成！")
     print(f"{'='*60}")
     print(f"共處理 {len(all_exams)} 份試卷")
+    print(f"建置清單: {manifest.summary()}")
+    if args.split:
+        print(shared_ocr_cache().summary())
     print(f"\n下一步:")
     print("1. 檢查生成的圖片和 JSON 檔案")
     print("2. 在 JSON 中填寫正確答案")
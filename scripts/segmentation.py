@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+"""
+頁面分割共用模組
+以向量化的 run-length 編碼找出空白列區段，取代逐列的 Python 迴圈
+並以垂直投影偵測多欄版面，將頁面切成二維區塊
+供 crop_questions.py 與 crop_questions_simple.py 共用
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image
+
+# 批次模式一次載入的最大頁數（1143x1664 灰階約 1.9 MB/頁）
+MAX_BATCH_PAGES = 32
+
+# 尺寸分組單位（像素），同一組頁面的寬高差距在此範圍內
+SIZE_BUCKET = 32
+
+# 版面分析可用的二值化方法
+#   adaptive: cv2.adaptiveThreshold 高斯視窗（原本的做法，最慢）
+#   otsu:     在縮小的頁面上計算全域 Otsu 閾值，再套用到原圖
+#   integral: 以視窗區域平均值作為閾值（box filter 計算，與積分影像的結果相同）
+BINARIZE_METHODS = ('adaptive', 'otsu', 'integral')
+
+# 版面分欄參數（以頁寬的比例表示，與解析度無關）
+#   欄間空白的最小寬度、欄間空白中心必須落在頁面中段、每欄的最小寬度
+MIN_GUTTER_RATIO = 0.02
+GUTTER_CENTER_RANGE = (0.25, 0.75)
+MIN_COLUMN_RATIO = 0.15
+
+# 墨水比例低於此值、或低於內容欄中位數 GUTTER_RELATIVE_INK 倍的欄視為空白
+# （容許跨欄的頁首或少量雜點）
+GUTTER_INK_RATIO = 0.01
+GUTTER_RELATIVE_INK = 0.2
+
+# 每一欄的墨水總量至少要是最多那一欄的這個比例，避免把只有短行的單欄頁面誤判為雙欄
+MIN_COLUMN_INK_SHARE = 0.25
+
+# 跨越欄間空白的列至少要這麼高（像素）才視為整行區塊，過濾雜點；
+# 間隔小於頁高 SPANNING_MERGE_RATIO 的整行區塊合併成一塊
+MIN_SPANNING_ROWS = 3
+SPANNING_MERGE_RATIO = 0.02
+
+
+def find_runs(mask: np.ndarray, include_trailing: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    找出布林陣列中連續為 True 的區段
+    include_trailing=False 時忽略延伸到陣列結尾的區段（與原本逐列迴圈的行為相同）
+    返回: (起點陣列, 終點陣列)，終點不包含在區段內
+    """
+    mask = np.asarray(mask, dtype=bool)
+    padded = np.concatenate(([False], mask, [False])).view(np.int8)
+    edges = np.diff(padded)
+
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+
+    if not include_trailing and len(ends) and ends[-1] == len(mask):
+        starts, ends = starts[:-1], ends[:-1]
+
+    return starts, ends
+
+
+def find_gaps(mask: np.ndarray, min_length: int) -> List[Tuple[int, int]]:
+    """
+    找出長度至少為 min_length 的空白區段
+    mask: 每一列是否為空白
+    返回: [(gap_start, gap_end), ...]
+    """
+    starts, ends = find_runs(mask)
+    keep = (ends - starts) >= min_length
+    return list(zip(starts[keep].tolist(), ends[keep].tolist()))
+
+
+def skip_header_gap(gaps: List[Tuple[int, int]], height: int, header_ratio: float) -> Tuple[int, List[Tuple[int, int]]]:
+    """
+    第一個空白區段位於頁首範圍內時，從它之後開始切割
+    返回: (起始 y, 剩餘的空白區段)
+    """
+    if gaps and gaps[0][0] < height * header_ratio:
+        return gaps[0][1], gaps[1:]
+    return 0, gaps
+
+
+def drop_header_gaps(gaps: List[Tuple[int, int]], height: int, header_ratio: float) -> List[Tuple[int, int]]:
+    """移除所有起點位於頁首範圍內的空白區段"""
+    return [g for g in gaps if g[0] > height * header_ratio]
+
+
+def split_by_gaps(gaps: List[Tuple[int, int]], height: int, min_content: int, start_y: int = 0) -> List[Tuple[int, int]]:
+    """
+    以空白區段切割頁面，只保留高度大於 min_content 的內容區段
+    返回: [(y_start, y_end), ...]
+    """
+    gap_array = np.asarray(gaps, dtype=np.int64).reshape(-1, 2)
+
+    seg_starts = np.concatenate(([start_y], gap_array[:, 1]))
+    seg_ends = np.concatenate((gap_array[:, 0], [height]))
+    keep = (seg_ends - seg_starts) > min_content
+
+    return list(zip(seg_starts[keep].tolist(), seg_ends[keep].tolist()))
+
+
+def binarize(gray: np.ndarray, method: str = 'adaptive', block_size: int = 11, c: int = 2, downsample: int = 4) -> np.ndarray:
+    """
+    將灰階頁面二值化，文字為 255、背景為 0
+    method: 見 BINARIZE_METHODS
+    """
+    if method == 'adaptive':
+        return cv2.adaptiveThreshold(
+            gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+            cv2.THRESH_BINARY_INV, block_size, c
+        )
+
+    if method == 'otsu':
+        height, width = gray.shape
+        small = cv2.resize(
+            gray, (max(1, width // downsample), max(1, height // downsample)),
+            interpolation=cv2.INTER_AREA
+        )
+        threshold, _ = cv2.threshold(small, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        _, binary = cv2.threshold(gray, threshold, 255, cv2.THRESH_BINARY_INV)
+        return binary
+
+    if method == 'integral':
+        height, width = gray.shape
+        half = block_size // 2
+
+        # 視窗總和：以 box filter 一次算完（頁面外補 0），等同積分影像上的四角相減
+        local_mean = cv2.boxFilter(gray, cv2.CV_32F, (block_size, block_size), normalize=False, borderType=cv2.BORDER_CONSTANT)
+
+        # 除以視窗在頁面內的面積得到區域平均（邊緣處縮小視窗）；面積可拆成列數 x 欄數
+        rows = np.minimum(np.arange(height) + half + 1, height) - np.maximum(np.arange(height) - half, 0)
+        cols = np.minimum(np.arange(width) + half + 1, width) - np.maximum(np.arange(width) - half, 0)
+        local_mean /= rows.astype(np.float32)[:, None]
+        local_mean /= cols.astype(np.float32)[None, :]
+        local_mean -= c
+
+        return (gray < local_mean).view(np.uint8) * 255
+
+    raise ValueError(f"未知的二值化方法: {method}（可用: {', '.join(BINARIZE_METHODS)}）")
+
+
+def find_gutters(col_ink: np.ndarray, width: int, min_gutter: int = None) -> List[Tuple[int, int]]:
+    """
+    以垂直投影找出欄間空白
+    col_ink: 每一欄 (x) 的墨水比例（該欄有墨水的像素數 / 頁高）
+    只保留兩側都有內容、位於頁面中段、且分出的每欄都夠寬的空白區段，
+    左右頁邊的空白不算
+    返回: [(x_start, x_end), ...]
+    """
+    if min_gutter is None:
+        min_gutter = max(1, int(width * MIN_GUTTER_RATIO))
+
+    col_ink = np.asarray(col_ink[:width], dtype=np.float64)
+    content = col_ink[col_ink > GUTTER_INK_RATIO]
+    if len(content) == 0:
+        return []
+    threshold = max(GUTTER_INK_RATIO, GUTTER_RELATIVE_INK * float(np.median(content)))
+
+    starts, ends = find_runs(col_ink <= threshold)
+    centers = (starts + ends) / 2
+    keep = (
+        (starts > 0)
+        & (ends - starts >= min_gutter)
+        & (centers >= width * GUTTER_CENTER_RANGE[0])
+        & (centers <= width * GUTTER_CENTER_RANGE[1])
+    )
+
+    gutters = []
+    left = 0
+    for x0, x1 in zip(starts[keep].tolist(), ends[keep].tolist()):
+        if x0 - left >= width * MIN_COLUMN_RATIO:
+            gutters.append((x0, x1))
+            left = x1
+
+    # 最後一欄太窄時捨棄最後一個欄間空白
+    if gutters and width - gutters[-1][1] < width * MIN_COLUMN_RATIO:
+        gutters.pop()
+
+    # 每一欄都要有相當份量的內容
+    if gutters:
+        column_ink = [col_ink[x0:x1].sum() for x0, x1 in column_spans(gutters, width)]
+        if min(column_ink) < MIN_COLUMN_INK_SHARE * max(column_ink):
+            return []
+
+    return gutters
+
+
+def column_spans(gutters: List[Tuple[int, int]], width: int) -> List[Tuple[int, int]]:
+    """將欄間空白轉換成每一欄的水平範圍 [(x_start, x_end), ...]，由左到右"""
+    edges = [0] + [x for gutter in gutters for x in gutter] + [width]
+    return list(zip(edges[0::2], edges[1::2]))
+
+
+def layout_blocks(ink: np.ndarray, col_ink: np.ndarray = None, min_gutter: int = None) -> List[Tuple[int, int, int, int]]:
+    """
+    將頁面切成依閱讀順序排列的二維區塊
+    單欄頁面返回整頁；多欄頁面中，跨越欄間空白的列（頁首、整行的圖表）成為整行區塊，
+    其餘部分依欄由左到右切開
+    ink: 墨水遮罩 (H, W)，True 為有墨水
+    col_ink: 預先計算好的每欄墨水比例（省略時由 ink 計算）
+    返回: [(x1, y1, x2, y2), ...]
+    """
+    height, width = ink.shape
+    if col_ink is None:
+        col_ink = ink.mean(axis=0)
+
+    gutters = find_gutters(col_ink, width, min_gutter)
+    if not gutters:
+        return [(0, 0, width, height)]
+
+    # 找出有墨水跨過任一欄間空白的列
+    spanning = np.zeros(height, dtype=bool)
+    for x0, x1 in gutters:
+        spanning |= ink[:, x0:x1].any(axis=1)
+
+    band_starts, band_ends = find_runs(spanning, include_trailing=True)
+    keep = (band_ends - band_starts) >= MIN_SPANNING_ROWS
+
+    bands = []
+    for y0, y1 in zip(band_starts[keep].tolist(), band_ends[keep].tolist()):
+        if bands and y0 - bands[-1][1] < height * SPANNING_MERGE_RATIO:
+            bands[-1] = (bands[-1][0], y1)
+        else:
+            bands.append((y0, y1))
+
+    columns = column_spans(gutters, width)
+    blocks = []
+    top = 0
+    for y0, y1 in bands + [(height, height)]:
+        if y0 > top:
+            blocks.extend((x0, top, x1, y0) for x0, x1 in columns if ink[top:y0, x0:x1].any())
+        if y1 > y0:
+            blocks.append((0, y0, width, y1))
+        top = y1
+
+    return blocks
+
+
+def find_runs_batch(masks: np.ndarray, include_trailing: bool = False) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    在 (N, L) 布林陣列的每一列中同時找出連續為 True 的區段
+    返回: (頁索引, 起點, 終點) 三個等長陣列，依頁索引、起點排序
+    """
+    masks = np.asarray(masks, dtype=bool)
+    n, length = masks.shape
+
+    padded = np.zeros((n, length + 2), dtype=np.int8)
+    padded[:, 1:-1] = masks
+    edges = np.diff(padded, axis=1)
+
+    # nonzero 依列優先順序返回，同一頁的起點與終點會一一對應
+    pages, starts = np.nonzero(edges == 1)
+    _, ends = np.nonzero(edges == -1)
+
+    if not include_trailing:
+        keep = ends != length
+        pages, starts, ends = pages[keep], starts[keep], ends[keep]
+
+    return pages, starts, ends
+
+
+def find_gaps_batch(masks: np.ndarray, min_length: int) -> List[List[Tuple[int, int]]]:
+    """
+    find_gaps 的批次版本
+    返回: 每頁的 [(gap_start, gap_end), ...]
+    """
+    pages, starts, ends = find_runs_batch(masks)
+    keep = (ends - starts) >= min_length
+    pages, starts, ends = pages[keep], starts[keep], ends[keep]
+
+    counts = np.bincount(pages, minlength=len(masks))
+    splits = np.cumsum(counts)[:-1]
+
+    return [
+        list(zip(s.tolist(), e.tolist()))
+        for s, e in zip(np.split(starts, splits), np.split(ends, splits))
+    ]
+
+
+def _load_gray(path: Path, loader: Callable[[Path], np.ndarray] = None) -> Optional[np.ndarray]:
+    """以 loader 讀取灰階頁面，無法讀取時返回 None"""
+    if loader is None:
+        return cv2.imread(str(path), cv2.IMREAD_GRAYSCALE)
+    try:
+        return loader(path)
+    except OSError:
+        return None
+
+
+def load_page_stacks(
+    paths: List[Path],
+    max_batch: int = MAX_BATCH_PAGES,
+    workers: int = None,
+    loader: Callable[[Path], np.ndarray] = None,
+) -> Iterator[Tuple[List[Path], np.ndarray, np.ndarray]]:
+    """
+    將尺寸相近的頁面解碼成一個 (N, H, W) 灰階陣列
+    掃描頁面的尺寸常差幾個像素，因此以 SIZE_BUCKET 像素為單位分組，
+    較小的頁面在右側與下方補 0；每批最多 max_batch 頁以限制記憶體
+    只讀取圖片標頭來分組，解碼以執行緒平行進行（cv2.imread 與 Pillow 解碼都會釋放 GIL）
+    loader: 讀取灰階頁面的函式（例如 PageStore.gray，讓之後的裁切沿用解碼結果），
+            預設直接以 cv2.imread 解碼，無法讀取時返回 None 或拋出 OSError
+    返回: (頁面路徑, 灰階陣列, 每頁實際尺寸 (N, 2) = [高, 寬])
+    """
+    groups: Dict[Tuple[int, int], List[Tuple[Path, int, int]]] = {}
+    for path in paths:
+        with Image.open(path) as img:
+            width, height = img.size
+        key = (-(-width // SIZE_BUCKET), -(-height // SIZE_BUCKET))
+        groups.setdefault(key, []).append((path, width, height))
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as executor:
+        for group in groups.values():
+            for i in range(0, len(group), max_batch):
+                batch = group[i:i + max_batch]
+                max_width = max(w for _, w, _ in batch)
+                max_height = max(h for _, _, h in batch)
+                stack = np.zeros((len(batch), max_height, max_width), dtype=np.uint8)
+
+                decoded = executor.map(lambda item: _load_gray(item[0], loader), batch)
+
+                loaded = []
+                sizes = []
+                for (path, width, height), gray in zip(batch, decoded):
+                    if gray is None:
+                        print(f"無法讀取圖片: {path}")
+                        continue
+                    stack[len(loaded), :gray.shape[0], :gray.shape[1]] = gray
+                    loaded.append(path)
+                    sizes.append(gray.shape)
+
+                yield loaded, stack[:len(loaded)], np.array(sizes, dtype=np.int64).reshape(-1, 2)
+
+
+def batch_profiles(stack: np.ndarray, sizes: np.ndarray, fill: float = 255.0) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    一次計算整批頁面的列亮度與欄亮度（以每頁實際的寬、高平均，補 0 的部分不影響結果）
+    超出頁面實際範圍的位置填入 fill（預設為白色，不會被當成內容）
+    返回: (列亮度 (N, H), 欄亮度 (N, W))
+    """
+    heights = sizes[:, 0]
+    widths = sizes[:, 1]
+
+    row_profiles = stack.sum(axis=2, dtype=np.uint32) / widths[:, None]
+    col_profiles = stack.sum(axis=1, dtype=np.uint32) / heights[:, None]
+
+    row_profiles[np.arange(stack.shape[1])[None, :] >= heights[:, None]] = fill
+    col_profiles[np.arange(stack.shape[2])[None, :] >= widths[:, None]] = fill
+
+    return row_profiles, col_profiles
+
+
+def batch_column_ink(stack: np.ndarray, sizes: np.ndarray, threshold: int, row_step: int = 4) -> np.ndarray:
+    """
+    一次計算整批頁面每一欄的墨水比例（灰階值低於 threshold 的像素比例），供 find_gutters 使用
+    只取每 row_step 列估計即可分辨欄間空白；下方補 0 的列也會低於閾值，以每頁補齊的列數扣除
+    返回: (N, W)
+    """
+    sampled = stack[:, ::row_step, :]
+    valid_rows = -(-sizes[:, 0] // row_step)
+    counts = (sampled < threshold).sum(axis=1, dtype=np.int64) - (sampled.shape[1] - valid_rows)[:, None]
+    return np.maximum(counts, 0) / valid_rows[:, None]
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+批次 tesseract 辨識
+pytesseract.image_to_data 每次呼叫都會啟動一個新的 tesseract 行程並重新載入 traineddata（chi_tra 數十 MB），
+頁數多時大部分時間花在啟動上
+這裡把整批圖片（或頁面上的區域）寫成暫存 PNG 與清單檔，交給同一個 tesseract 行程辨識，
+再依 TSV 的 page_num 欄拆回每張圖片的結果（格式與 pytesseract.Output.DICT 相同）
+
+- workers = 1：整批只啟動一個 tesseract 行程
+- workers > 1：以執行緒池將圖片分成 workers 組，每組一個 tesseract 行程；
+  每個行程以 OMP_THREAD_LIMIT 限制 OpenMP 執行緒數（CPU 核心數 / workers），避免核心被過度分配
+"""
+
+import os
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+
+from page_store import PageStore, shared_store
+
+# tesseract 執行檔（可用環境變數 TESSERACT_CMD 指定）
+TESSERACT_CMD = os.environ.get('TESSERACT_CMD', 'tesseract')
+
+# TSV 欄位（與 pytesseract.Output.DICT 的鍵值相同），除了 conf 與 text 之外都是整數
+TSV_COLUMNS = ('level', 'page_num', 'block_num', 'par_num', 'line_num', 'word_num',
+               'left', 'top', 'width', 'height', 'conf', 'text')
+
+# 一個辨識區域：頁面路徑與 (x1, y1, x2, y2)，None 表示整頁
+Region = Tuple[Path, Optional[Tuple[int, int, int, int]]]
+
+
+def _empty_data() -> Dict[str, list]:
+    return {column: [] for column in TSV_COLUMNS}
+
+
+def parse_tsv(text: str, count: int) -> List[Dict[str, list]]:
+    """
+    將 tesseract 的 TSV 輸出依 page_num 拆成每張圖片的字典
+    count: 送出的圖片數（沒有任何輸出的圖片得到空的字典）
+    """
+    pages = [_empty_data() for _ in range(count)]
+
+    for line in text.splitlines():
+        fields = line.split('\t')
+        if len(fields) < len(TSV_COLUMNS) - 1 or fields[0] == 'level':
+            continue
+        # 最後一欄文字可能是空的
+        fields += [''] * (len(TSV_COLUMNS) - len(fields))
+
+        page_index = int(fields[1]) - 1
+        if not 0 <= page_index < count:
+            continue
+
+        data = pages[page_index]
+        for column, value in zip(TSV_COLUMNS, fields):
+            if column == 'text':
+                data[column].append(value)
+            elif column == 'conf':
+                data[column].append(float(value))
+            else:
+                data[column].append(int(value))
+
+    return pages
+
+
+def run_tesseract(images: List[Path], lang: str, config: str = '', omp_threads: int = None) -> List[Dict[str, list]]:
+    """
+    以一個 tesseract 行程辨識多張圖片
+    images: 圖片檔案，依序寫入清單檔（tesseract 會逐張辨識，page_num 為清單中的順序）
+    omp_threads: OMP_THREAD_LIMIT（None 表示不限制）
+    """
+    if not images:
+        return []
+
+    env = dict(os.environ)
+    if omp_threads is not None:
+        env['OMP_THREAD_LIMIT'] = str(omp_threads)
+
+    with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False, encoding='utf-8') as f:
+        f.write('\n'.join(str(path) for path in images) + '\n')
+        list_file = f.name
+
+    try:
+        result = subprocess.run(
+            [TESSERACT_CMD, list_file, 'stdout', '-l', lang, *config.split(), 'tsv'],
+            capture_output=True, check=True, env=env,
+        )
+    finally:
+        os.unlink(list_file)
+
+    return parse_tsv(result.stdout.decode('utf-8', errors='replace'), len(images))
+
+
+def image_to_data_batch(
+    regions: List[Region],
+    lang: str = 'eng',
+    config: str = '',
+    workers: int = 1,
+    store: PageStore = None,
+) -> Tuple[List[Dict[str, list]], float]:
+    """
+    批次辨識多個區域
+    區域以灰階裁切後寫成暫存 PNG（與 pytesseract 收到 NumPy 陣列時相同），座標為區域內座標
+    workers: tesseract 行程數（執行緒池），每個行程的 OMP_THREAD_LIMIT 為 CPU 核心數 / workers
+    返回: (與 regions 順序相同的 [image_to_data 字典, ...], 辨識耗時秒數)
+    """
+    if not regions:
+        return [], 0.0
+
+    store = store or shared_store()
+    workers = max(1, min(workers or 1, len(regions)))
+
+    with tempfile.TemporaryDirectory(prefix='tesseract_batch_') as tmp_dir:
+        images = []
+        for i, (path, box) in enumerate(regions):
+            gray = store.gray(path)
+            if box is not None:
+                x1, y1, x2, y2 = box
+                gray = gray[y1:y2, x1:x2]
+            image = Path(tmp_dir) / f"{i:05d}.png"
+            cv2.imwrite(str(image), gray)
+            images.append(image)
+
+        start_time = time.perf_counter()
+
+        if workers == 1:
+            results = run_tesseract(images, lang, config)
+        else:
+            # 連續分組，保持結果順序
+            omp_threads = max(1, (os.cpu_count() or 1) // workers)
+            size = -(-len(images) // workers)
+            chunks = [images[i:i + size] for i in range(0, len(images), size)]
+            with ThreadPoolExecutor(max_workers=len(chunks)) as executor:
+                chunk_results = executor.map(lambda chunk: run_tesseract(chunk, lang, config, omp_threads), chunks)
+                results = [data for chunk in chunk_results for data in chunk]
+
+        elapsed = time.perf_counter() - start_time
+
+    return results, elapsed